@@ -13,8 +13,6 @@ import numpy as np
 import numpy.random as random
 import pandas as pd
 import torch
-import torch.nn as nn
-from torch.autograd import Variable
 import matplotlib.pyplot as plt
 from sklearn.impute import SimpleImputer
 from sklearn import preprocessing
@@ -28,7 +26,11 @@ from flim.plugin import AbstractPlugin
 from flim.plugin import plugin
 from flim.gui.dialogs import BasicAnalysisConfigDlg
 from flim import utils
-from joblib import load
+from flim.analysis.ml.runtime import (
+    RUNTIME_OPTIONS,
+    load_runtime,
+    quantize_runtime,
+)
 
 
 class AEAugmentConfigDlg(BasicAnalysisConfigDlg):
@@ -42,6 +44,8 @@ class AEAugmentConfigDlg(BasicAnalysisConfigDlg):
         selectedfeatures="All",
         modelfile="",
         device="cpu",
+        runtime="sklearn",
+        quantize=False,
         sets=1,
         add_noise=True,
         snr_db=0.0,
@@ -51,6 +55,8 @@ class AEAugmentConfigDlg(BasicAnalysisConfigDlg):
     ):
         self.modelfile = modelfile
         self.device = device
+        self.runtime = runtime
+        self.quantize = quantize
         self.sets = sets
         self.add_noise = add_noise
         self.snr_unit = (
@@ -110,6 +116,28 @@ class AEAugmentConfigDlg(BasicAnalysisConfigDlg):
             self.device_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        self.runtime_combobox = wx.ComboBox(
+            self.panel,
+            wx.ID_ANY,
+            style=wx.CB_READONLY,
+            value=self.runtime,
+            choices=RUNTIME_OPTIONS,
+        )
+        bottom_sizer.Add(
+            wx.StaticText(self.panel, label="Runtime"),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        bottom_sizer.Add(
+            self.runtime_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+        self.quantize_checkbox = wx.CheckBox(self.panel, wx.ID_ANY, label="int8")
+        self.quantize_checkbox.SetValue(self.quantize)
+        bottom_sizer.Add(
+            self.quantize_checkbox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
         self.sets_spinner = wx.SpinCtrl(
             self.panel, wx.ID_ANY, min=1, max=20, initial=self.sets
         )
@@ -195,6 +223,8 @@ class AEAugmentConfigDlg(BasicAnalysisConfigDlg):
         params = super()._get_selected()
         params["modelfile"] = self.modelfile  # self.modelfiletxt.GetLabel()
         params["device"] = self.device_combobox.GetValue()
+        params["runtime"] = self.runtime_combobox.GetValue()
+        params["quantize"] = self.quantize_checkbox.GetValue()
         params["sets"] = self.sets_spinner.GetValue()
         params["add_noise"] = self.noise_checkbox.GetValue()
         self.noise_input.Refresh()
@@ -243,9 +273,14 @@ class AEAugment(AbstractPlugin):
             {
                 "modelfile": "",
                 "device": "cpu",
+                "runtime": "sklearn",  # 'torchscript', 'onnx': exported CPU graph
+                "quantize": False,  # int8 linear layers if the MSE stays in tolerance
+                "quantize_tolerance": 0.01,  # accepted relative MSE increase
                 "sets": 1,
                 "add_noise": True,
                 "snr_db": 0.0,  # 0.0 < noise < 1.0
+                "torch_threads": 0,  # 0: share cores among concurrent tasks
+                "chunksize": 100000,  # rows per forward pass, 0: all rows at once
             }
         )
         return params
@@ -263,6 +298,8 @@ class AEAugment(AbstractPlugin):
             selectedfeatures=self.params["features"],
             modelfile=self.params["modelfile"],
             device=self.params["device"],
+            runtime=self.params["runtime"],
+            quantize=self.params["quantize"],
             sets=self.params["sets"],
             add_noise=self.params["add_noise"],
             snr_db=self.params["snr_db"],
@@ -290,7 +327,37 @@ class AEAugment(AbstractPlugin):
         mean_noise = np.zeros(std_noise.shape)
         return mean_noise, std_noise
 
+    def _relabel(self, codes, categories, simsets):
+        """Makes the labels of the last grouping category unique for each set.
+
+        Integer labels are shifted by the maximum label times the set number, other
+        labels get the set number appended, e.g. '12.3'.
+
+        Args:
+            codes (numpy.ndarray): category codes of all stacked rows.
+            categories (pandas.Index): category labels.
+            simsets (numpy.ndarray): set number of each row.
+
+        Returns:
+            tuple(numpy.ndarray, numpy.ndarray): codes and sorted string labels.
+        """
+        sets = simsets.max() + 1 if len(simsets) > 0 else 1
+        try:
+            labels = categories.astype(int).to_numpy()
+            maxcell = labels[np.unique(codes[codes >= 0])].max()
+            setlabels = [(labels + maxcell * s).astype(str) for s in range(sets)]
+        except (TypeError, ValueError):
+            labels = categories.astype(str).to_numpy(dtype=str)
+            setlabels = [np.char.add(labels, f".{s}") for s in range(sets)]
+        setlabels = np.concatenate(setlabels)
+        # shifted labels of different sets may coincide, merge them
+        newcategories, inverse = np.unique(setlabels, return_inverse=True)
+        newcodes = inverse[simsets * len(categories) + codes]
+        newcodes[codes < 0] = -1
+        return newcodes, newcategories
+
     def execute(self):
+        autoencoder.set_torch_threads(self.params["torch_threads"])
         results = {}
         for mfile in self.params["modelfile"]:
             r = self.simulate(mfile)
@@ -323,61 +390,23 @@ class AEAugment(AbstractPlugin):
             logging.info(
                 "CUDA selected, but no CUDA device available. Switching to CPU."
             )
-        sim_df = pd.DataFrame(columns=(cats + feat_cols))
-        noise_df = pd.DataFrame()
-        try:
-            maxcell = np.amax(data[grouping[-1]].astype(int).to_numpy())
-        except:
-            pass
-
         mean_noise, std_noise = self._model_noise(data_feat, self.params["snr_db"])
         # ae = torch.load(self.params['modelfile'], map_location = device)
-        ae_pipeline = load(modelfile)
+        ae_runtime = load_runtime(modelfile, self.params["runtime"])
 
-        temps = []
-        for simset in range(0, self.params["sets"]):
-            if self.params["add_noise"]:
-                noise = np.random.normal(
-                    mean_noise, scale=std_noise, size=data_feat.shape
-                )
-                sdata_feat = data_feat + noise
-            else:
-                sdata_feat = data_feat
-
-            sdata_feat = sdata_feat.to_numpy(dtype=np.float32)
-
-            features, reconstructed = ae_pipeline.transform(sdata_feat)
-
-            sdata_feat = torch.FloatTensor(sdata_feat)
-            logging.debug(f"Sim set {simset+1}, original shape: {sdata_feat.shape}")
-
-            # features, reconstructed = ae(data_input)
-            logging.debug(f"Reconstructed shape: {reconstructed.shape}")
-
-            features = torch.squeeze(features)
-            logging.debug(f"Features shape: {features.shape}")
-
-            criterion = nn.MSELoss()
-            loss = criterion(reconstructed, sdata_feat)
-            logging.debug(f"Sim set {simset+1}, loss: {loss.data}")
-
-            recon_data = reconstructed.detach().numpy()
-            scaler = ae_pipeline.named_steps["minmaxscaler"]
-            sim_data = scaler.inverse_transform(recon_data)
-            temp = pd.DataFrame(columns=(cats + feat_cols))
-            temp[cats] = data[cats]
-            try:
-                temp[grouping[-1]] = temp[grouping[-1]].astype(int) + maxcell * simset
-            except:
-                temp[grouping[-1]] = temp[grouping[-1]].astype(str) + f".{simset}"
-            temp[feat_cols] = sim_data
-            temps.append(temp)
-
-        sim_df = pd.concat(temps).reset_index()
-        # calculate the rel amplitudes, e.g. a1%, a2% etc.
+        # all simulation sets stacked into one array, set s occupies rows s*n:(s+1)*n
+        sets = self.params["sets"]
+        nrows = len(data_feat)
+        total_rows = sets * nrows
+        signal = data_feat.to_numpy(dtype=np.float64)
+        results = {}
+        if self.params["quantize"]:
+            ae_runtime, report = quantize_runtime(
+                modelfile, ae_runtime, signal, self.params["quantize_tolerance"]
+            )
+            results[f"Table: Quantization-{os.path.basename(modelfile)}"] = report
+        calc_cols = {}
         for k, amps in amplitudes.items():
-            total_col = f"{k} total"
-            total_amp = sim_df[amps].sum(axis=1)
             for a in amps:
                 calc_col = [
                     c
@@ -386,13 +415,51 @@ class AEAugment(AbstractPlugin):
                 ]
                 calc_col = calc_col[0] if len(calc_col) > 0 else f"{a}%"
                 logging.debug(f"Calculating {calc_col}.")
-                sim_df[calc_col] = sim_df[a] / total_amp * 100.0
+                calc_cols[calc_col] = (a, amps)
+        value_cols = feat_cols + [c for c in calc_cols if c not in feat_cols]
+        values = np.empty((total_rows, len(value_cols)), dtype=np.float32, order="F")
+        chunksize = self.params["chunksize"]
+        if chunksize < 1:
+            chunksize = max(total_rows, 1)
+        sq_error = 0.0
+        for start in range(0, total_rows, chunksize):
+            end = min(start + chunksize, total_rows)
+            sdata_feat = signal[np.arange(start, end) % nrows]
+            if self.params["add_noise"]:
+                # same random stream as drawing each set's noise in turn
+                sdata_feat = sdata_feat + np.random.normal(
+                    mean_noise, scale=std_noise, size=sdata_feat.shape
+                )
+            sdata_feat = sdata_feat.astype(np.float32)
+            _, recon_data, rescaled = ae_runtime.predict(sdata_feat)
+            sq_error += float(np.square(recon_data - sdata_feat).sum())
+            values[start:end, : len(feat_cols)] = rescaled
+        loss = sq_error / max(total_rows * len(feat_cols), 1)
+        logging.debug(f"Sim sets {sets}, loss: {loss}")
+
+        # calculate the rel amplitudes, e.g. a1%, a2% etc.
+        column = {c: i for i, c in enumerate(value_cols)}
+        for k, amps in amplitudes.items():
+            amp_block = values[:, [column[a] for a in amps]]
+            rel_block = amp_block / amp_block.sum(axis=1, keepdims=True) * 100.0
+            for calc_col, (a, _) in calc_cols.items():
+                if a in amps:
+                    values[:, column[calc_col]] = rel_block[:, amps.index(a)]
+
+        sim_df = pd.DataFrame(values, columns=value_cols, copy=False)
+        sim_df["index"] = np.tile(data.index.to_numpy(), sets)
+        simsets = np.repeat(np.arange(sets), nrows)
+        for cat in cats:
+            codes = np.tile(data[cat].cat.codes.to_numpy(), sets)
+            categories = data[cat].cat.categories
+            if cat == grouping[-1]:
+                codes, categories = self._relabel(codes, categories, simsets)
+            sim_df[cat] = pd.Categorical.from_codes(codes, categories)
+        sim_df[grouping[-1]] = sim_df[grouping[-1]].cat.remove_unused_categories()
 
         outfeats = list([c for c in sim_df.columns.values if c not in cats])
         outfeats.sort()  # ensure feature vectors will be applied correctly
         sim_df = sim_df[cats + outfeats]
-        sim_df[grouping[-1]] = sim_df[grouping[-1]].astype(str).astype("category")
 
-        return {
-            f"Table: Simulated-{os.path.basename(modelfile)}": sim_df,
-        }
+        results[f"Table: Simulated-{os.path.basename(modelfile)}"] = sim_df
+        return results
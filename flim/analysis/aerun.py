@@ -5,11 +5,10 @@
 
 import logging
 import os
+import time
 import numpy as np
 import pandas as pd
 import torch
-import torch.nn as nn
-from torch.autograd import Variable
 import matplotlib.pyplot as plt
 from sklearn.impute import SimpleImputer
 from sklearn import preprocessing
@@ -21,7 +20,11 @@ from flim.gui.dialogs import BasicAnalysisConfigDlg
 import flim.analysis.ml.autoencoder as autoencoder
 import flim.resources
 from importlib_resources import files, as_file
-from joblib import load
+from flim.analysis.ml.runtime import (
+    RUNTIME_OPTIONS,
+    load_runtime,
+    quantize_runtime,
+)
 
 
 class AERunningConfigDlg(BasicAnalysisConfigDlg):
@@ -34,11 +37,15 @@ class AERunningConfigDlg(BasicAnalysisConfigDlg):
         selectedfeatures="All",
         modelfile="",
         device="cpu",
+        runtime="sklearn",
+        quantize=False,
         autosave=True,
         working_dir="",
     ):
         self.modelfile = modelfile
         self.device = device
+        self.runtime = runtime
+        self.quantize = quantize
         super().__init__(
             parent,
             title,
@@ -85,6 +92,27 @@ class AERunningConfigDlg(BasicAnalysisConfigDlg):
         device_sizer.Add(
             self.device_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
+        self.runtime_combobox = wx.ComboBox(
+            self.panel,
+            wx.ID_ANY,
+            style=wx.CB_READONLY,
+            value=self.runtime,
+            choices=RUNTIME_OPTIONS,
+        )
+        device_sizer.Add(
+            wx.StaticText(self.panel, label="Runtime"),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        device_sizer.Add(
+            self.runtime_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+        self.quantize_checkbox = wx.CheckBox(self.panel, wx.ID_ANY, label="int8")
+        self.quantize_checkbox.SetValue(self.quantize)
+        device_sizer.Add(
+            self.quantize_checkbox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
 
         return [timeseries_sizer, device_sizer]
 
@@ -103,6 +131,8 @@ class AERunningConfigDlg(BasicAnalysisConfigDlg):
         params = super()._get_selected()
         params["modelfile"] = self.modelfiletxt.GetLabel()
         params["device"] = self.device_combobox.GetValue()
+        params["runtime"] = self.runtime_combobox.GetValue()
+        params["quantize"] = self.quantize_checkbox.GetValue()
         return params
 
 
@@ -130,6 +160,11 @@ class RunAE(AbstractPlugin):
             {
                 "modelfile": "",
                 "device": "cpu",
+                "runtime": "sklearn",  # 'torchscript', 'onnx': exported CPU graph
+                "quantize": False,  # int8 linear layers if the MSE stays in tolerance
+                "quantize_tolerance": 0.01,  # accepted relative MSE increase
+                "torch_threads": 0,  # 0: share cores among concurrent tasks
+                "chunksize": 100000,  # rows per forward pass, 0: all rows at once
             }
         )
         return params
@@ -143,6 +178,8 @@ class RunAE(AbstractPlugin):
             selectedfeatures=self.params["features"],
             modelfile=self.params["modelfile"],
             device=self.params["device"],
+            runtime=self.params["runtime"],
+            quantize=self.params["quantize"],
             autosave=self.params["autosave"],
             working_dir=self.params["working_dir"],
         )
@@ -157,6 +194,7 @@ class RunAE(AbstractPlugin):
         return {"Table: Reconstructed": None, "Table: Features": None}
 
     def execute(self):
+        autoencoder.set_torch_threads(self.params["torch_threads"])
         if isinstance(self.params["modelfile"], list):
             results = {}
             for mfile in self.params["modelfile"]:
@@ -166,6 +204,42 @@ class RunAE(AbstractPlugin):
             results = self.run_model(self.params["modelfile"])
         return results
 
+    def _transform_chunks(self, ae_runtime, data_input, chunksize):
+        """Runs the model over consecutive row chunks.
+
+        Encoded and reconstructed values are written into preallocated arrays, so
+        peak memory beyond the outputs is bounded by the chunk size.
+
+        Args:
+            ae_runtime (object): inference runtime returned by load_runtime.
+            data_input (numpy.ndarray): 2D float32 input features.
+            chunksize (int): rows per forward pass, 0 processes all rows at once.
+
+        Returns:
+            tuple(numpy.ndarray, numpy.ndarray, float): encoded features,
+                reconstructed features, mean squared error of the reconstruction.
+        """
+        nrows = len(data_input)
+        if chunksize < 1:
+            chunksize = max(nrows, 1)
+        features_data = None
+        recon_data = np.empty(data_input.shape, dtype=np.float32, order="F")
+        sq_error = 0.0
+        for start in range(0, nrows, chunksize):
+            chunk = data_input[start : start + chunksize]
+            features, reconstructed, _ = ae_runtime.predict(chunk)
+            if features_data is None:
+                features_data = np.empty(
+                    (nrows, features.shape[1]), dtype=np.float32, order="F"
+                )
+            features_data[start : start + chunksize] = features
+            recon_data[start : start + chunksize] = reconstructed
+            sq_error += float(np.square(reconstructed - chunk).sum())
+        if features_data is None:
+            features_data = np.empty((0, 0), dtype=np.float32)
+        loss = sq_error / max(data_input.size, 1)
+        return features_data, recon_data, loss
+
     def run_model(self, modelfile):
         data = list(self.input.values())[0]
         data_feat = data[self.params["features"]]
@@ -178,33 +252,37 @@ class RunAE(AbstractPlugin):
                 "CUDA selected, but no CUDA device available. Switching to CPU."
             )
         # ae = torch.load(self.params['modelfile'], map_location = device)
-        ae_pipeline = load(modelfile)  # currently no way to remap device
+        # currently no way to remap device, exported runtimes run on the CPU
+        ae_runtime = load_runtime(modelfile, self.params["runtime"])
 
-        data_feat = data_feat.astype(float)
         data_input = data_feat.to_numpy(dtype=np.float32)
-
-        features, reconstructed = ae_pipeline.transform(data_input)
-        logging.debug(f"Reconstructed shape: {reconstructed.shape}")
-
-        features = torch.squeeze(features)
-        logging.debug(f"Features shape: {features.shape}")
-
-        criterion = nn.MSELoss()
-        reconstructed = torch.FloatTensor(reconstructed)
-        data_feat = np.asarray(data_feat)
-        data_feat = torch.FloatTensor(data_feat)
-        loss = criterion(Variable(reconstructed), Variable(data_feat))
-        logging.debug(f"Loss: {loss.data}")
-
-        recon_data = reconstructed.detach().numpy()
-        features_data = features.detach().numpy()
-        len_features = 1 if len(features_data.shape) == 1 else features_data.shape[1]
+        results = {}
+        if self.params["quantize"]:
+            ae_runtime, report = quantize_runtime(
+                modelfile, ae_runtime, data_input, self.params["quantize_tolerance"]
+            )
+            results[f"Table: Quantization-{os.path.basename(modelfile)}"] = report
+        start = time.perf_counter()
+        features_data, recon_data, loss = self._transform_chunks(
+            ae_runtime, data_input, self.params["chunksize"]
+        )
+        elapsed = time.perf_counter() - start
+        logging.debug(f"Reconstructed shape: {recon_data.shape}")
+        logging.debug(f"Features shape: {features_data.shape}")
+        logging.debug(f"Loss: {loss}")
+        logging.info(
+            f"{os.path.basename(modelfile)}: {len(data_input)} rows in {elapsed:.2f} s"
+            f" ({len(data_input) / max(elapsed, 1e-9):.0f} rows/s)"
+        )
+        len_features = features_data.shape[1]
 
         lcols = [n for n in data.select_dtypes("category").columns]
 
         recon_df = pd.DataFrame(
             recon_data,
+            index=data.index,
             columns=[f"Recon Feature {i}" for i in range(1, recon_data.shape[1] + 1)],
+            copy=False,
         )
         recon_df = pd.concat(
             [data[lcols], recon_df],
@@ -212,14 +290,20 @@ class RunAE(AbstractPlugin):
         )
 
         features_df = pd.DataFrame(
-            features_data, columns=[f"Feature {i}" for i in range(1, len_features + 1)]
+            features_data,
+            index=data.index,
+            columns=[f"Feature {i}" for i in range(1, len_features + 1)],
+            copy=False,
         )
         features_df = pd.concat(
             [data[lcols], features_df],
             axis=1,
         )
 
-        return {
-            f"Table: Reconstructed-{os.path.basename(modelfile)}": recon_df,
-            f"Table: Features-{os.path.basename(modelfile)}": features_df,
-        }
+        results.update(
+            {
+                f"Table: Reconstructed-{os.path.basename(modelfile)}": recon_df,
+                f"Table: Features-{os.path.basename(modelfile)}": features_df,
+            }
+        )
+        return results
@@ -7,10 +7,14 @@ import copy
 import itertools
 import logging
 import os
-import random
-from collections import defaultdict
 
 import flim.analysis.ml.autoencoder as autoencoder
+from flim.analysis.ml.runtime import (
+    EXPORT_OPTIONS,
+    export_pipeline,
+    exported_file,
+    onnx_available,
+)
 import flim.resources
 import matplotlib.figure
 import matplotlib.pyplot as plt
@@ -20,36 +24,123 @@ import torch
 import torch.nn as nn
 import torch.nn.parallel
 import torch.optim as optim
-import torch.utils.data
 import wx
 from flim import utils
 from flim.gui.dialogs import BasicAnalysisConfigDlg
 from flim.plugin import AbstractPlugin, plugin
 from importlib_resources import files
-from joblib import dump
+from joblib import Parallel, cpu_count, delayed, dump, effective_n_jobs
 from matplotlib.ticker import MaxNLocator
 from sklearn import preprocessing
 from sklearn.impute import SimpleImputer
 from sklearn.pipeline import make_pipeline
-from sklearn.preprocessing import LabelEncoder
-from torch.utils.data.dataset import Dataset
 from wx.lib.masked import NumCtrl
 
 
-class datasets(Dataset):
-    def __init__(self, data, labels=[]):
-        self.data = np.asarray(data)
-        self.data_len = len(self.data)
-        self.labels = np.asarray(labels)
-        # self.transform = transforms.Compose([transforms.ToTensor()])
+class datasets:
+    """Tensor-resident dataset that yields whole batches of features and labels.
+
+    Features and integer labels are converted to tensors once. Each iteration
+    permutes all rows with a single gather (if shuffle is set) and yields batches as
+    contiguous slices, avoiding per-sample __getitem__ calls and collation.
 
-    def __getitem__(self, index):
-        single_item = self.data[index]
-        item_label = self.labels[index]
-        return single_item, item_label
+    Args:
+        data (array-like): 2D feature array.
+        labels (array-like): 2D array of integer encoded labels, one row per sample.
+        batch_size (int): number of rows per batch.
+        shuffle (bool): reshuffle rows at the start of every iteration.
+    """
+
+    def __init__(self, data, labels=[], batch_size=1, shuffle=False):
+        self.data = torch.as_tensor(np.asarray(data, dtype=np.float32))
+        self.data_len = len(self.data)
+        self.labels = torch.as_tensor(np.asarray(labels, dtype=np.int64))
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+
+    def to(self, device):
+        """Moves the feature tensor to device, labels stay on the CPU."""
+        self.data = self.data.to(device)
+        return self
+
+    def __iter__(self):
+        data, labels = self.data, self.labels
+        if self.shuffle:
+            order = torch.randperm(self.data_len)
+            data, labels = data[order.to(data.device)], labels[order]
+        for start in range(0, self.data_len, self.batch_size):
+            end = start + self.batch_size
+            yield data[start:end], labels[start:end]
 
     def __len__(self):
-        return self.data_len
+        return -(-self.data_len // self.batch_size)
+
+
+SCHEDULER_OPTIONS = ["None", "plateau", "cosine"]
+SPLIT_KEYS = ["train_index", "val_index", "scaler", "imputer"]
+
+
+def split_indices(data, grouping, train_size, seed=None):
+    """Randomly assigns whole groups of rows to the training or validation set.
+
+    Rows are mapped to group ids based on the category codes of the grouping columns.
+    A random group id -> fold mask then selects the rows of each set in O(n).
+
+    Args:
+        data (pandas.DataFrame): input data.
+        grouping (list(str)): category columns that define the groups. Each row is its
+            own group if empty.
+        train_size (float): fraction of groups used for training.
+        seed (int): seed of the split, None draws a new split on each call.
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray): row positions of the training and
+            validation set.
+    """
+    if len(grouping) > 0:
+        group_ids = np.zeros(len(data), dtype=np.int64)
+        for col in grouping:
+            # shift codes so that missing values (-1) form a group of their own
+            codes = data[col].cat.codes.to_numpy(dtype=np.int64) + 1
+            # renumbering after each column keeps the combined ids below len(data)
+            group_ids, _ = pd.factorize(
+                group_ids * (len(data[col].cat.categories) + 1) + codes, sort=True
+            )
+        ngroups = group_ids.max() + 1 if len(group_ids) > 0 else 0
+    else:
+        group_ids = np.arange(len(data))
+        ngroups = len(data)
+    rng = np.random.default_rng(seed)
+    in_train = np.zeros(ngroups, dtype=bool)
+    in_train[rng.permutation(ngroups)[: int(np.around(train_size * ngroups))]] = True
+    logging.debug(f"Groups for training: {in_train.sum()} of {ngroups}")
+    row_mask = in_train[group_ids]
+    return np.flatnonzero(row_mask), np.flatnonzero(~row_mask)
+
+
+def train_grid_point(
+    params, data, prepared, size, rate, decay, threads, checkpoint=None
+):
+    """Trains one hyperparameter combination in a grid worker process.
+
+    Args:
+        params (dict): AETraining parameters.
+        data (pandas.DataFrame): category columns of the input data.
+        prepared (dict): shared datasets created by AETraining._create_datasets.
+        size (int): batch size.
+        rate (float): learning rate.
+        decay (float): weight decay.
+        threads (int): number of torch threads used by this worker.
+        checkpoint (dict): training state to resume from, or None.
+
+    Returns:
+        dict: training results, loss plots are created by the calling process.
+    """
+    autoencoder.set_torch_threads(threads)
+    trainer = AETraining()
+    trainer.params.update(params)
+    trainer.params["create_plots"] = False
+    return trainer._train_combination(data, prepared, size, rate, decay, checkpoint)
 
 
 class AETrainingConfigDlg(BasicAnalysisConfigDlg):
@@ -71,6 +162,10 @@ class AETrainingConfigDlg(BasicAnalysisConfigDlg):
         device="cpu",
         rescale=False,
         checkpoint_interval=20,
+        patience=0,
+        lr_scheduler="None",
+        resume=False,
+        export="None",
         autosave=True,
         working_dir="",
     ):
@@ -88,6 +183,10 @@ class AETrainingConfigDlg(BasicAnalysisConfigDlg):
         self.device = device
         self.rescale = rescale
         self.checkpoint_interval = checkpoint_interval
+        self.patience = patience
+        self.lr_scheduler = lr_scheduler
+        self.resume = resume
+        self.export = export
         super().__init__(
             parent,
             title,
@@ -146,10 +245,25 @@ class AETrainingConfigDlg(BasicAnalysisConfigDlg):
             self.checkpoint_spinner, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        patience_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.patience_spinner = wx.SpinCtrl(
+            self.panel, wx.ID_ANY, min=0, max=500, initial=self.patience
+        )
+        patience_sizer.Add(
+            wx.StaticText(self.panel, label="Early stop patience"),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        patience_sizer.Add(
+            self.patience_spinner, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
         spinner_sizer = wx.BoxSizer(wx.VERTICAL)
         spinner_sizer.Add(epoches_sizer)
         spinner_sizer.Add(batch_sizer)
         spinner_sizer.Add(checkpoint_sizer)
+        spinner_sizer.Add(patience_sizer)
 
         learning_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.learning_input = wx.TextCtrl(
@@ -179,9 +293,28 @@ class AETrainingConfigDlg(BasicAnalysisConfigDlg):
             self.weight_input, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        scheduler_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.scheduler_combobox = wx.ComboBox(
+            self.panel,
+            wx.ID_ANY,
+            style=wx.CB_READONLY,
+            value=self.lr_scheduler,
+            choices=SCHEDULER_OPTIONS,
+        )
+        scheduler_sizer.Add(
+            wx.StaticText(self.panel, label="LR Schedule"),
+            1,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        scheduler_sizer.Add(
+            self.scheduler_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
         float_sizer = wx.BoxSizer(wx.VERTICAL)
         float_sizer.Add(learning_sizer)
         float_sizer.Add(weight_sizer)
+        float_sizer.Add(scheduler_sizer)
 
         device_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.device_combobox = wx.ComboBox(
@@ -195,6 +328,10 @@ class AETrainingConfigDlg(BasicAnalysisConfigDlg):
             self.panel, wx.ID_ANY, label="Rescale decoded"
         )
         self.rescale_checkbox.SetValue(self.rescale)
+        self.resume_checkbox = wx.CheckBox(
+            self.panel, wx.ID_ANY, label="Resume from checkpoint"
+        )
+        self.resume_checkbox.SetValue(self.resume)
         device_sizer.Add(
             wx.StaticText(self.panel, label="Device"),
             1,
@@ -205,9 +342,29 @@ class AETrainingConfigDlg(BasicAnalysisConfigDlg):
             self.device_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        export_sizer = wx.BoxSizer(wx.HORIZONTAL)
+        self.export_combobox = wx.ComboBox(
+            self.panel,
+            wx.ID_ANY,
+            style=wx.CB_READONLY,
+            value=self.export,
+            choices=EXPORT_OPTIONS,
+        )
+        export_sizer.Add(
+            wx.StaticText(self.panel, label="Export"),
+            1,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        export_sizer.Add(
+            self.export_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
         rescale_sizer = wx.BoxSizer(wx.VERTICAL)
         rescale_sizer.Add(device_sizer)
+        rescale_sizer.Add(export_sizer)
         rescale_sizer.Add(self.rescale_checkbox)
+        rescale_sizer.Add(self.resume_checkbox)
 
         top_sizer = wx.BoxSizer(wx.HORIZONTAL)
         top_sizer.Add(spinner_sizer)
@@ -364,6 +521,10 @@ class AETrainingConfigDlg(BasicAnalysisConfigDlg):
         params["device"] = self.device_combobox.GetValue()
         params["rescale"] = self.rescale_checkbox.GetValue()
         params["checkpoint_interval"] = self.checkpoint_spinner.GetValue()
+        params["patience"] = self.patience_spinner.GetValue()
+        params["lr_scheduler"] = self.scheduler_combobox.GetValue()
+        params["resume"] = self.resume_checkbox.GetValue()
+        params["export"] = self.export_combobox.GetValue()
         return params
 
 
@@ -444,7 +605,18 @@ class AETraining(AbstractPlugin):
                 "rescale": False,
                 "create_plots": True,
                 "train_size": 0.7,  # 0.0 < train_size < 1.0
+                "seed": None,  # fixed train/validation split if set
                 "checkpoint_interval": 20,
+                "patience": 0,  # epochs without val loss improvement, 0: off
+                "min_delta": 0.0,
+                "lr_scheduler": "None",  # 'plateau', 'cosine'
+                "lr_factor": 0.5,
+                "lr_patience": 5,
+                "resume": False,
+                "export": "None",  # 'torchscript', 'onnx': graph for AE Run/Augment
+                "n_jobs": 1,  # concurrent hyperparameter combinations
+                "threads_per_job": 0,  # torch threads per combination, 0: auto
+                "torch_threads": 0,  # 0: share cores among concurrent tasks
             }
         )
         return params
@@ -490,6 +662,10 @@ class AETraining(AbstractPlugin):
             device=self.params["device"],
             rescale=self.params["rescale"],
             checkpoint_interval=self.params["checkpoint_interval"],
+            patience=self.params["patience"],
+            lr_scheduler=self.params["lr_scheduler"],
+            resume=self.params["resume"],
+            export=self.params["export"],
             autosave=self.params["autosave"],
             working_dir=self.params["working_dir"],
         )
@@ -500,74 +676,172 @@ class AETraining(AbstractPlugin):
         self.configure(**params)
         return self.params
 
-    def _create_datasets(self, batch_size):
+    def _create_datasets(self, split=None):
+        """Splits the data and fits the scaler and imputer.
+
+        The returned arrays, scaler and imputer are computed once and shared
+        read-only by all hyperparameter combinations.
+
+        Args:
+            split (dict): training and validation row positions and the fitted
+                scaler and imputer of a checkpoint; a new split is drawn if None.
+
+        Returns:
+            dict: training and validation row positions, arrays and label codes,
+                fitted scaler, imputer and the categories of the label codes.
+        """
         train_size = self.params["train_size"]
         data = list(self.input.values())[0]
         allcat_columns = [n for n in data.select_dtypes("category").columns]
         grouping = [
             n for n in self.params["grouping"] if n != self.params["timeseries"]
         ]
-        columns = list(allcat_columns)  # list(cat_columns)
-        columns.extend(self.params["features"])
-
-        # encode labels of all category columns
-        label_encoders = defaultdict(LabelEncoder)
-        data = data.loc[:, columns]
-        data.loc[:, allcat_columns] = data.loc[:, allcat_columns].apply(
-            lambda x: label_encoders[x.name].fit_transform(x)
-        )
-
-        random.seed()
-        if len(grouping) > 0:
-            # define logical groups first, then split into train and validation set.
-            g = data[columns].groupby(grouping)
-            cat_groups = sorted(g.groups.keys())
-            train_cat = random.sample(
-                cat_groups, k=int(np.around(train_size * len(cat_groups)))
-            )
-            val_cat = [c for c in cat_groups if c not in train_cat]
-            logging.debug(f"Groups for training: {sorted(train_cat)}")
-            logging.debug(f"Groups for validation: {sorted(val_cat)}")
-            train_df = pd.concat(
-                [g.get_group(group) for group in g.groups if group in train_cat]
-            )
-            val_df = pd.concat(
-                [g.get_group(group) for group in g.groups if group not in train_cat]
+        if split is None:
+            train_index, val_index = split_indices(
+                data, grouping, train_size, self.params["seed"]
             )
         else:
-            train_df = data.sample(n=int(np.around(train_size * len(data))))
-            val_df = pd.concat([data, train_df, train_df]).drop_duplicates(keep=False)
-        logging.debug(train_df.describe())
-        logging.debug(val_df.describe())
+            train_index, val_index = split["train_index"], split["val_index"]
+        logging.debug(f"{len(train_index)} training, {len(val_index)} validation rows")
 
-        # normalize data, create dataloaders
-        my_imputer = SimpleImputer(strategy="constant", fill_value=0)
-        train_scaler = preprocessing.MinMaxScaler()
+        # category codes serve as labels, decoded again after training
+        codes = np.empty((len(data), len(allcat_columns)), dtype=np.int64)
+        for i, col in enumerate(allcat_columns):
+            codes[:, i] = data[col].cat.codes
+        categories = {col: data[col].cat.categories for col in allcat_columns}
+        values = data[self.params["features"]].to_numpy(dtype=np.float32)
 
-        training_set = train_df[self.params["features"]].to_numpy(dtype=np.float32)
-        train_scaler = train_scaler.fit(training_set)
-        training_set = train_scaler.transform(training_set)
-        my_imputer = my_imputer.fit(training_set)
+        # normalize data, create dataloaders
+        training_set = values[train_index]
+        if split is None:
+            train_scaler = preprocessing.MinMaxScaler().fit(training_set)
+            training_set = train_scaler.transform(training_set)
+            my_imputer = SimpleImputer(strategy="constant", fill_value=0)
+            my_imputer = my_imputer.fit(training_set)
+        else:
+            train_scaler, my_imputer = split["scaler"], split["imputer"]
+            training_set = train_scaler.transform(training_set)
         training_set = my_imputer.transform(training_set)
-        train_labels = train_df[allcat_columns]
-        train_dataset = datasets(training_set, labels=train_labels)
-        train_loader = torch.utils.data.DataLoader(
-            dataset=train_dataset, batch_size=batch_size, shuffle=True
-        )
+        train_labels = codes[train_index]
         logging.debug(f"Training set shape: {training_set.shape}")
 
-        val_set = val_df[self.params["features"]].to_numpy(dtype=np.float32)
+        val_set = values[val_index]
         # use train scaler & imputer to decrease information leak from train to validation set
         val_set = train_scaler.transform(val_set)
         val_set = my_imputer.transform(val_set)  # fit_transform(val_set)
-        val_labels = val_df[allcat_columns]
-        val_dataset = datasets(val_set, labels=val_labels)
-        val_loader = torch.utils.data.DataLoader(
-            dataset=val_dataset, batch_size=batch_size, shuffle=True
-        )
+        val_labels = codes[val_index]
         logging.debug(f"Val set shape: {val_set.shape}")
 
-        return train_loader, val_loader, train_scaler, my_imputer, label_encoders
+        return {
+            "train_index": train_index,
+            "val_index": val_index,
+            "train": training_set,
+            "train_labels": train_labels,
+            "val": val_set,
+            "val_labels": val_labels,
+            "scaler": train_scaler,
+            "imputer": my_imputer,
+            "categories": categories,
+        }
+
+    def _create_loaders(self, prepared, batch_size):
+        train_loader = datasets(
+            prepared["train"],
+            labels=prepared["train_labels"],
+            batch_size=batch_size,
+            shuffle=True,
+        )
+        val_loader = datasets(
+            prepared["val"],
+            labels=prepared["val_labels"],
+            batch_size=batch_size,
+            shuffle=True,
+        )
+        return train_loader, val_loader
+
+    def _train_combination(self, data, prepared, size, rate, decay, checkpoint=None):
+        train_loader, val_loader = self._create_loaders(prepared, size)
+        return self.train(
+            data,
+            rate,
+            decay,
+            size,
+            train_loader,
+            val_loader,
+            prepared["scaler"],
+            prepared["imputer"],
+            prepared["categories"],
+            split={key: prepared[key] for key in SPLIT_KEYS},
+            checkpoint=checkpoint,
+        )
+
+    def _model_file(self, batch_size, learning_rate, weight_decay):
+        return os.path.join(
+            self.params["working_dir"],
+            f'{self.params["modelfile"]}_{batch_size}_{learning_rate}_{weight_decay}',
+        )
+
+    def _load_checkpoint(self, modelfile, rows):
+        """Returns the training state saved for a model file, or None.
+
+        Checkpoints carry the train/validation split with the fitted scaler and
+        imputer, so that a resumed run trains and validates on the same rows and
+        input scaling. Checkpoints without them, or written for a different number
+        of input rows, are not resumed.
+
+        Args:
+            modelfile (str): model file path without epoch suffix.
+            rows (int): number of input rows.
+
+        Returns:
+            dict: checkpoint contents, or None if training starts from scratch.
+        """
+        checkpointfile = f"{modelfile}.ckpt"
+        if not self.params["resume"] or not os.path.exists(checkpointfile):
+            return None
+        try:
+            # the fitted scaler and imputer are pickled objects, not only weights
+            checkpoint = torch.load(
+                checkpointfile, map_location="cpu", weights_only=False
+            )
+        except TypeError:
+            # torch < 1.13 has no weights_only option
+            checkpoint = torch.load(checkpointfile, map_location="cpu")
+        if checkpoint.get("split") is None or checkpoint.get("rows") != rows:
+            logging.warning(
+                f"{checkpointfile} has no train/validation split for this data,"
+                " training from scratch."
+            )
+            return None
+        return checkpoint
+
+    def _resume_datasets(self, prepared, checkpoints):
+        """Returns the datasets for each checkpoint, rebuilt from its saved split.
+
+        Args:
+            prepared (dict): datasets created by _create_datasets for a new split.
+            checkpoints (list(dict)): checkpoint per combination, or None.
+
+        Returns:
+            list(dict): datasets per combination.
+        """
+        known = [prepared]
+        result = []
+        for checkpoint in checkpoints:
+            if checkpoint is None:
+                result.append(prepared)
+                continue
+            split = checkpoint["split"]
+            for datasets in known:
+                if np.array_equal(
+                    datasets["train_index"], split["train_index"]
+                ) and np.array_equal(datasets["val_index"], split["val_index"]):
+                    break
+            else:
+                datasets = self._create_datasets(split=split)
+                known.append(datasets)
+            result.append(datasets)
+        return result
 
     def execute(self):
         data = next(iter(self.input.values()))
@@ -576,32 +850,113 @@ class AETraining(AbstractPlugin):
         decays = self.params["weight_decay"]
         sizes = self.params["batch_size"]
         combinations = utils.combine(sizes, rates, decays)
-        results = {}
-        for size, rate, decay in combinations:
-            (
-                train_loader,
-                val_loader,
-                input_scaler,
-                imputer,
-                label_encoders,
-            ) = self._create_datasets(size)
-            r = self.train(
-                data,
-                rate,
-                decay,
-                size,
-                train_loader,
-                val_loader,
-                input_scaler,
-                imputer,
-                label_encoders,
+        prepared = self._create_datasets()
+        # resumed combinations continue on the split saved with their checkpoint
+        checkpoints = [
+            self._load_checkpoint(self._model_file(size, rate, decay), len(data))
+            for size, rate, decay in combinations
+        ]
+        datasets = self._resume_datasets(prepared, checkpoints)
+        n_jobs = min(effective_n_jobs(self.params["n_jobs"]), len(combinations))
+        if n_jobs > 1:
+            # one process per combination, each limited to its share of the cores
+            threads = self.params["threads_per_job"]
+            if threads < 1:
+                threads = max(1, cpu_count() // n_jobs)
+            categories = data.select_dtypes("category")
+            grid = Parallel(n_jobs=n_jobs)(
+                delayed(train_grid_point)(
+                    self.params,
+                    categories,
+                    prepared,
+                    size,
+                    rate,
+                    decay,
+                    threads,
+                    checkpoint,
+                )
+                for (size, rate, decay), prepared, checkpoint in zip(
+                    combinations, datasets, checkpoints
+                )
             )
+        else:
+            autoencoder.set_torch_threads(self.params["torch_threads"])
+            grid = [
+                self._train_combination(data, prepared, size, rate, decay, checkpoint)
+                for (size, rate, decay), prepared, checkpoint in zip(
+                    combinations, datasets, checkpoints
+                )
+            ]
+        results = {}
+        for r, (size, rate, decay) in zip(grid, combinations):
+            label = f"{size}-{rate}-{decay}"
+            if self.params["create_plots"] and f"Plot: AE Loss-{label}" not in r:
+                loss_df = r[f"Table: AE Loss-{label}"]
+                r[f"Plot: AE Loss-{label}"] = self._loss_plot(
+                    loss_df["Training Loss"], loss_df["Validation Loss"]
+                )
             for key in r:
                 if key in results:
                     r[key] = results[key] + r[key]
             results.update(r)
         return results
 
+    def _loss_plot(self, loss_train, loss_val):
+        fig, ax = plt.subplots(constrained_layout=True)
+        ax.plot(range(1, len(loss_train) + 1), loss_train, "b-", label="train-loss")
+        ax.plot(range(1, len(loss_val) + 1), loss_val, "r-", label="val-loss")
+        ax.grid("on")
+        ax.set_ylabel("loss")
+        ax.set_xlabel("epoch")
+        ax.legend(["training", "testing"], loc="upper right")
+        ax.xaxis.set_major_locator(MaxNLocator(integer=True))
+        self._add_picker(fig)
+        return fig
+
+    def _create_scheduler(self, optimizer):
+        scheduler = self.params["lr_scheduler"]
+        if scheduler == "plateau":
+            return optim.lr_scheduler.ReduceLROnPlateau(
+                optimizer,
+                factor=self.params["lr_factor"],
+                patience=self.params["lr_patience"],
+            )
+        if scheduler == "cosine":
+            return optim.lr_scheduler.CosineAnnealingLR(
+                optimizer, T_max=self.params["epoches"]
+            )
+        return None
+
+    def _save_checkpoint(self, checkpointfile, ae, optimizer, scheduler, state):
+        """Writes model, optimizer, scheduler and training state for resuming.
+
+        The file is replaced atomically, an interrupted write leaves the previous
+        checkpoint intact.
+        """
+        checkpoint = dict(state)
+        checkpoint["model"] = ae.state_dict()
+        checkpoint["optimizer"] = optimizer.state_dict()
+        checkpoint["scheduler"] = None if scheduler is None else scheduler.state_dict()
+        torch.save(checkpoint, f"{checkpointfile}.tmp")
+        os.replace(f"{checkpointfile}.tmp", checkpointfile)
+
+    def _dump_pipeline(self, modelfile, ae, imputer, input_scaler):
+        """Writes the model pipeline and, if selected, its exported graph."""
+        pipeline = make_pipeline(imputer, input_scaler, copy.deepcopy(ae))
+        dump(
+            pipeline,
+            filename=modelfile,
+        )
+        runtime = self.params["export"]
+        if runtime == "onnx" and not onnx_available():
+            logging.warning(
+                "onnx or onnxruntime is not installed, exporting TorchScript instead."
+            )
+            runtime = "torchscript"
+        if runtime in EXPORT_OPTIONS[1:]:
+            export_pipeline(pipeline, exported_file(modelfile, runtime), runtime)
+        return pipeline
+
     def train(
         self,
         data,
@@ -612,13 +967,12 @@ class AETraining(AbstractPlugin):
         val_loader,
         input_scaler,
         imputer,
-        label_encoders,
+        categories,
+        split=None,
+        checkpoint=None,
     ):
         results = {}
-        modelfile = os.path.join(
-            self.params["working_dir"],
-            f'{self.params["modelfile"]}_{batch_size}_{learning_rate}_{weight_decay}',
-        )
+        modelfile = self._model_file(batch_size, learning_rate, weight_decay)
         logging.info("Training started.")
         aeclasses = autoencoder.get_autoencoder_classes()
         device = self.params["device"]
@@ -631,34 +985,75 @@ class AETraining(AbstractPlugin):
         ae = autoencoder.create_instance(
             aeclasses[self.params["model"]], nb_param=no_features
         ).to(device)
+        train_loader.to(device)
+        val_loader.to(device)
         criterion = nn.MSELoss()  # .cuda()
         optimizer = optim.RMSprop(ae.parameters(), learning_rate, weight_decay)
+        scheduler = self._create_scheduler(optimizer)
 
-        loss_train = []
-        loss_val = []
+        parts = modelfile  # self.params["modelfile"].split(".")
+        presuf = (
+            ["".join(parts[: len(parts) - 1]), f".{parts[-1]}"]
+            if len(parts) > 1
+            else parts + [""]
+        )
+        def epochfile(epoch):
+            return (
+                f"{presuf[0]}{presuf[1]}_epoch{epoch:04d}".replace(".model", "")
+                + ".model"
+            )
+
+        # training state, restored from the checkpoint file when resuming
+        patience = self.params["patience"]
+        state = {
+            "epoch": 0,
+            "loss_train": [],
+            "loss_val": [],
+            "best_loss": np.inf,
+            "best_epoch": 0,
+            "best_model": None,
+            "wait": 0,
+            "model_files": {},
+            "epoches": self.params["epoches"],
+            "patience": patience,
+            # split, scaler and imputer the model is trained and validated on
+            "split": split,
+            "rows": len(data),
+        }
+        first_epoch = 1
+        checkpointfile = f"{modelfile}.ckpt"
+        if checkpoint is not None:
+            checkpoint = dict(checkpoint)
+            ae.load_state_dict(checkpoint.pop("model"))
+            optimizer.load_state_dict(checkpoint.pop("optimizer"))
+            scheduler_state = checkpoint.pop("scheduler")
+            if scheduler is not None and scheduler_state is not None:
+                scheduler.load_state_dict(scheduler_state)
+            settings = (checkpoint.get("epoches"), checkpoint.get("patience"))
+            state.update(checkpoint)
+            first_epoch = state["epoch"] + 1
+            if settings != (self.params["epoches"], patience):
+                # new stopping criteria, count epochs without improvement afresh
+                state["wait"] = 0
+                state["epoches"] = self.params["epoches"]
+                state["patience"] = patience
+            elif patience > 0 and state["wait"] >= patience:
+                logging.info(
+                    f"Training stopped early at epoch {state['epoch']}, not resuming."
+                    " Increase epochs or patience to continue training."
+                )
+                first_epoch = self.params["epoches"] + 1
+            if first_epoch <= self.params["epoches"]:
+                logging.info(f"Resuming training after epoch {state['epoch']}.")
+        loss_train = state["loss_train"]
+        loss_val = state["loss_val"]
+        all_model_files = state["model_files"]
 
         # Train the autoencoder
-        labels = []
-        decoded = []  # np.zeros((len(self.data),len(self.params['features'])))
-        encoded = []  # np.zeros((len(self.data),len(self.params['features'])))
-        checkpoints = []
-        for epoch in range(1, self.params["epoches"] + 1):
+        for epoch in range(first_epoch, self.params["epoches"] + 1):
             cum_loss = 0
-            train_samples = 0
             for i, (batchinputs, batchlabels) in enumerate(train_loader):
                 encoder_out, decoder_out = ae(batchinputs) #runs inputs through autoencoder
-                if epoch == self.params["epoches"]:
-                    length = len(batchlabels)
-                    # use int 0 to label as 'train'
-                    labelarray = np.array(length * [0]).reshape(length, 1)
-                    labelarray = np.concatenate([batchlabels, labelarray], axis=1)
-                    labels.append(labelarray)
-                    batchout = decoder_out.detach().numpy()
-                    decoded.append(batchout)
-                    encod = encoder_out.detach().numpy()
-                    encoded.append(encod)
-                    train_samples += len(batchinputs)
-
                 loss = criterion(decoder_out, batchinputs)
                 cum_loss += loss.data.item()
 
@@ -670,37 +1065,83 @@ class AETraining(AbstractPlugin):
             logging.debug("Epoch %d., Train loss: %.4f" % (epoch, loss_train[-1]))
 
             cum_loss = 0
-            for i, item in enumerate(val_loader): #validation step
-                batchinputs = item[0]  # .cuda()
-                batchlabels = item[1]
-                encoder_out, decoder_out = ae(batchinputs)
-                if epoch == self.params["epoches"]:
-                    length = len(batchlabels)
-                    # use int 1 to label as 'validation'
-                    labelarray = np.array(length * [1]).reshape(length, 1)
-                    labelarray = np.concatenate([batchlabels, labelarray], axis=1)
-                    labels.append(labelarray)
-                    batchout = decoder_out.detach().numpy()
-                    decoded.append(batchout)
-                    encod = encoder_out.detach().numpy()
-                    encoded.append(encod)
-
-                loss = criterion(decoder_out, batchinputs)
-                cum_loss += loss.data.item()
+            with autoencoder.inference():
+                for i, item in enumerate(val_loader): #validation step
+                    batchinputs = item[0]  # .cuda()
+                    encoder_out, decoder_out = ae(batchinputs)
+                    loss = criterion(decoder_out, batchinputs)
+                    cum_loss += loss.item()
 
             loss_val.append(cum_loss / (i + 1))
             logging.debug("Epoch %d., Test loss: %.4f" % (epoch, loss_val[-1]))
 
+            if isinstance(scheduler, optim.lr_scheduler.ReduceLROnPlateau):
+                scheduler.step(loss_val[-1])
+            elif scheduler is not None:
+                scheduler.step()
+            if loss_val[-1] < state["best_loss"] - self.params["min_delta"]:
+                state["best_loss"] = loss_val[-1]
+                state["wait"] = 0
+                if patience > 0:
+                    state["best_epoch"] = epoch
+                    state["best_model"] = copy.deepcopy(ae.state_dict())
+            else:
+                state["wait"] += 1
+            stop = patience > 0 and state["wait"] >= patience
+
             if (
-                epoch == self.params["epoches"]
+                stop
+                or epoch == self.params["epoches"]
                 or epoch % self.params["checkpoint_interval"] == 0
             ):
-                ae_clone = autoencoder.create_instance(
-                    aeclasses[self.params["model"]], nb_param=no_features
-                ).to(device)
-                ae_clone.load_state_dict(ae.state_dict())
-                checkpoints.append((epoch, ae_clone))
-
+                # write model pipeline and resumable training state right away
+                f = epochfile(epoch)
+                pipeline = self._dump_pipeline(f, ae, imputer, input_scaler)
+                results[os.path.split(f)[1]] = pipeline
+                all_model_files[epoch] = f
+                state["epoch"] = epoch
+                self._save_checkpoint(checkpointfile, ae, optimizer, scheduler, state)
+            if stop:
+                logging.info(
+                    f"Early stopping at epoch {epoch}, no validation loss improvement"
+                    f" in {patience} epochs."
+                )
+                break
+
+        model_epochs = sorted(all_model_files)
+        if patience > 0 and state["best_model"] is not None:
+            # with early stopping, keep the model with the lowest validation loss
+            ae.load_state_dict(state["best_model"])
+            best_epoch = state["best_epoch"]
+            if best_epoch not in all_model_files:
+                f = epochfile(best_epoch)
+                pipeline = self._dump_pipeline(f, ae, imputer, input_scaler)
+                results[os.path.split(f)[1]] = pipeline
+                all_model_files[best_epoch] = f
+            logging.info(f"Using the model of epoch {best_epoch}, lowest val loss.")
+            # list the model that produced the output tables last
+            model_epochs = [e for e in sorted(all_model_files) if e != best_epoch]
+            model_epochs.append(best_epoch)
+
+        # encode and decode training (0) and validation (1) set with the final model,
+        # or the best model with early stopping
+        labels = []
+        decoded = []
+        encoded = []
+        train_samples = len(train_loader.data)
+        with autoencoder.inference():
+            for flag, loader in enumerate([train_loader, val_loader]):
+                for batchinputs, batchlabels in loader:
+                    encoder_out, decoder_out = ae(batchinputs)
+                    length = len(batchlabels)
+                    labelarray = np.full((length, 1), flag)
+                    labelarray = np.concatenate(
+                        [batchlabels.numpy(), labelarray], axis=1
+                    )
+                    labels.append(labelarray)
+                    decoded.append(decoder_out.cpu().numpy())
+                    encod = encoder_out.cpu().numpy()
+                    encoded.append(encod)
         logging.debug(f"train_samples={train_samples}")
 
         encoded = np.concatenate(encoded)
@@ -713,10 +1154,13 @@ class AETraining(AbstractPlugin):
         lcols.append("Autoencoder")
         # create train/validation labels
         labels = np.concatenate(labels)
-        label_df = pd.DataFrame(labels, columns=lcols)  # , dtype='category')
-        label_encoders["Autoencoder"].fit(["training", "validation"])
-        label_df = label_df.apply(lambda x: label_encoders[x.name].inverse_transform(x))
-        label_df = label_df.astype("category")
+        categories = dict(categories, Autoencoder=["training", "validation"])
+        label_df = pd.DataFrame(
+            {
+                col: pd.Categorical.from_codes(labels[:, i], categories[col])
+                for i, col in enumerate(lcols)
+            }
+        )
 
         decoded_cols = [f"AE Recon {s}" for s in self.params["features"]]
         decoded_df = pd.concat(
@@ -738,27 +1182,7 @@ class AETraining(AbstractPlugin):
         )
         encoded_df = encoded_df.set_index(data.index)
 
-        epoch_list = [str(e) for e in range(1, self.params["epoches"] + 1)]
-        parts = modelfile  # self.params["modelfile"].split(".")
-        presuf = (
-            ["".join(parts[: len(parts) - 1]), f".{parts[-1]}"]
-            if len(parts) > 1
-            else parts + [""]
-        )
-        all_model_files = {}
-        for epoch, ae in checkpoints:
-            f = (
-                f"{presuf[0]}{presuf[1]}_epoch{epoch:04d}".replace(".model", "")
-                + ".model"
-            )
-            pipeline = make_pipeline(imputer, input_scaler, ae)
-            dump(
-                pipeline,
-                filename=f,
-            )
-            results[os.path.split(f)[1]] = pipeline
-            all_model_files[epoch] = f
-
+        epoch_list = [str(e) for e in range(1, len(loss_train) + 1)]
         loss_df = pd.DataFrame(
             {
                 "Epoch": epoch_list,
@@ -768,8 +1192,7 @@ class AETraining(AbstractPlugin):
                 "Training Loss": loss_train,
                 "Validation Loss": loss_val,
                 "Model File": [
-                    all_model_files.get(e, "---")
-                    for e in range(1, self.params["epoches"] + 1)
+                    all_model_files.get(e, "---") for e in range(1, len(loss_train) + 1)
                 ],
             }
         )
@@ -788,19 +1211,11 @@ class AETraining(AbstractPlugin):
                 f"Table: AE Loss-{batch_size}-{learning_rate}-{weight_decay}": loss_df,
                 f"Table: AE Decoded-{batch_size}-{learning_rate}-{weight_decay}": decoded_df,
                 f"Table: AE Encoded-{batch_size}-{learning_rate}-{weight_decay}": encoded_df,
-                "Model File": [v for v in all_model_files.values()],
+                "Model File": [all_model_files[e] for e in model_epochs],
             }
         )
         if self.params["create_plots"]:
-            fig, ax = plt.subplots(constrained_layout=True)
-            ax.plot(range(1, len(loss_train) + 1), loss_train, "b-", label="train-loss")
-            ax.plot(range(1, len(loss_val) + 1), loss_val, "r-", label="val-loss")
-            ax.grid("on")
-            ax.set_ylabel("loss")
-            ax.set_xlabel("epoch")
-            ax.legend(["training", "testing"], loc="upper right")
-            ax.xaxis.set_major_locator(MaxNLocator(integer=True))
-            self._add_picker(fig)
+            fig = self._loss_plot(loss_train, loss_val)
             results.update(
                 {
                     f"Plot: AE Loss-{batch_size}-{learning_rate}-{weight_decay}": fig,
@@ -9,6 +9,7 @@ Created on Wed Dec 16 14:18:30 2020
 import logging
 import itertools
 import pandas as pd
+from flim.core.aggregates import grouped_percentiles
 from flim.plugin import plugin
 from flim.plugin import AbstractPlugin
 import matplotlib.figure
@@ -20,6 +21,37 @@ import flim.resources
 import numpy as np
 import matplotlib.ticker as mtick
 
+IQR_PERCENTILES = [25, 75]
+
+
+def _iqr_error(data, feature, categories, mean):
+    """Calculates asymmetric error bars spanning the 25th to 75th percentile.
+
+    The bars start at the mean. If the mean lies outside the interquartile range of a
+    skewed group, the side facing away from the range is clipped at 0 and the bar
+    shows only the span from the mean to the farther percentile.
+
+    Returns:
+        tuple(pandas.DataFrame): distances of lower and upper percentile from mean.
+    """
+    table = grouped_percentiles(data, feature, categories, IQR_PERCENTILES)
+    if len(categories) == 0:
+        table.index = mean.index
+    else:
+        table = table.reindex(index=mean.index)
+    lower = mean - table.xs(IQR_PERCENTILES[0], axis=1, level=1)
+    upper = table.xs(IQR_PERCENTILES[1], axis=1, level=1) - mean
+    return lower.clip(lower=0), upper.clip(lower=0)
+
+
+def _asymmetric_error(lower, upper, error_bar):
+    """Converts lower/upper error frames to the (columns, 2, rows) array used by pandas plots."""
+    lower = np.asarray(lower, dtype=float)
+    upper = np.asarray(upper, dtype=float)
+    if error_bar == "+":
+        lower = np.zeros_like(lower)
+    return np.stack([lower.T, upper.T], axis=1)
+
 
 def grouped_meanbarplot(
     data,
@@ -52,7 +84,9 @@ def grouped_meanbarplot(
         mean.loc[0] = data[feature].mean()
         if error_bar != "None":
             error = pd.DataFrame(columns=feature)
-            if error_type == "std":
+            if error_type == "IQR":
+                error = _iqr_error(data, feature, categories, mean)
+            elif error_type == "std":
                 error.loc[0] = data[feature].std()
             else:
                 error.loc[0] = data[feature].sem()
@@ -62,11 +96,14 @@ def grouped_meanbarplot(
             # sum all columns, than devide means[all columns] by sum (row-by-row) and convert to percent
             sum = mean.abs().sum(axis=1)
             mean = mean.div(sum, axis=0) * 100.0
-            if error is not None:
+            if isinstance(error, tuple):
+                error = tuple(e.div(sum, axis=0) * 100.0 for e in error)
+            elif error is not None:
                 error = error.div(sum, axis=0) * 100.0
-        if error_bar == "+":
-            error_vals = error.to_numpy().flatten()
-            error = [[np.zeros_like(error_vals), error_vals]]
+        if isinstance(error, tuple):
+            error = _asymmetric_error(*error, error_bar)
+        elif error_bar == "+":
+            error = _asymmetric_error(error, error, error_bar)
         ticklabels = ""  # mean.index.values
         if orientation == "horizontal":
             mean.plot.barh(
@@ -96,7 +133,9 @@ def grouped_meanbarplot(
             logging.debug("Single value per group. Keeping index of original data.")
             mean = mean.reindex(index=dataindex)
         if error_bar != "None":
-            if error_type == "std":
+            if error_type == "IQR":
+                error = _iqr_error(groupeddata.obj, feature, categories, mean)
+            elif error_type == "std":
                 error = groupeddata.std()
             else:
                 error = groupeddata.sem()
@@ -106,7 +145,9 @@ def grouped_meanbarplot(
             # sum all columns, than devide means[all columns]  by sum (row-by-row)
             sum = mean.abs().sum(axis=1)
             mean = mean.div(sum, axis=0) * 100.0
-            if error is not None:
+            if isinstance(error, tuple):
+                error = tuple(e.div(sum, axis=0) * 100.0 for e in error)
+            elif error is not None:
                 error = error.div(sum, axis=0) * 100.0
         num_bars = len(mean)
         if not stacked and pivot_level < len(categories):
@@ -114,10 +155,16 @@ def grouped_meanbarplot(
             logging.debug(f"Unstacking: {pivot_level}, {unstack_level}")
             mean = mean.unstack(unstack_level)
             mean = mean.dropna(how="all", axis=0)
-            if error is not None:
+            if isinstance(error, tuple):
+                error = tuple(
+                    e.unstack(unstack_level).reindex(index=mean.index) for e in error
+                )
+            elif error is not None:
                 error = error.unstack(unstack_level)
                 error = error.dropna(how="all", axis=0)
-        if error_bar == "+":
+        if isinstance(error, tuple):
+            error = _asymmetric_error(*error, error_bar)
+        elif error_bar == "+":
             error = error.transpose()
             dim = error.shape
             zeros = np.zeros_like(error)
@@ -311,7 +358,7 @@ class BarPlotConfigDlg(BasicAnalysisConfigDlg):
         )
 
         tsizer = wx.BoxSizer(wx.HORIZONTAL)
-        etype_opts = ["std", "s.e.m."]
+        etype_opts = ["std", "s.e.m.", "IQR"]
         sel_etype = self.etype
         if sel_etype not in sel_etype:
             sel_etype = sel_etype[0]
@@ -378,7 +425,7 @@ class BarPlot(AbstractPlugin):
                 "bar_type": "single",  # 'stacked', '100% stacked'
                 "dropna": True,
                 "error_bar": "+/-",  # '+', 'None'
-                "error_type": "std",  # 's.e.m'
+                "error_type": "std",  # 's.e.m', 'IQR'
                 "legend": True,
             }
         )
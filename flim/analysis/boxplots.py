@@ -7,11 +7,14 @@ Created on Thu Dec 17 16:11:37 2020
 """
 
 import logging
+import numpy as np
 import pandas as pd
+from flim.core.aggregates import group_codes, grouped_percentiles_by_codes
 from flim.plugin import plugin
 from flim.plugin import AbstractPlugin
 from flim.gui.dialogs import BasicAnalysisConfigDlg
 import wx
+import matplotlib.figure
 import matplotlib.pyplot as plt
 import seaborn as sns
 from importlib_resources import files
@@ -33,6 +36,25 @@ class BoxPlot(AbstractPlugin):
     def get_required_features(self):
         return ["any"]
 
+    def get_default_parameters(self):
+        params = super().get_default_parameters()
+        params.update(
+            {
+                "summary_table": False,
+            }
+        )
+        return params
+
+    def output_definition(self):
+        outputs = {
+            f"Box Plot {f}": matplotlib.figure.Figure for f in self.params["features"]
+        }
+        if self.params["summary_table"]:
+            outputs.update(
+                {f"Table: Box Plot {f}": pd.DataFrame for f in self.params["features"]}
+            )
+        return outputs
+
     def get_mapped_parameters(self):
         parallel_params = []
         for f in self.params["features"]:
@@ -63,6 +85,11 @@ class BoxPlot(AbstractPlugin):
     def execute(self):
         results = {}
         data = list(self.input.values())[0].copy()
+        if self.params["summary_table"]:
+            for feature in sorted(self.params["features"]):
+                results[f"Table: Box Plot {feature}"] = self._box_stats(
+                    data, feature, self.params["grouping"]
+                )
         categories = data.select_dtypes("category").columns.values
         for c in categories:
             data[c] = data[c].astype("str")
@@ -73,6 +100,53 @@ class BoxPlot(AbstractPlugin):
             results[f"Box Plot {feature}"] = fig
         return results
 
+    def _box_stats(self, data, feature, categories=[], whis=1.5):
+        """Calculates quartiles and whisker ends drawn in the box plot for each group.
+
+        Quartiles are extracted from a single sort of the feature's values per group.
+        Whiskers extend to the most extreme values within whis * IQR of the box.
+
+        Returns:
+            pandas.DataFrame: box statistics, one row per group.
+        """
+        codes, keys = group_codes(data, categories)
+        table = grouped_percentiles_by_codes(
+            data, [feature], codes, keys, [25, 50, 75]
+        )[feature]
+        q1 = table[25].to_numpy()
+        q3 = table[75].to_numpy()
+        iqr = q3 - q1
+        values = data[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+        valid = (codes >= 0) & ~np.isnan(values)
+        values = values[valid]
+        codes = codes[valid]
+        lowfence = (q1 - whis * iqr)[codes]
+        highfence = (q3 + whis * iqr)[codes]
+        whislo = np.full(len(keys), np.inf)
+        whishi = np.full(len(keys), -np.inf)
+        inside = values >= lowfence
+        np.minimum.at(whislo, codes[inside], values[inside])
+        inside = values <= highfence
+        np.maximum.at(whishi, codes[inside], values[inside])
+        outliers = np.bincount(
+            codes[(values < lowfence) | (values > highfence)], minlength=len(keys)
+        )
+        stats = pd.DataFrame(
+            {
+                "count": np.bincount(codes, minlength=len(keys)),
+                "lower whisker": whislo,
+                "25 percentile": q1,
+                "median": table[50].to_numpy(),
+                "75 percentile": q3,
+                "upper whisker": whishi,
+                "outliers": outliers,
+            },
+            index=keys,
+        ).replace([np.inf, -np.inf], np.nan)
+        if len(categories) > 0:
+            stats = stats.reset_index()
+        return stats
+
     def _grouped_plot(
         self,
         data,
@@ -15,6 +15,7 @@ import wx
 import matplotlib.pyplot as plt
 from importlib_resources import files
 import flim.resources
+from flim.core.aggregates import grouped_histograms
 from flim.plugin import plugin
 
 
@@ -34,6 +35,7 @@ class FreqHistoConfigDlg(BasicAnalysisConfigDlg):
         cumulative=False,
         histtype="step",
         datatable=False,
+        plot=True,
         featuresettings={},
         settingspecs={},
         autosave=True,
@@ -44,6 +46,7 @@ class FreqHistoConfigDlg(BasicAnalysisConfigDlg):
         self.cumulative = cumulative
         self.histtype = histtype
         self.datatable = datatable
+        self.plot = plot
 
         super().__init__(
             parent,
@@ -102,6 +105,10 @@ class FreqHistoConfigDlg(BasicAnalysisConfigDlg):
             self.showdata_cb, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        self.plot_cb = wx.CheckBox(self.panel, wx.ID_ANY, label="Plot")
+        self.plot_cb.SetValue(self.plot)
+        optsizer.Add(self.plot_cb, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5)
+
         return [optsizer]
 
     def _get_selected(self):
@@ -110,6 +117,7 @@ class FreqHistoConfigDlg(BasicAnalysisConfigDlg):
         params["cumulative"] = self.cumulative_cb.GetValue()
         params["histtype"] = self.histtype_combobox.GetValue()
         params["datatable"] = self.showdata_cb.GetValue()
+        params["plot"] = self.plot_cb.GetValue()
         return params
 
 
@@ -136,6 +144,7 @@ class FreqHisto(AbstractPlugin):
         params["histtype"] = "step"  # 'bar', 'barstacked', 'step', 'stepfilled'
         params["stacked"] = False
         params["datatable"] = False
+        params["plot"] = True
         params["featuresettings"] = {
             "trp t1": [0, 8000, 81, ["Treatment"]],
             "trp t2": [0, 8000, 81, ["Treatment"]],
@@ -210,6 +219,7 @@ class FreqHisto(AbstractPlugin):
             cumulative=self.params["cumulative"],
             histtype=self.params["histtype"],
             datatable=self.params["datatable"],
+            plot=self.params["plot"],
             featuresettings=self.params["featuresettings"],
             settingspecs=binspecs,
             autosave=self.params["autosave"],
@@ -225,18 +235,22 @@ class FreqHisto(AbstractPlugin):
     def execute(self):
         data = list(self.input.values())[0]
         results = {}
-        density = self.params["density"]
         histtype = self.params["histtype"]
-        cumulative = self.params["cumulative"]
-        self.stacked = self.params["stacked"]
+        # matplotlib always stacks 'barstacked' histograms
+        self.stacked = self.params["stacked"] or histtype == "barstacked"
         self.datatable = self.params["datatable"]
-        bins = 100
-        for header in sorted(self.params["features"]):
+        features = sorted(self.params["features"])
+        groups = self.params["grouping"]
+        if groups is None:
+            groups = []
+        ranges = {}
+        bins = {}
+        for header in features:
             mrange = (data[header].min(), data[header].max())
             try:
                 hconfig = self.params["featuresettings"][header]
-                mrange = (hconfig["min"], hconfig["max"])
-                bins = hconfig["bins"]
+                ranges[header] = (hconfig["min"], hconfig["max"])
+                bins[header] = hconfig["bins"]
             except:
                 logging.debug("\tmissing binning parameters, using defaults.")
                 self.params["featuresettings"][header] = {
@@ -244,113 +258,105 @@ class FreqHisto(AbstractPlugin):
                     "max": mrange[1],
                     "bins": 100,
                 }
-            logging.debug(
-                f"\tcreating frequency histogram plot for {header} with {bins} bins,"
-                f" range {mrange}"
-            )
-            # categories = [col for col in self.flimanalyzer.get_importer().get_parser().get_regexpatterns()]
-            #            fig, ax = MatplotlibFigure()
-            # fig = plt.figure(FigureClass=MatplotlibFigure)
-            # ax = fig.add_subplot(111)
-            binvalues, binedges, groupnames, fig, ax = self.histogram(
-                data,
-                header,
-                groups=self.params["grouping"],
-                normalize=100,
-                range=mrange,
-                bins=bins,
-                histtype=histtype,
-                cumulative=cumulative,
-                density=density,
-                stacked=self.stacked,
-                alpha=0.5,
-            )
-
-            results[f"Frequency Histo Plot: {header}"] = fig
+                ranges[header] = mrange
+                bins[header] = 100
+
+        # bin counts for all features and groups, computed without matplotlib
+        normalize = 100
+        histograms, keys = grouped_histograms(
+            data,
+            features,
+            grouping=groups,
+            bins=bins,
+            ranges=ranges,
+            normalize=normalize,
+            stacked=self.stacked,
+            cumulative=self.params["cumulative"],
+            density=self.params["density"],
+        )
+        if len(groups) == 0:
+            groupnames = ["all"]
+        else:
+            # table headers use the group names yielded by iterating the groupby;
+            # one row per group keeps this cheap
+            groupnames = [
+                name
+                for name, _ in keys.to_frame(index=False).groupby(
+                    groups, observed=True, sort=False
+                )
+            ]
+        if normalize == 100:
+            groupnames = [f"{n} [rel %]" for n in groupnames]
+
+        for header in features:
+            binvalues, binedges = histograms[header]
+            if self.params["plot"]:
+                logging.debug(
+                    f"\tcreating frequency histogram plot for {header} with"
+                    f" {bins[header]} bins, range {ranges[header]}"
+                )
+                fig, ax = self.histogram(
+                    binvalues,
+                    binedges,
+                    header,
+                    keys,
+                    groups=groups,
+                    normalize=normalize,
+                    histtype=histtype,
+                    alpha=0.5,
+                )
+                results[f"Frequency Histo Plot: {header}"] = fig
 
             if self.datatable:
                 df = pd.DataFrame()
                 df["bin edge low"] = binedges[:-1]
                 df["bin edge high"] = binedges[1:]
-                if len(binvalues.shape) == 1:
-                    df[groupnames[0]] = binvalues
-                else:
-                    for i in range(len(binvalues)):
-                        df[groupnames[i]] = binvalues[i]
-                df.reset_index()
-                # bindata = core.plots.bindata(binvalues,binedges, groupnames)
-                # bindata = bindata.reset_index()
+                for i in range(len(binvalues)):
+                    df[groupnames[i]] = binvalues[i]
                 results[f"Frequency Histo Table: {header}"] = df
         return results
 
     def histogram(
         self,
-        data,
+        binvalues,
+        binedges,
         column,
+        keys,
         title=None,
         groups=[],
         normalize=None,
-        titlesuffix=None,
         **kwargs,
     ):
-        # plt.rcParams.update({'figure.autolayout': True})
-
-        if data is None or not column in data.columns.values:
-            return None, None
+        """Draws precomputed histograms, see flim.core.aggregates.grouped_histograms.
+
+        Args:
+            binvalues (numpy.ndarray): counts of shape (groups, bins); stacked counts
+                if self.stacked is set.
+            binedges (numpy.ndarray): bin edges.
+            column (str): feature name.
+            keys (pandas.Index): group keys.
+            title (str): plot title; defaults to column and grouping.
+            groups (list(str)): grouping categories.
+            normalize (float): normalization used for the counts.
+            **kwargs: passed to matplotlib's Axes.hist.
+
+        Returns:
+            tuple(matplotlib.figure.Figure, matplotlib.axes.Axes): figure and axes.
+        """
         fig, ax = plt.subplots(constrained_layout=True)
         if groups is None:
             groups = []
 
-        newkwargs = kwargs.copy()
-        # newkwargs.update({'range':(minx,maxx)})
-        totalcounts = data[column].dropna(axis=0, how="all").count()
-        pltdata = []
-        weights = []
-        groupnames = []
-        if len(groups) == 0:
-            groupnames.append("all")
-            pltdata = data[column].values
-            newkwargs.update({"label": "all"})
-            if normalize is not None:
-                weights = (
-                    np.ones_like(data[column].values) / float(totalcounts) * normalize
-                )
-        else:
-            groupeddata = data.groupby(groups, observed=True)
-            newkwargs.update({"label": list(groupeddata.groups)})
-            for name, group in groupeddata:
-                if len(group[column]) > 0:
-                    groupnames.append(name)
-                    pltdata.append(group[column].values)
-                    totalcount = len(data)
-                    if not self.stacked:
-                        totalcounts = group[column].count()
-                    if normalize is not None:
-                        weights.append(
-                            np.ones_like(group[column].values)
-                            / float(totalcounts)
-                            * normalize
-                        )
         if normalize is not None:
             slabel = ""
             if not self.stacked:
                 slabel = "in each group "
             if normalize == 100:
                 ax.set_ylabel(f"relative counts {slabel}[%]")
-                groupnames = [f"{n} [rel %]" for n in groupnames]
             else:
                 ax.set_ylabel("relative counts (norm. to %.1f)" % normalize)
-
-            newkwargs.update(
-                {
-                    "weights": weights,
-                    #'density':False,
-                }
-            )
         else:
             ax.set_ylabel("counts")
-        #    if newkwargs[range] is not None:
-        #        ax.set_xlim(newkwargs[range[0]],newkwargs[range[1]])
         ax.set_xlabel(column)
 
         if title is None:
@@ -362,16 +368,33 @@ class FreqHisto(AbstractPlugin):
 
         fig.set_size_inches(8, 8)
 
-        binvalues, binedges, patches = ax.hist(pltdata, **newkwargs)
+        # one weighted sample per bin reproduces the precomputed counts; matplotlib
+        # stacks the datasets itself, so stacked counts are passed as increments
+        weights = binvalues
+        if self.stacked:
+            weights = np.diff(binvalues, axis=0, prepend=0)
+        if len(groups) == 0:
+            x = binedges[:-1]
+            weights = weights[0]
+            labels = "all"
+        else:
+            x = [binedges[:-1]] * len(binvalues)
+            weights = list(weights)
+            labels = [str(k) for k in keys]
+        ax.hist(
+            x,
+            bins=binedges,
+            weights=weights,
+            stacked=self.stacked,
+            label=labels,
+            **kwargs,
+        )
         if len(groups) > 0 and len(binvalues) > 1:
             h, labels = ax.get_legend_handles_labels()
-            # labels = [l.encode('ascii','ignore').split(',')[1].strip(' \)') for l in labels]
             labels = [
                 l.replace("'", "").replace("(", "").replace(")", "") for l in labels
             ]
             no_legendcols = len(binvalues) // 30 + 1
-            # chartbox = ax.get_position()
-            # ax.set_position([chartbox.x0, chartbox.y0, chartbox.width* (1-0.2 * no_legendcols), chartbox.height])
             ax.legend(
                 labels=labels,
                 loc="upper left",
@@ -381,13 +404,5 @@ class FreqHisto(AbstractPlugin):
                 ncol=no_legendcols,
             )
 
-        # plt.rcParams.update({'figure.autolayout': False})
         self._add_picker(fig)
-
-        return (
-            np.array(binvalues),
-            binedges,
-            groupnames,
-            fig,
-            ax,
-        )
+        return fig, ax
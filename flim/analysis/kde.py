@@ -20,6 +20,7 @@ import wx
 from importlib_resources import files
 import flim.resources
 from prefect import Task
+from flim.core.aggregates import grouped_kde
 from flim.plugin import plugin, ALL_FEATURES
 
 
@@ -47,7 +48,9 @@ class KDE(AbstractPlugin, Task):
         features = self.params["features"]
         if features == ALL_FEATURES and isinstance(data, pd.DataFrame):
             features = list(data.select_dtypes(np.number).columns.values)
-        return_type = {"Table: KDE {header}": pd.DataFrame for feature in features}
+        return_type = {f"Table: KDE {feature}": pd.DataFrame for feature in features}
+        if not self.params["return_plot"]:
+            return return_type
         if self.params["single_plot"]:
             return_type["Plot: KDE"] = matplotlib.figure.Figure
         else:
@@ -103,7 +106,10 @@ class KDE(AbstractPlugin, Task):
         features = self.params["features"]
         if features == ALL_FEATURES:
             features = list(data.select_dtypes(np.number).columns.values)
-        if self.params["single_plot"] and len(features) > 1:
+        return_plot = self.params.get("return_plot")
+        single_plot = self.params["single_plot"] and len(features) > 1
+        cols = 1
+        if return_plot and single_plot:
             n = len(features)
             if self.params["col_wrap"] == 0:
                 # auto
@@ -119,36 +125,40 @@ class KDE(AbstractPlugin, Task):
                     fig.delaxes(axs[j // cols][j % cols])
             self._add_picker(fig)
         for i, header in enumerate(sorted(features)):
-            if self.params["single_plot"] and len(features) > 1:
+            # table only runs do not create any figures
+            ax = None
+            if return_plot and single_plot:
                 if axs.ndim == 2:
                     ax = axs[i // cols][i % cols]
                 else:
                     ax = axs[i]
-            else:
+            elif return_plot:
                 fig, ax = plt.subplots()
                 self._add_picker(fig)
-            bins = 100
             cdata = data[header].replace([np.inf, -np.inf], np.nan).dropna()
-            len(cdata)
             minx = cdata.min()  # hconfig[0]
             maxx = cdata.max()  # hconfig[1]
-            logging.debug(f"Creating kde plot for {str(header)}, bins={str(bins)}")
+            logging.debug(f"Creating kde plot for {str(header)}")
             kde_data = self.grouped_kdeplot(
                 data,
                 header,
                 groups=self.params["grouping"],
                 clip=(minx, maxx),
                 ax=ax,
-                return_plot=self.params.get("return_plot"),
+                return_plot=return_plot,
                 show_legend=not self.params["single_plot"] or i == cols - 1,
-            )  # bins=bins, hist=False,
-            if not np.isinf([minx, maxx]).any() and not np.isnan([minx, maxx]).any():
+            )
+            if (
+                ax is not None
+                and not np.isinf([minx, maxx]).any()
+                and not np.isnan([minx, maxx]).any()
+            ):
                 ax.set_xlim(minx, maxx)
-            if self.params.get("return_plot") and not self.params["single_plot"]:
+            if return_plot and not self.params["single_plot"]:
                 fig.tight_layout()
                 results[f"Plot: KDE {header}"] = fig
             results[f"Table: KDE {header}"] = kde_data
-        if self.params.get("return_plot") and self.params["single_plot"]:
+        if return_plot and self.params["single_plot"]:
             fig.tight_layout()
             results[f"Plot: KDE"] = fig
         return results
@@ -165,6 +175,7 @@ class KDE(AbstractPlugin, Task):
         dropna=True,
         linestyles=None,
         pivot_level=1,
+        clip=None,
         **kwargs,
     ):
         if data is None or not column in data.columns.values:
@@ -172,17 +183,11 @@ class KDE(AbstractPlugin, Task):
         if groups is None:
             groups = []
 
-        newkwargs = kwargs.copy()
-        newkwargs["ax"] = ax
-        newkwargs["warn_singular"] = False
-
-        cols = [c for c in groups]
-        cols.append(column)
-        if dropna:
-            data = data[cols].dropna(how="any", subset=[column])
+        # densities of all groups from a single binned FFT pass
+        kdes = grouped_kde(data, column, grouping=groups, clip=clip)
         df = pd.DataFrame()
         if len(groups) > 0:
-            gs = data.groupby(groups)
+            keys = list(kdes.keys())
             styles = []
             if linestyles is None and len(groups) == 2:
                 uniquevalues = [data[g].unique() for g in groups]
@@ -195,25 +200,27 @@ class KDE(AbstractPlugin, Task):
                         for ls in linestyles:
                             styles.append({"color": c, "linestyle": ls})
             logging.debug(f"styles={styles}")
-            index = 0
             labels = []
-            for name, groupdata in gs:
-                if len(groupdata[column]) > 0:
-                    name_fixed = self._fix_label(name)
-                    if len(styles) > index:
-                        newkwargs["color"] = styles[index]["color"]
-                        newkwargs["linestyle"] = styles[index]["linestyle"]
-                    try:
-                        kde = sns.kdeplot(groupdata[column], **newkwargs)
-                        x, y = kde.get_lines()[-1].get_data()
-                        df[name_fixed + "_x"] = x
-                        df[name_fixed + "_y"] = y
-                    except Exception as e:
-                        logging.error(e)
-                    labels.append(name_fixed)
-                index += 1
+            for name in keys:
+                name_fixed = self._fix_label(name)
+                x, y = kdes[name]
+                df[name_fixed + "_x"] = x
+                df[name_fixed + "_y"] = y
+                labels.append(name_fixed)
+                if return_plot:
+                    newkwargs = kwargs.copy()
+                    if len(styles) > 0:
+                        # style by position of the key's categories
+                        index = (
+                            data[groups[0]].cat.categories.get_loc(name[0])
+                            * len(data[groups[1]].cat.categories)
+                            + data[groups[1]].cat.categories.get_loc(name[1])
+                        )
+                        if len(styles) > index:
+                            newkwargs.update(styles[index])
+                    ax.plot(x, y, label=name_fixed, **newkwargs)
             no_legendcols = len(groups) // 30 + 1
-            if show_legend:
+            if return_plot and show_legend:
                 ax.legend(
                     labels=labels,
                     loc="upper left",
@@ -222,21 +229,15 @@ class KDE(AbstractPlugin, Task):
                     fontsize="small",
                     ncol=no_legendcols,
                 )
-        else:
-            try:
-                kde = sns.kdeplot(data[column], **newkwargs)
-                x, y = kde.get_lines()[-1].get_data()
-                df["ungrouped_x"] = x
-                df["ungrouped_y"] = y
-            except Exception as e:
-                logging.error(e)
-        ax.autoscale(enable=True, axis="y")
-        ax.set_ylim(0, None)
-        # if title is None:
-        #    title = column.replace("\n", " ")
-        #    if len(groups) > 0:
-        #        title = f"{title}"  # " grouped by {groups}"
-        # if len(title) > 0:
-        #    ax.set_title(title)
-
+        elif len(kdes) > 0:
+            x, y = list(kdes.values())[0]
+            df["ungrouped_x"] = x
+            df["ungrouped_y"] = y
+            if return_plot:
+                ax.plot(x, y, **kwargs)
+        if return_plot:
+            ax.set_xlabel(column)
+            ax.set_ylabel("Density")
+            ax.autoscale(enable=True, axis="y")
+            ax.set_ylim(0, None)
         return df
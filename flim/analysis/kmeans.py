@@ -11,19 +11,116 @@ import torch
 import torch.nn as nn
 from torch.autograd import Variable
 import matplotlib.pyplot as plt
+import matplotlib.figure
 from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
+from sklearn.metrics import silhouette_score, calinski_harabasz_score
+from joblib import Parallel, delayed
 import wx
 from wx.lib.masked import NumCtrl
 from importlib_resources import files, as_file
 
 from flim.plugin import plugin, AbstractPlugin
+from flim.core.aggregates import group_codes
 import flim.resources
 from flim.gui.dialogs import BasicAnalysisConfigDlg
 
 ALGO_OPTIONS = ["auto", "full", "elkan"]
 INIT_OPTIONS = ["k-means++", "random"]
 TOLERANCE_OPTONS = ["%.1e" % (10.0 ** (-b)) for b in range(2, 6)]
+MODE_OPTIONS = ["full", "minibatch"]
+
+
+def fit_kmeans(standard_data, params):
+    """Fits the clustering model to the standardized data.
+
+    In 'minibatch' mode the model is updated with partial fits over shuffled batches
+    of rows. Passes over the data are repeated until the squared shift of the cluster
+    centers drops below the tolerance, or max_iter passes.
+
+    Args:
+        standard_data (numpy.ndarray): standardized feature matrix.
+        params (dict): K-Means plugin parameters.
+
+    Returns:
+        KMeans or MiniBatchKMeans: the fitted model.
+    """
+    if params["mode"] == "minibatch":
+        kmeans = MiniBatchKMeans(
+            n_clusters=params["n_clusters"],
+            init=params["init"],
+            n_init=params["n_init"],
+            batch_size=params["batch_size"],
+            tol=params["tolerance"],
+            random_state=0,
+        )
+        rng = np.random.default_rng(0)
+        batch_size = max(params["batch_size"], params["n_clusters"])
+        centers = None
+        for epoch in range(params["max_iter"]):
+            order = rng.permutation(len(standard_data))
+            for start in range(0, len(order), batch_size):
+                batch = np.sort(order[start : start + batch_size])
+                kmeans.partial_fit(standard_data[batch])
+            if centers is not None:
+                shift = np.sum((kmeans.cluster_centers_ - centers) ** 2)
+                if shift <= params["tolerance"]:
+                    logging.debug(f"Mini-batch k-means converged after {epoch + 1}")
+                    break
+            centers = kmeans.cluster_centers_.copy()
+        return kmeans
+    kmeans = KMeans(
+        n_clusters=params["n_clusters"],
+        init=params["init"],
+        algorithm=params["algorithm"],
+        n_init=params["n_init"],
+        max_iter=params["max_iter"],
+        tol=params["tolerance"],
+        random_state=0,
+    )
+    return kmeans.fit(standard_data)
+
+
+def assign_clusters(kmeans, standard_data, chunksize=100000):
+    """Assigns all rows to the nearest cluster center in chunks of rows."""
+    labels = np.empty(len(standard_data), dtype=np.intp)
+    for start in range(0, len(standard_data), chunksize):
+        chunk = standard_data[start : start + chunksize]
+        labels[start : start + chunksize] = kmeans.predict(chunk)
+    return labels
+
+
+def sweep_fit(standard_data, params, sample=None, metric_sample=None):
+    """Fits one model of a cluster count sweep and scores it.
+
+    Args:
+        standard_data (numpy.ndarray): standardized feature matrix.
+        params (dict): K-Means plugin parameters, including n_clusters.
+        sample (numpy.ndarray): row positions to fit to; all rows if None.
+        metric_sample (numpy.ndarray): row positions used for silhouette and
+            Calinski-Harabasz scores.
+
+    Returns:
+        tuple(KMeans or MiniBatchKMeans, dict): the fitted model and its scores.
+    """
+    fitdata = standard_data if sample is None else standard_data[sample]
+    kmeans = fit_kmeans(fitdata, params)
+    if sample is None and params["mode"] != "minibatch":
+        inertia = kmeans.inertia_
+    else:
+        inertia = -kmeans.score(standard_data)
+    metricdata = standard_data
+    if metric_sample is not None:
+        metricdata = standard_data[metric_sample]
+    labels = kmeans.predict(metricdata)
+    scores = {"Clusters": params["n_clusters"], "Inertia": inertia}
+    if len(np.unique(labels)) > 1:
+        scores["Silhouette"] = silhouette_score(metricdata, labels)
+        scores["Calinski-Harabasz"] = calinski_harabasz_score(metricdata, labels)
+    else:
+        scores["Silhouette"] = np.nan
+        scores["Calinski-Harabasz"] = np.nan
+    return kmeans, scores
 
 
 class KMeansClusteringConfigDlg(BasicAnalysisConfigDlg):
@@ -41,6 +138,10 @@ class KMeansClusteringConfigDlg(BasicAnalysisConfigDlg):
         n_init=4,
         max_iter=300,
         tolerance=1e-4,
+        mode="full",
+        sample_size=0,
+        sweep=False,
+        sweep_max=10,
         autosave=True,
         working_dir="",
     ):
@@ -51,11 +152,14 @@ class KMeansClusteringConfigDlg(BasicAnalysisConfigDlg):
         self.n_init = n_init
         self.tolerance = tolerance
         self.algorithm = algorithm
+        self.mode = mode
+        self.sample_size = sample_size
+        self.sweep = sweep
+        self.sweep_max = sweep_max
         super().__init__(
             parent,
             title,
             input=input,
-            enablegrouping=False,
             selectedgrouping=selectedgrouping,
             selectedfeatures=selectedfeatures,
             optgridrows=0,
@@ -157,6 +261,48 @@ class KMeansClusteringConfigDlg(BasicAnalysisConfigDlg):
             self.tol_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        self.mode_combobox = wx.ComboBox(
+            self.panel,
+            wx.ID_ANY,
+            style=wx.CB_READONLY,
+            value=self.mode,
+            choices=MODE_OPTIONS,
+        )
+        option_sizer.Add(
+            wx.StaticText(self.panel, label="Mode"),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        option_sizer.Add(
+            self.mode_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
+        self.sample_spinner = wx.SpinCtrl(
+            self.panel, wx.ID_ANY, initial=self.sample_size, min=0, max=100000000
+        )
+        option_sizer.Add(
+            wx.StaticText(self.panel, label="Sample Size"),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        option_sizer.Add(
+            self.sample_spinner, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
+        self.sweep_cb = wx.CheckBox(self.panel, wx.ID_ANY, label="Sweep up to")
+        self.sweep_cb.SetValue(self.sweep)
+        option_sizer.Add(
+            self.sweep_cb, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+        self.sweep_spinner = wx.SpinCtrl(
+            self.panel, wx.ID_ANY, initial=self.sweep_max, min=3, max=50
+        )
+        option_sizer.Add(
+            self.sweep_spinner, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
         return [option_sizer]
 
     def OnBrowse(self, event):
@@ -179,6 +325,10 @@ class KMeansClusteringConfigDlg(BasicAnalysisConfigDlg):
         params["n_init"] = self.n_init_spinner.GetValue()
         params["max_iter"] = self.miter_spinner.GetValue()
         params["tolerance"] = float(self.tol_combobox.GetValue())
+        params["mode"] = self.mode_combobox.GetValue()
+        params["sample_size"] = self.sample_spinner.GetValue()
+        params["sweep"] = self.sweep_cb.GetValue()
+        params["sweep_max"] = self.sweep_spinner.GetValue()
         return params
 
 
@@ -208,12 +358,25 @@ class KMeansClustering(AbstractPlugin):
                 "n_init": 4,
                 "max_iter": 300,
                 "tolerance": 1e-4,
+                "mode": "full",  # 'minibatch'
+                "batch_size": 10000,
+                "sample_size": 0,  # fit on all rows
+                "chunksize": 100000,
+                "sweep": False,
+                "sweep_min": 2,
+                "sweep_max": 10,
+                "metric_sample_size": 10000,
+                "n_jobs": 1,
             }
         )
         return params
 
     def output_definition(self):
-        return {"Table: K-Means": pd.DataFrame}
+        outputs = {"Table: K-Means": pd.DataFrame}
+        if self.params["sweep"]:
+            outputs["Table: K-Means Sweep"] = pd.DataFrame
+            outputs["Plot: K-Means Elbow"] = matplotlib.figure.Figure
+        return outputs
 
     def run_configuration_dialog(self, parent, data_choices={}):
         dlg = KMeansClusteringConfigDlg(
@@ -229,6 +392,10 @@ class KMeansClustering(AbstractPlugin):
             n_init=self.params["n_init"],
             max_iter=self.params["max_iter"],
             tolerance=self.params["tolerance"],
+            mode=self.params["mode"],
+            sample_size=self.params["sample_size"],
+            sweep=self.params["sweep"],
+            sweep_max=self.params["sweep_max"],
             autosave=self.params["autosave"],
             working_dir=self.params["working_dir"],
         )
@@ -239,40 +406,107 @@ class KMeansClustering(AbstractPlugin):
         self.configure(**params)
         return self.params
 
+    def _sample(self, cat_df, n):
+        """Draws a sample of row positions, stratified by the grouping categories.
+
+        Args:
+            cat_df (pandas.DataFrame): category columns of the rows.
+            n (int): approximate sample size.
+
+        Returns:
+            numpy.ndarray: sorted row positions.
+        """
+        strata = [c for c in self.params["grouping"] if c in cat_df.columns]
+        codes, _ = group_codes(cat_df, strata)
+        positions = pd.Series(np.arange(len(cat_df)))
+        # proportional allocation, each stratum keeps its share of rows
+        sample = positions.groupby(codes).sample(
+            frac=min(1.0, n / len(cat_df)), random_state=0
+        )
+        return np.sort(sample.to_numpy())
+
+    def _sweep(self, standard_data, sample):
+        """Fits and scores models for a range of cluster counts in parallel processes.
+
+        The standardized matrix is shared with the worker processes (memory mapped by
+        joblib) instead of being recomputed per cluster count.
+
+        Returns:
+            tuple(dict, pandas.DataFrame): fitted model per cluster count, scores.
+        """
+        ks = range(self.params["sweep_min"], self.params["sweep_max"] + 1)
+        metric_sample = None
+        metric_size = self.params["metric_sample_size"]
+        if 0 < metric_size < len(standard_data):
+            rng = np.random.default_rng(0)
+            metric_sample = np.sort(
+                rng.choice(len(standard_data), metric_size, replace=False)
+            )
+        fits = Parallel(n_jobs=self.params["n_jobs"])(
+            delayed(sweep_fit)(
+                standard_data, {**self.params, "n_clusters": k}, sample, metric_sample
+            )
+            for k in ks
+        )
+        models = {k: kmeans for k, (kmeans, _) in zip(ks, fits)}
+        scores = pd.DataFrame([scores for _, scores in fits])
+        return models, scores
+
+    def _elbow_plot(self, scores):
+        fig, ax = plt.subplots(constrained_layout=True)
+        ax.plot(scores["Clusters"], scores["Inertia"], "o-", color="C0")
+        ax.set_xlabel("Number of Clusters")
+        ax.set_ylabel("Inertia", color="C0")
+        ax2 = ax.twinx()
+        ax2.plot(scores["Clusters"], scores["Silhouette"], "s--", color="C1")
+        ax2.set_ylabel("Silhouette", color="C1")
+        ax.set_title("K-Means Elbow")
+        self._add_picker(fig)
+        return fig
+
     def execute(self):
         original = list(self.input.values())[0]
-        data = original[self.params["features"]]
+        features = self.params["features"]
+        data = original[features]
         data = data.dropna(how="any", axis=0).reset_index()
         oldidx = data["index"]
-        features = self.params["features"]
-        if len(features) == 1:
-            # reshape 1d array
-            data_no_class = data[features].values.reshape((-1, 1))
-        else:
-            data_no_class = data[features].values
-        scaler = StandardScaler()
-        scaler.fit(data_no_class)
-        standard_data = scaler.transform(data_no_class)
-        kmeans = KMeans(
-            n_clusters=self.params["n_clusters"],
-            init=self.params["init"],
-            algorithm=self.params["algorithm"],
-            n_init=self.params["n_init"],
-            max_iter=self.params["max_iter"],
-            tol=self.params["tolerance"],
-            random_state=0,
-        )
-        predict = kmeans.fit(standard_data)
         cat_cols = list(original.select_dtypes(["category"]).columns.values)
         cat_df = original.iloc[
             oldidx
         ].reset_index()  # match cat_df index w/ index of used prediction data
         cat_df = cat_df[cat_cols].copy()
 
+        data_no_class = data[features].to_numpy(dtype=np.float64)
+        scaler = StandardScaler()
+        scaler.fit(data_no_class)
+        standard_data = scaler.transform(data_no_class)
+        sample = None
+        sample_size = self.params["sample_size"]
+        if 0 < sample_size < len(standard_data):
+            sample = self._sample(cat_df, sample_size)
+            logging.debug(f"Fitting k-means to {len(sample)} sampled rows")
+
+        results = {}
+        models = {}
+        if self.params["sweep"]:
+            models, scores = self._sweep(standard_data, sample)
+            results["Table: K-Means Sweep"] = scores
+            results["Plot: K-Means Elbow"] = self._elbow_plot(scores)
+        kmeans = models.get(self.params["n_clusters"])
+        if kmeans is None:
+            fitdata = standard_data if sample is None else standard_data[sample]
+            kmeans = fit_kmeans(fitdata, self.params)
+        if sample is None and self.params["mode"] != "minibatch":
+            labels = kmeans.labels_
+        else:
+            labels = assign_clusters(kmeans, standard_data, self.params["chunksize"])
+
         predict_df = pd.DataFrame(data, columns=features)
         labelcol = self.params["cluster_prefix"]
-        predict_df[labelcol] = [f"{labelcol} {l + 1}" for l in predict.labels_]
-        predict_df[labelcol] = predict_df[labelcol].astype("category")
+        predict_df[labelcol] = pd.Categorical.from_codes(
+            labels,
+            categories=[f"{labelcol} {l + 1}" for l in range(kmeans.n_clusters)],
+        )
         predict_df = pd.concat([cat_df, predict_df], axis=1)
         neworder = [
             c for c in list(predict_df.select_dtypes(["category"]).columns.values)
@@ -281,25 +515,5 @@ class KMeansClustering(AbstractPlugin):
         neworder.extend(noncategories)
         predict_df = predict_df[neworder]
 
-        """
-        estimator = make_pipeline(StandardScaler(), kmeans).fit(data)
-        fit_time = time() - t0
-        results = [name, fit_time, estimator[-1].inertia_]
-        
-        # Define the metrics which require only the true labels and estimator
-        # labels
-        clustering_metrics = [
-            metrics.homogeneity_score,
-            metrics.completeness_score,
-            metrics.v_measure_score,
-            metrics.adjusted_rand_score,
-            metrics.adjusted_mutual_info_score,
-        ]
-        results += [m(labels, estimator[-1].labels_) for m in clustering_metrics]
-        # The silhouette score requires the full dataset
-        results += [
-            metrics.silhouette_score(data, estimator[-1].labels_, metric="euclidean", sample_size=300,)
-        ]
-        print (results)
-        """
-        return {"Table: K-Means": predict_df}
+        results["Table: K-Means"] = predict_df
+        return results
@@ -14,8 +14,14 @@ from importlib_resources import files
 import flim.resources
 import pandas as pd
 import numpy as np
-from scipy import stats
 from itertools import combinations
+from joblib import Parallel, delayed, effective_n_jobs
+from flim.core.pairwise import (
+    sorted_cells,
+    ks_2samp_sorted,
+    resampled_ks,
+    resampled_pvalue,
+)
 from flim.plugin import plugin
 
 
@@ -130,6 +136,11 @@ class KSStats(AbstractPlugin):
             {
                 "comparison": "Treatment",
                 "alpha": 0.05,
+                "method": "auto",  # 'exact', 'asymp'
+                "resampling": "None",  # 'permutation', 'bootstrap', 'both'
+                "n_resamples": 1000,
+                "seed": 0,
+                "n_jobs": 1,
             }
         )
         return params
@@ -181,6 +192,48 @@ class KSStats(AbstractPlugin):
             results[f"KS-stats: {header}"] = result
         return results
 
+    def _resampling_modes(self):
+        resampling = self.params["resampling"]
+        if resampling == "both":
+            return ["permutation", "bootstrap"]
+        elif resampling in ["permutation", "bootstrap"]:
+            return [resampling]
+        return []
+
+    def _pair_kststats(self, groupval, pair, data1, data2, alpha, seed, n_jobs):
+        """Runs KS test for a single pair of comparison values within a group."""
+        statistic, pvalue = ks_2samp_sorted(data1, data2, method=self.params["method"])
+        critical_d = calpha[alpha] * np.sqrt(
+            (len(data1) + len(data2)) / (len(data1) * len(data2))
+        )
+        row = [v for v in groupval]
+        dissimilar = statistic > critical_d and pvalue < alpha
+        row.extend(
+            [
+                pair[0],
+                pair[1],
+                f"{pair[0]}-{pair[1]}",
+                f"Yes" if dissimilar else "No",
+                len(data1),
+                len(data2),
+                pvalue,
+                statistic,
+                critical_d,
+            ]
+        )
+        modes = self._resampling_modes()
+        for mode, modeseed in zip(modes, seed.spawn(len(modes))):
+            resampled = resampled_ks(
+                data1,
+                data2,
+                n_resamples=self.params["n_resamples"],
+                mode=mode,
+                seed=modeseed,
+                n_jobs=n_jobs,
+            )
+            row.append(resampled_pvalue(statistic, resampled))
+        return row
+
     def feature_kststats(
         self, data, column, groups=[], comparison="", alpha=0.05, dropna=True
     ):
@@ -188,12 +241,10 @@ class KSStats(AbstractPlugin):
         if data is None or not column in data.columns.values:
             return None, None
         if len(groups) == 0:
-            groupvals = [("none",)]
             cols = ["Grouping"]
         else:
             # set groups based on categories excluding the comparison category
             groups = [g for g in groups if g != comparison]
-            groupvals = [name for name, _ in data.groupby(groups)]
             cols = [c for c in groups]
         dissimilar_label = f"dissimilar (<{alpha})"
         allcategories = [c for c in cols]
@@ -218,48 +269,25 @@ class KSStats(AbstractPlugin):
                 f"critical D ({alpha})",
             ]
         )
-        rdata = []
-        for groupval in groupvals:
-            if len(groups) == 0:
-                fdata = data
-            else:
-                # bracket group and grpupvals with backticks in case they contain whitespaces or special characters
-                querystr = " and ".join(
-                    [f'`{groups[i]}` == "{groupval[i]}"' for i in range(len(groupval))]
-                )
-                logging.debug(f"QUERY={querystr}, cols={data.columns.values}")
-                fdata = data.query(querystr)
-            if len(fdata) == 0:
-                continue
-            compgroups = {
-                name: splitdata for name, splitdata in fdata.groupby(comparison)
-            }
-            comb = combinations(compgroups.keys(), 2)
-            for c in comb:
-                data1 = compgroups[c[0]][column]
-                data2 = compgroups[c[1]][column]
-                if len(data1) == 0 or len(data2) == 0:
-                    continue
-                ks = stats.ks_2samp(data1, data2)
-                critical_d = calpha[alpha] * np.sqrt(
-                    (len(data1) + len(data2)) / (len(data1) * len(data2))
-                )
-                row = [v for v in groupval]
-                dissimilar = ks.statistic > critical_d and ks.pvalue < alpha
-                row.extend(
-                    [
-                        c[0],
-                        c[1],
-                        f"{c[0]}-{c[1]}",
-                        f"Yes" if dissimilar else "No",
-                        len(data1),
-                        len(data2),
-                        ks.pvalue,
-                        ks.statistic,
-                        critical_d,
-                    ]
-                )
-                rdata.append(row)
+        cols.extend([f"{mode} p-value" for mode in self._resampling_modes()])
+        # single groupby over groups + comparison, values sorted once per cell
+        cells = sorted_cells(data, column, groups, comparison, dropna=dropna)
+        if len(groups) == 0:
+            cells = {("none",): cells.get((), {})}
+        tasks = [
+            (groupval, pair, compgroups[pair[0]], compgroups[pair[1]])
+            for groupval, compgroups in cells.items()
+            for pair in combinations(compgroups.keys(), 2)
+        ]
+        # fixed seed per pair, results do not depend on n_jobs
+        seeds = np.random.SeedSequence(self.params["seed"]).spawn(len(tasks))
+        # parallelize across pairs, or across resample batches if there are few pairs
+        n_jobs = effective_n_jobs(self.params["n_jobs"])
+        outer_jobs, inner_jobs = (n_jobs, 1) if len(tasks) >= n_jobs else (1, n_jobs)
+        rdata = Parallel(n_jobs=outer_jobs, prefer="threads")(
+            delayed(self._pair_kststats)(*task, alpha, seed, inner_jobs)
+            for task, seed in zip(tasks, seeds)
+        )
         ksdata = pd.DataFrame(rdata, columns=cols)
         for ckey in allcategories:
             ksdata[ckey] = ksdata[ckey].astype("category")
@@ -11,12 +11,48 @@ import logging
 import torch
 import torch.optim as optim
 import torch.nn as nn
-from torch.autograd import Variable
 import numpy as np
 from sklearn.base import BaseEstimator, TransformerMixin
 from abc import abstractmethod
 
 
+def inference():
+    """Returns a context for forward passes without autograd graph recording."""
+    if hasattr(torch, "inference_mode"):
+        return torch.inference_mode()
+    return torch.no_grad()
+
+
+def set_torch_threads(threads=0, interop_threads=0):
+    """Sets the torch threading policy of the current (worker) process.
+
+    Args:
+        threads (int): number of intra-op threads. With 0, the cores are divided
+            among the tasks that run concurrently in this process, e.g. the threads of
+            a Dask worker.
+        interop_threads (int): number of inter-op threads, 0 keeps the torch default.
+            Can only be set before the process runs its first parallel torch operation.
+    """
+    if threads < 1:
+        try:
+            from distributed import get_worker
+
+            concurrent = get_worker().nthreads
+        except (ImportError, ValueError):
+            concurrent = 1
+        threads = max(1, (os.cpu_count() or 1) // concurrent)
+    torch.set_num_threads(threads)
+    if interop_threads > 0 and torch.get_num_interop_threads() != interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as err:
+            logging.debug(f"Inter-op threads already fixed: {err}")
+    logging.debug(
+        f"torch threads: {torch.get_num_threads()}, inter-op:"
+        f" {torch.get_num_interop_threads()}"
+    )
+
+
 def get_autoencoder_classes():
     pkdir = os.path.dirname(__file__)
     for module_loader, name, ispkg in pkgutil.iter_modules([pkdir]):
@@ -90,8 +126,8 @@ class Autoencoder_One_Six(AbsAutoencoder): #used for simulation
 
     def transform(self, X):
         # return only decoder output
-        X = Variable(torch.from_numpy(X))
-        return self(X)
+        with inference():
+            return self(torch.from_numpy(X))
 
     def forward(self, x):
         encoder_out = self.activation2(self.fc1(x))
@@ -118,8 +154,8 @@ class Autoencoder_One_Three(AbsAutoencoder): #also for simulation but isnt used
 
     def transform(self, X):
         # return only decoder output
-        X = Variable(torch.from_numpy(X))
-        return self(X)
+        with inference():
+            return self(torch.from_numpy(X))
 
     def forward(self, x):
         encoder_out = self.activation2(self.fc1(x))
@@ -148,8 +184,8 @@ class Autoencoder_Two_Ten(AbsAutoencoder):
 
     def transform(self, X):
         # return only decoder output
-        X = Variable(torch.from_numpy(X))
-        return self(X)
+        with inference():
+            return self(torch.from_numpy(X))
 
     def forward(self, x):
         x_out = self.activation2(self.fc1(x))
@@ -180,8 +216,8 @@ class Autoencoder_Two_Five(AbsAutoencoder): #also not really used
 
     def transform(self, X):
         # return only decoder output
-        X = Variable(torch.from_numpy(X))
-        return self(X)
+        with inference():
+            return self(torch.from_numpy(X))
 
     def forward(self, x):
         x_out = self.activation2(self.fc1(x))
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 18:05:37 2026
+
+@author: khs3z
+"""
+
+import copy
+import importlib.util
+import logging
+import os
+import threading
+import numpy as np
+import pandas as pd
+import torch
+import torch.nn as nn
+
+from flim.analysis.ml.autoencoder import inference
+from flim.core.modelcache import MODEL_CACHE, load_model
+
+RUNTIME_OPTIONS = ["sklearn", "torchscript", "onnx"]
+EXPORT_OPTIONS = ["None", "torchscript", "onnx"]
+EXPORT_EXTENSIONS = {"torchscript": ".pt", "onnx": ".onnx"}
+OUTPUT_NAMES = ["encoded", "decoded", "rescaled"]
+
+
+class FusedAutoencoder(nn.Module):
+    """Imputer, min-max scaler and autoencoder of a model pipeline as one module.
+
+    The forward pass returns the encoded features, the decoded features and the
+    decoded features mapped back to the range of the input.
+
+    Args:
+        pipeline (Pipeline): fitted imputer, min-max scaler and autoencoder.
+    """
+
+    def __init__(self, pipeline):
+        super().__init__()
+        imputer, scaler, ae = [step for _, step in pipeline.steps]
+        # the pipeline may be shared through the model cache, leave it untouched
+        self.ae = copy.deepcopy(ae)
+        for name, values in [
+            ("fill", imputer.statistics_),
+            ("scale", scaler.scale_),
+            ("offset", scaler.min_),
+        ]:
+            values = np.asarray(values, dtype=np.float32)
+            self.register_buffer(name, torch.from_numpy(values))
+
+    def forward(self, x):
+        x = torch.where(torch.isnan(x), self.fill, x)
+        encoded, decoded = self.ae(x * self.scale + self.offset)
+        rescaled = (decoded - self.offset) / self.scale
+        return encoded, decoded, rescaled
+
+
+def exported_file(modelfile, runtime):
+    """Returns the path of the exported graph that belongs to a model file."""
+    return os.path.splitext(modelfile)[0] + EXPORT_EXTENSIONS[runtime]
+
+
+def export_pipeline(pipeline, filename, runtime="torchscript"):
+    """Writes a model pipeline as TorchScript or ONNX graph for CPU inference.
+
+    Args:
+        pipeline (Pipeline): fitted imputer, min-max scaler and autoencoder.
+        filename (str): path of the exported graph.
+        runtime (str): 'torchscript' or 'onnx'.
+
+    Returns:
+        str: filename
+    """
+    fused = FusedAutoencoder(pipeline)
+    fused = fused.to(torch.device("cpu")).eval()
+    example = torch.zeros((2, len(fused.scale)), dtype=torch.float32)
+    # concurrent exports of the same model must not write into the same file
+    tmpfile = f"{filename}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with torch.no_grad():
+        if runtime == "onnx":
+            torch.onnx.export(
+                fused,
+                example,
+                tmpfile,
+                input_names=["input"],
+                output_names=OUTPUT_NAMES,
+                dynamic_axes={n: {0: "rows"} for n in ["input"] + OUTPUT_NAMES},
+                opset_version=11,
+            )
+        else:
+            module = torch.jit.trace(fused, example)
+            if hasattr(torch.jit, "freeze"):
+                module = torch.jit.freeze(module)
+            module.save(tmpfile)
+    os.replace(tmpfile, filename)
+    logging.info(f"Exported {runtime} model to {filename}")
+    return filename
+
+
+class PipelineRuntime:
+    """Runs the joblib dumped model pipeline."""
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.scaler = pipeline.named_steps["minmaxscaler"]
+
+    def predict(self, X):
+        """Returns encoded, decoded and rescaled decoded features of X.
+
+        Args:
+            X (numpy.ndarray): 2D float32 input features.
+
+        Returns:
+            tuple(numpy.ndarray, numpy.ndarray, numpy.ndarray): 2D arrays.
+        """
+        with inference():
+            encoded, decoded = self.pipeline.transform(X)
+        decoded = decoded.cpu().numpy()
+        encoded = encoded.reshape(len(X), -1).cpu().numpy()
+        return encoded, decoded, self.scaler.inverse_transform(decoded)
+
+
+class TorchScriptRuntime:
+    """Runs an exported TorchScript graph or a FusedAutoencoder on the CPU."""
+
+    def __init__(self, module):
+        self.module = module
+
+    def predict(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        with inference():
+            outputs = self.module(torch.from_numpy(X))
+        return tuple(o.reshape(len(X), -1).numpy() for o in outputs)
+
+
+def _load_torchscript(modelfile):
+    return TorchScriptRuntime(torch.jit.load(modelfile, map_location="cpu"))
+
+
+class OnnxRuntime:
+    """Runs an exported ONNX graph with onnxruntime."""
+
+    def __init__(self, modelfile):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = torch.get_num_threads()
+        self.session = onnxruntime.InferenceSession(
+            modelfile, options, providers=["CPUExecutionProvider"]
+        )
+
+    def predict(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        outputs = self.session.run(OUTPUT_NAMES, {"input": X})
+        return tuple(o.reshape(len(X), -1) for o in outputs)
+
+
+def onnx_available():
+    """Returns True if ONNX graphs can be exported and run.
+
+    torch.onnx.export needs the onnx package, inference needs onnxruntime.
+    """
+    return all(
+        importlib.util.find_spec(package) is not None
+        for package in ["onnx", "onnxruntime"]
+    )
+
+
+def load_runtime(modelfile, runtime="sklearn"):
+    """Returns a cached inference runtime for a model pipeline file.
+
+    Exported graphs are written next to the model file, e.g. 'AEModel_epoch0020.pt',
+    and are recreated when missing or older than the model file.
+
+    Args:
+        modelfile (str): path of a joblib dumped model pipeline.
+        runtime (str): 'sklearn', 'torchscript' or 'onnx'.
+
+    Returns:
+        object: runtime whose predict(X) returns encoded, decoded and rescaled
+            decoded features.
+    """
+    if runtime not in EXPORT_EXTENSIONS:
+        return PipelineRuntime(load_model(modelfile))
+    if runtime == "onnx" and not onnx_available():
+        logging.warning(
+            "onnx or onnxruntime is not installed, using TorchScript instead."
+        )
+        runtime = "torchscript"
+    exportfile = exported_file(modelfile, runtime)
+    if not os.path.exists(exportfile) or os.path.getmtime(
+        exportfile
+    ) < os.path.getmtime(modelfile):
+        export_pipeline(load_model(modelfile), exportfile, runtime)
+    loader = OnnxRuntime if runtime == "onnx" else _load_torchscript
+    return MODEL_CACHE.load(exportfile, loader=loader)
+
+
+def quantize_runtime(modelfile, runtime, X, tolerance=0.01, samples=10000):
+    """Quantizes the linear layers of a model to int8 for CPU inference.
+
+    The reconstruction errors of the float and the quantized model are compared on up
+    to `samples` evenly spaced rows of X, in the scaled feature space the model was
+    trained in.
+
+    Args:
+        modelfile (str): path of a joblib dumped model pipeline.
+        runtime (object): float runtime returned by load_runtime.
+        X (numpy.ndarray): 2D input features.
+        tolerance (float): accepted relative increase of the reconstruction MSE.
+        samples (int): maximum number of rows used for the comparison.
+
+    Returns:
+        tuple(object, pandas.DataFrame): the quantized runtime if the MSE increase is
+            within tolerance, otherwise runtime, and the one row accuracy report.
+    """
+    fused = FusedAutoencoder(load_model(modelfile))
+    fused = fused.to(torch.device("cpu")).eval()
+    try:
+        quantized = torch.quantization.quantize_dynamic(
+            fused, {nn.Linear}, dtype=torch.qint8
+        )
+    except RuntimeError as err:
+        logging.warning(f"Dynamic quantization not supported: {err}")
+        quantized = None
+    step = max(1, len(X) // max(samples, 1))
+    sample = np.ascontiguousarray(X[::step][:samples], dtype=np.float32)
+    fill, scale, offset = [b.numpy() for b in [fused.fill, fused.scale, fused.offset]]
+    target = np.where(np.isnan(sample), fill, sample) * scale + offset
+    float_mse = float(np.mean(np.square(runtime.predict(sample)[1] - target)))
+    quant_mse = np.nan
+    if quantized is not None:
+        qruntime = TorchScriptRuntime(quantized)
+        quant_mse = float(np.mean(np.square(qruntime.predict(sample)[1] - target)))
+    accepted = bool(quant_mse - float_mse <= tolerance * float_mse)
+    logging.info(
+        f"{os.path.basename(modelfile)}: float MSE {float_mse:.6g}, int8 MSE"
+        f" {quant_mse:.6g}, {'using' if accepted else 'discarding'} int8 model"
+    )
+    report = pd.DataFrame(
+        {
+            "Model File": [os.path.basename(modelfile)],
+            "Samples": [len(sample)],
+            "Float MSE": [float_mse],
+            "Quantized MSE": [quant_mse],
+            "MSE Delta": [quant_mse - float_mse],
+            "Tolerance": [tolerance],
+            "Quantized": ["Yes" if accepted else "No"],
+        }
+    )
+    for col in ["Model File", "Quantized"]:
+        report[col] = report[col].astype("category")
+    return (qruntime if accepted else runtime), report
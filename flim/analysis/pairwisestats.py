@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 10:12:41 2026
+
+@author: khs3z
+"""
+
+import logging
+from flim.plugin import AbstractPlugin
+from flim.analysis.ksstats import KSStatsConfigDlg
+import wx
+from importlib_resources import files
+import flim.resources
+import pandas as pd
+from flim.core.pairwise import pairwise_tests, PAIRWISE_TESTS, P_ADJUSTMENTS
+from flim.plugin import plugin
+
+
+class PairwiseStatsConfigDlg(KSStatsConfigDlg):
+    def __init__(
+        self,
+        parent,
+        title,
+        input=None,
+        selectedgrouping=["None"],
+        selectedfeatures="All",
+        comparison="Treatment",
+        alpha=0.05,
+        tests=["KS"],
+        correction="fdr_bh",
+        autosave=True,
+        working_dir="",
+    ):
+        self.tests = tests
+        self.correction = correction
+        super().__init__(
+            parent,
+            title,
+            input=input,
+            selectedgrouping=selectedgrouping,
+            selectedfeatures=selectedfeatures,
+            comparison=comparison,
+            alpha=alpha,
+            autosave=autosave,
+            working_dir=working_dir,
+        )
+
+    def get_option_panels(self):
+        osizer = super().get_option_panels()[0]
+        self.test_boxes = {}
+        for test in PAIRWISE_TESTS:
+            box = wx.CheckBox(self.panel, wx.ID_ANY, label=test)
+            box.SetValue(test in self.tests)
+            self.test_boxes[test] = box
+            osizer.Add(box, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+
+        sel_correction = self.correction
+        if sel_correction not in P_ADJUSTMENTS:
+            sel_correction = P_ADJUSTMENTS[0]
+        self.correction_combobox = wx.ComboBox(
+            self.panel,
+            wx.ID_ANY,
+            style=wx.CB_READONLY,
+            value=sel_correction,
+            choices=P_ADJUSTMENTS,
+        )
+        osizer.Add(
+            wx.StaticText(self.panel, label="Correction "),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        osizer.Add(
+            self.correction_combobox,
+            0,
+            wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        return [osizer]
+
+    def _get_selected(self):
+        params = super()._get_selected()
+        params["tests"] = [t for t, box in self.test_boxes.items() if box.GetValue()]
+        params["correction"] = self.correction_combobox.GetValue()
+        return params
+
+
+@plugin(plugintype="Analysis")
+class PairwiseStats(AbstractPlugin):
+    def __init__(self, name="Pairwise Statistics", **kwargs):
+        super().__init__(name=name, **kwargs)
+
+    def get_required_categories(self):
+        return []
+
+    def get_icon(self):
+        source = files(flim.resources).joinpath("ks.png")
+        return wx.Bitmap(str(source))
+
+    def get_required_features(self):
+        return ["any"]
+
+    def get_default_parameters(self):
+        params = super().get_default_parameters()
+        params.update(
+            {
+                "comparison": "Treatment",
+                "alpha": 0.05,
+                "tests": ["KS", "Mann-Whitney", "t-test"],
+                "correction": "fdr_bh",  # 'bonferroni', 'None'
+                "method": "auto",  # KS p-values: 'exact', 'asymp'
+                "n_jobs": 1,
+            }
+        )
+        return params
+
+    def output_definition(self):
+        return {"Table: Pairwise Stats": pd.DataFrame}
+
+    def run_configuration_dialog(self, parent, data_choices={}):
+        dlg = PairwiseStatsConfigDlg(
+            parent,
+            f"Configuration: {self.name}",
+            input=self.input,
+            selectedgrouping=self.params["grouping"],
+            selectedfeatures=self.params["features"],
+            comparison=self.params["comparison"],
+            alpha=self.params["alpha"],
+            tests=self.params["tests"],
+            correction=self.params["correction"],
+            autosave=self.params["autosave"],
+            working_dir=self.params["working_dir"],
+        )
+        if dlg.ShowModal() == wx.ID_OK:
+            results = dlg.get_selected()
+            self.params.update(results)
+            return self.params
+        else:
+            return None
+
+    def get_mapped_parameters(self):
+        # p-values are corrected across all features, do not split by feature
+        return [self.params]
+
+    def execute(self):
+        data = list(self.input.values())[0]
+        comparison = self.params["comparison"]
+        alpha = self.params["alpha"]
+        correction = self.params["correction"]
+        groups = [g for g in self.params["grouping"] if g != comparison]
+        tests = [t for t in PAIRWISE_TESTS if t in self.params["tests"]]
+        logging.debug(
+            f"Calculating {tests} for {len(self.params['features'])} features"
+        )
+        result = pairwise_tests(
+            data,
+            sorted(self.params["features"]),
+            groups=groups,
+            comparison=comparison,
+            tests=tests,
+            correction=correction,
+            ks_method=self.params["method"],
+            n_jobs=self.params["n_jobs"],
+        )
+        for test in tests:
+            pcol = f"{test} p-value"
+            if correction != "None":
+                pcol = f"{pcol} ({correction})"
+            significant = (result[pcol] < alpha).map({True: "Yes", False: "No"})
+            result[f"{test} significant (<{alpha})"] = significant.astype("category")
+        return {"Table: Pairwise Stats": result}
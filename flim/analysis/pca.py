@@ -10,7 +10,7 @@ import logging
 import wx
 import numpy as np
 import pandas as pd
-from sklearn.decomposition import PCA
+from sklearn.decomposition import PCA, IncrementalPCA
 from sklearn.preprocessing import StandardScaler
 from flim.plugin import AbstractPlugin
 from flim.gui.dialogs import BasicAnalysisConfigDlg
@@ -21,6 +21,9 @@ import flim.resources
 from flim.plugin import plugin
 
 
+SOLVER_OPTIONS = ["auto", "full", "randomized", "incremental"]
+
+
 class PCAnalysisConfigDlg(BasicAnalysisConfigDlg):
     def __init__(
         self,
@@ -34,9 +37,13 @@ class PCAnalysisConfigDlg(BasicAnalysisConfigDlg):
         keepstd=True,
         explainedhisto=False,
         n_components=None,
+        svd_solver="auto",
+        loadings=False,
         autosave=True,
         working_dir="",
     ):
+        self.svd_solver = svd_solver
+        self.loadings = loadings
         self.keeporig = keeporig
         self.keepstd = keepstd
         self.explainedhisto = explainedhisto
@@ -79,6 +86,23 @@ class PCAnalysisConfigDlg(BasicAnalysisConfigDlg):
             self.n_components_input, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        self.solver_combobox = wx.ComboBox(
+            self.panel,
+            wx.ID_ANY,
+            style=wx.CB_READONLY,
+            value=self.svd_solver,
+            choices=SOLVER_OPTIONS,
+        )
+        sizer.Add(
+            wx.StaticText(self.panel, label="Solver"),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        sizer.Add(
+            self.solver_combobox, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
         self.keeporig_cb = wx.CheckBox(
             self.panel, id=wx.ID_ANY, label="Include original data"
         )
@@ -99,6 +123,12 @@ class PCAnalysisConfigDlg(BasicAnalysisConfigDlg):
             self.explainedhisto_cb, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        self.loadings_cb = wx.CheckBox(
+            self.panel, id=wx.ID_ANY, label="Loadings table"
+        )
+        self.loadings_cb.SetValue(self.loadings)
+        sizer.Add(self.loadings_cb, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5)
+
         return [sizer]
 
     def _get_selected(self):
@@ -111,6 +141,8 @@ class PCAnalysisConfigDlg(BasicAnalysisConfigDlg):
         params["keepstd"] = self.keepstd_cb.GetValue()
         params["n_components"] = n_comps
         params["explainedhisto"] = self.explainedhisto_cb.GetValue()
+        params["svd_solver"] = self.solver_combobox.GetValue()
+        params["loadings"] = self.loadings_cb.GetValue()
 
         return params
 
@@ -146,6 +178,9 @@ class PCAnalysis(AbstractPlugin):
                 "keepstd": True,
                 "explainedhisto": False,
                 "n_components": 0.999,
+                "svd_solver": "auto",  # 'full', 'randomized', 'incremental'
+                "chunksize": 100000,
+                "loadings": False,
             }
         )
         return params
@@ -162,6 +197,8 @@ class PCAnalysis(AbstractPlugin):
             keepstd=self.params["keepstd"],
             explainedhisto=self.params["explainedhisto"],
             n_components=self.params["n_components"],
+            svd_solver=self.params["svd_solver"],
+            loadings=self.params["loadings"],
             autosave=self.params["autosave"],
             working_dir=self.params["working_dir"],
         )
@@ -173,82 +210,131 @@ class PCAnalysis(AbstractPlugin):
         return self.params
 
     def output_definition(self):
+        outputs = {"Table: PCA Components": None, "Table: PCA Explained": None}
+        if self.params["loadings"]:
+            outputs["Table: PCA Loadings"] = None
         if self.params["explainedhisto"]:
-            return {
-                "Table: PCA Components": None,
-                "Table: PCA explained": None,
-                "Plot: PCA Explained": None,
-            }
+            outputs["Plot: PCA Explained"] = None
+        return outputs
+
+    def _fit(self, values, valid):
+        """Fits the scaler and PCA model to the rows without missing values.
+
+        The 'incremental' solver feeds both models chunk by chunk and never holds a
+        complete copy of the data matrix.
+
+        Args:
+            values (pandas.DataFrame): feature columns.
+            valid (numpy.ndarray): boolean mask of rows without missing values.
+
+        Returns:
+            tuple(StandardScaler, PCA or IncrementalPCA, int, numpy.ndarray): fitted
+                scaler and PCA model, number of retained components, standardized
+                valid rows (None for the 'incremental' solver).
+        """
+        n_components = self.params["n_components"]
+        fraction = n_components is not None and 0 < n_components < 1
+        solver = self.params["svd_solver"]
+        chunksize = self.params["chunksize"]
+        scaler = StandardScaler()
+        standard_data = None
+        if solver == "incremental":
+            # balanced batches of valid rows, none smaller than half a chunk
+            rows = np.flatnonzero(valid)
+            batches = np.array_split(rows, max(1, -(-len(rows) // chunksize)))
+            for batch in batches:
+                scaler.partial_fit(values.iloc[batch].to_numpy(np.float64))
+            pca = IncrementalPCA(n_components=None if fraction else n_components)
+            for batch in batches:
+                chunk = values.iloc[batch].to_numpy(np.float64)
+                pca.partial_fit(scaler.transform(chunk))
         else:
-            return {"Table: PCA Components": None, "Table: PCA explained": None}
+            standard_data = values.to_numpy(np.float64)[valid]
+            scaler.fit(standard_data)
+            standard_data = scaler.transform(standard_data)
+            if solver == "randomized":
+                pca = PCA(
+                    n_components=None if fraction else n_components,
+                    svd_solver=solver,
+                    random_state=0,
+                )
+            else:
+                pca = PCA(n_components=n_components, svd_solver=solver)
+            pca.fit(standard_data)
+        ncomp = len(pca.components_)
+        if fraction:
+            # smallest number of components that explain the requested fraction
+            ratio_cumsum = np.cumsum(pca.explained_variance_ratio_)
+            ncomp = min(ncomp, np.searchsorted(ratio_cumsum, n_components, "right") + 1)
+        return scaler, pca, ncomp, standard_data
 
     def execute(self):
         data = list(self.input.values())[0]
         features = self.params["features"]
-        data_no_na = data[features].dropna(how="any", axis=0).reset_index()
-        if len(features) == 1:
-            # reshape 1d array
-            data_no_class = data_no_na.values.reshape((-1, 1))
-        else:
-            data_no_class = data_no_na[features].values
-        scaler = StandardScaler()
-        scaler.fit(data_no_class)
-        standard_data = scaler.transform(data_no_class)
-
-        pca_params = {k: self.params[k] for k in self.params if k in ["n_components"]}
-        pca = PCA(**pca_params)
-        principalComponents = pca.fit_transform(standard_data)
-
-        pca_df = pd.DataFrame(
-            data=principalComponents,
-            columns=["PC %d" % x for x in range(1, principalComponents.shape[1] + 1)],
-        )
-        if self.params["keeporig"] and self.params["keepstd"]:
-            standard_df = pd.DataFrame(
-                data=standard_data, columns=["%s\nstandardized" % c for c in features]
-            )
-            pca_df = pd.concat(
-                [
-                    data.select_dtypes(include="category"),
-                    data[features],
-                    standard_df,
-                    pca_df,
-                ],
-                axis=1,
-            )  # .reset_index(drop=True)
-        elif self.params["keeporig"]:
-            pca_df = pd.concat(
-                [data.select_dtypes(include="category"), data[features], pca_df], axis=1
-            )  # .reset_index(drop=True)
-        elif self.params["keepstd"]:
-            standard_df = pd.DataFrame(
-                data=standard_data, columns=["%s\nstandardized" % f for f in features]
-            )
-            pca_df = pd.concat(
-                [data.select_dtypes(include="category"), standard_df, pca_df], axis=1
-            )  # .reset_index(drop=True)
-        else:
-            pca_df = pd.concat(
-                [data.select_dtypes(include="category"), pca_df], axis=1
-            )  # .reset_index(drop=True)
+        values = data[features]
+        valid = values.notna().all(axis=1).to_numpy()
+        scaler, pca, ncomp, standard_data = self._fit(values, valid)
+        components = pca.components_[:ncomp]
+        pc_labels = ["PC %d" % x for x in range(1, ncomp + 1)]
+
+        # single preallocated block: original, standardized and transformed data
+        columns = []
+        if self.params["keeporig"]:
+            columns.extend(features)
+        if self.params["keepstd"]:
+            columns.extend(["%s\nstandardized" % f for f in features])
+        columns.extend(pc_labels)
+        # column-major so that the frame can wrap the block without a copy
+        block = np.full((len(data), len(columns)), np.nan, order="F")
+        chunksize = self.params["chunksize"]
+        offsets = np.concatenate([[0], np.cumsum(valid)])
+        for start in range(0, len(data), chunksize):
+            end = min(start + chunksize, len(data))
+            col = 0
+            if self.params["keeporig"]:
+                # original values are kept for all rows, including incomplete ones
+                block[start:end, : len(features)] = values.iloc[start:end].to_numpy(
+                    np.float64
+                )
+                col = len(features)
+            rows = slice(start, end)
+            if not valid[rows].all():
+                rows = np.flatnonzero(valid[rows]) + start
+            if standard_data is None:
+                chunk = values.iloc[rows].to_numpy(np.float64)
+                chunk = scaler.transform(chunk)
+            else:
+                chunk = standard_data[offsets[start] : offsets[end]]
+            if self.params["keepstd"]:
+                block[rows, col : col + len(features)] = chunk
+                col += len(features)
+            block[rows, col:] = (chunk - pca.mean_) @ components.T
+        pca_df = pd.concat(
+            [
+                data.select_dtypes(include="category"),
+                pd.DataFrame(block, index=data.index, columns=columns, copy=False),
+            ],
+            axis=1,
+        )
+
         pca_comp_label = "PC"
         explained_label = "explained var ratio"
         pca_explained_df = pd.DataFrame(
             data={
-                pca_comp_label: [
-                    str(c) for c in range(1, len(pca.explained_variance_ratio_) + 1)
-                ],
-                explained_label: pca.explained_variance_ratio_,
+                pca_comp_label: pd.Categorical([str(c) for c in range(1, ncomp + 1)]),
+                explained_label: pca.explained_variance_ratio_[:ncomp],
             }
         )
-        pca_explained_df[pca_comp_label] = pca_explained_df[pca_comp_label].astype(
-            "category"
-        )
 
         results = {
             "Table: PCA Components": pca_df,
             "Table: PCA Explained": pca_explained_df,
         }
+        if self.params["loadings"]:
+            loadings = components.T * np.sqrt(pca.explained_variance_[:ncomp])
+            loadings_df = pd.DataFrame(loadings, columns=pc_labels)
+            loadings_df.insert(0, "Feature", pd.Categorical(features))
+            results["Table: PCA Loadings"] = loadings_df
         if self.params["explainedhisto"]:
             plot = pca_explained_df.set_index(pca_comp_label).plot.bar()
             results["Plot: PCA Explained"] = plot.get_figure()
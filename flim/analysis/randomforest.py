@@ -8,9 +8,12 @@ Created on Wed Dec 16 14:18:30 2020
 
 import logging
 import wx
+import numpy as np
 import pandas as pd
-from sklearn.model_selection import train_test_split
+from joblib import Parallel, delayed, effective_n_jobs
+from sklearn.model_selection import train_test_split, GroupKFold, StratifiedKFold
 from sklearn.ensemble import RandomForestClassifier
+from sklearn.inspection import permutation_importance
 from sklearn import metrics
 from flim.plugin import AbstractPlugin
 from flim.gui.dialogs import BasicAnalysisConfigDlg
@@ -21,6 +24,40 @@ import flim.resources
 from flim.plugin import plugin
 
 
+def fit_fold(X, y, train, test, params, random_state=None, n_jobs=1):
+    """Trains a Random Forest on one training split and scores it on the test split.
+
+    Args:
+        X (numpy.ndarray): feature matrix.
+        y (numpy.ndarray): class labels.
+        train (numpy.ndarray): row indices of the training split.
+        test (numpy.ndarray): row indices of the test split.
+        params (dict): plugin parameters.
+        random_state (int): seed for the forest and the feature permutations.
+        n_jobs (int): number of jobs used to build the trees and permute features.
+
+    Returns:
+        tuple(float, numpy.ndarray, Bunch): accuracy, impurity-based importances,
+            permutation importances (None if disabled).
+    """
+    clf = RandomForestClassifier(
+        n_estimators=params["n_estimators"], random_state=random_state, n_jobs=n_jobs
+    )
+    clf.fit(X[train], y[train])
+    accuracy = metrics.accuracy_score(y[test], clf.predict(X[test]))
+    permutation = None
+    if params["permutation"]:
+        permutation = permutation_importance(
+            clf,
+            X[test],
+            y[test],
+            n_repeats=params["n_repeats"],
+            random_state=random_state,
+            n_jobs=n_jobs,
+        )
+    return accuracy, clf.feature_importances_, permutation
+
+
 class RandomForestConfigDlg(BasicAnalysisConfigDlg):
     def __init__(
         self,
@@ -33,6 +70,9 @@ class RandomForestConfigDlg(BasicAnalysisConfigDlg):
         importancehisto=True,
         n_estimators=100,
         test_size=0.3,
+        cv_folds=1,
+        cv_group="None",
+        permutation=False,
         autosave=True,
         working_dir="",
     ):
@@ -42,6 +82,13 @@ class RandomForestConfigDlg(BasicAnalysisConfigDlg):
             self.classifier = classifier
         else:
             self.classifier = self.classifieropts[0]
+        self.cv_groupopts = ["None"] + list(self.classifieropts)
+        if cv_group in self.cv_groupopts:
+            self.cv_group = cv_group
+        else:
+            self.cv_group = "None"
+        self.cv_folds = cv_folds
+        self.permutation = permutation
         self.importancehisto = importancehisto
         self.n_estimators = n_estimators
         self.test_size = test_size
@@ -114,6 +161,44 @@ class RandomForestConfigDlg(BasicAnalysisConfigDlg):
             self.test_size_input, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        self.cv_folds_spinner = wx.SpinCtrl(
+            self.panel, wx.ID_ANY, min=1, max=50, initial=self.cv_folds
+        )
+        sizer.Add(
+            wx.StaticText(self.panel, label="CV folds"),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        sizer.Add(
+            self.cv_folds_spinner, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
+        self.cv_group_selector = wx.ComboBox(
+            self.panel,
+            wx.ID_ANY,
+            style=wx.CB_READONLY,
+            value=self.cv_group,
+            choices=self.cv_groupopts,
+        )
+        sizer.Add(
+            wx.StaticText(self.panel, label="CV group"),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        sizer.Add(
+            self.cv_group_selector, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
+        self.permutation_cb = wx.CheckBox(
+            self.panel, id=wx.ID_ANY, label="Permutation importance"
+        )
+        self.permutation_cb.SetValue(self.permutation)
+        sizer.Add(
+            self.permutation_cb, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
+        )
+
         self.importancehisto_cb = wx.CheckBox(
             self.panel, id=wx.ID_ANY, label="Importance histogram"
         )
@@ -130,6 +215,9 @@ class RandomForestConfigDlg(BasicAnalysisConfigDlg):
         params["importancehisto"] = self.importancehisto_cb.GetValue()
         params["n_estimators"] = self.n_estimators_spinner.GetValue()
         params["test_size"] = self.test_size_input.GetValue()
+        params["cv_folds"] = self.cv_folds_spinner.GetValue()
+        params["cv_group"] = self.cv_group_selector.GetValue()
+        params["permutation"] = self.permutation_cb.GetValue()
         return params
 
 
@@ -156,6 +244,12 @@ class RandomForest(AbstractPlugin):
                 "n_estimators": 100,
                 "test_size": 0.3,
                 "importancehisto": True,
+                "cv_folds": 1,  # 1: single train/test split, >1: k-fold CV
+                "cv_group": "None",  # category, its groups are kept within a fold
+                "permutation": False,
+                "n_repeats": 10,
+                "seed": None,
+                "n_jobs": 1,
             }
         )
         return params
@@ -171,6 +265,9 @@ class RandomForest(AbstractPlugin):
             n_estimators=self.params["n_estimators"],
             test_size=self.params["test_size"],
             importancehisto=self.params["importancehisto"],
+            cv_folds=self.params["cv_folds"],
+            cv_group=self.params["cv_group"],
+            permutation=self.params["permutation"],
             autosave=self.params["autosave"],
             working_dir=self.params["working_dir"],
         )
@@ -195,6 +292,23 @@ class RandomForest(AbstractPlugin):
             return params
         return
 
+    def _splits(self, data, y):
+        """Creates the train/test row indices, one pair per fold."""
+        folds = self.params["cv_folds"]
+        seed = self.params["seed"]
+        if folds < 2:
+            train, test = train_test_split(
+                np.arange(len(y)), test_size=self.params["test_size"], random_state=seed
+            )
+            return [(train, test)]
+        cv_group = self.params["cv_group"]
+        if cv_group in data.columns:
+            # all rows of a group (e.g. FOV or Cell) are held out together
+            groups = data[cv_group].cat.codes.to_numpy()
+            return list(GroupKFold(n_splits=folds).split(y, y, groups))
+        splitter = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+        return list(splitter.split(y, y))
+
     def execute(self):
         data = list(self.input.values())[0]
         results = {}
@@ -202,37 +316,56 @@ class RandomForest(AbstractPlugin):
         data_features = [
             f for f in self.params["features"] if f not in self.params["grouping"]
         ]
-        X = data[data_features]  # Features
-        y = data[self.params["classifier"]]  # one of the categorical columns
-        # Split dataset into training set and test set
-        X_train, X_test, y_train, y_test = train_test_split(
-            X, y, test_size=self.params["test_size"]
+        X = data[data_features].to_numpy()  # Features
+        y = data[self.params["classifier"]].to_numpy()  # one of the categorical columns
+        splits = self._splits(data, y)
+        seed = self.params["seed"]
+        seeds = [None if seed is None else seed + i for i in range(len(splits))]
+        # parallelize across folds, or within the forest if there are few folds
+        n_jobs = effective_n_jobs(self.params["n_jobs"])
+        outer_jobs, inner_jobs = (n_jobs, 1) if len(splits) >= n_jobs else (1, n_jobs)
+        fits = Parallel(n_jobs=outer_jobs, prefer="threads")(
+            delayed(fit_fold)(X, y, train, test, self.params, fold_seed, inner_jobs)
+            for (train, test), fold_seed in zip(splits, seeds)
         )
-        # Create a Gaussian Classifier
-        clf = RandomForestClassifier(n_estimators=self.params["n_estimators"])
-        # Train the model using the training sets y_pred=clf.predict(X_test)
-        clf.fit(X_train, y_train)
+        accuracies = np.array([accuracy for accuracy, _, _ in fits])
+        importances = np.array([importance for _, importance, _ in fits])
+        accuracy = accuracies.mean()
 
-        y_pred = clf.predict(X_test)
-
-        accuracy = metrics.accuracy_score(y_test, y_pred)
         featurecol = "Feature"
         importance_df = pd.DataFrame(
             {
-                featurecol: self.params["features"],
-                "Importance Score": clf.feature_importances_,
+                featurecol: data_features,
+                "Importance Score": importances.mean(axis=0),
             }
         )
+        if len(fits) > 1:
+            importance_df["Importance Score Std"] = importances.std(axis=0)
+        if self.params["permutation"]:
+            permuted = np.array([p.importances_mean for _, _, p in fits])
+            importance_df["Permutation Importance"] = permuted.mean(axis=0)
+            # spread across all repeats of all folds
+            importance_df["Permutation Importance Std"] = np.concatenate(
+                [p.importances for _, _, p in fits], axis=1
+            ).std(axis=1)
         importance_df[featurecol] = importance_df[featurecol].astype("category")
         importance_df.sort_values(by="Importance Score", ascending=False, inplace=True)
         if self.params["importancehisto"]:
-            importance_plot = importance_df.set_index("Feature").plot.bar()
+            yerr = None
+            if len(fits) > 1:
+                yerr = importance_df["Importance Score Std"].to_numpy()
+            importance_plot = importance_df.set_index("Feature")[
+                ["Importance Score"]
+            ].plot.bar(yerr=yerr)
             fig = importance_plot.get_figure()
             ax = fig.get_axes()[0]
+            label = f"accuracy={accuracy:.3f}"
+            if len(fits) > 1:
+                label = f"{label}\u00b1{accuracies.std():.3f}"
             ax.text(
                 0.95,
                 0.80,
-                f"accuracy={accuracy:.3f}",
+                label,
                 horizontalalignment="right",
                 verticalalignment="center",
                 transform=ax.transAxes,
@@ -240,4 +373,22 @@ class RandomForest(AbstractPlugin):
             results["Importance Score Plot"] = fig
         # results['Accuracy'] = accuracy
         results["Importance Score Data"] = importance_df
+        if len(fits) > 1:
+            # per-fold accuracy and importance distributions, one row per feature
+            nfeatures = len(data_features)
+            fold_df = pd.DataFrame(
+                {
+                    "Fold": np.repeat(np.arange(1, len(fits) + 1), nfeatures),
+                    featurecol: np.tile(data_features, len(fits)),
+                    "Accuracy": np.repeat(accuracies, nfeatures),
+                    "n Train": np.repeat([len(tr) for tr, _ in splits], nfeatures),
+                    "n Test": np.repeat([len(te) for _, te in splits], nfeatures),
+                    "Importance Score": importances.ravel(),
+                }
+            )
+            if self.params["permutation"]:
+                fold_df["Permutation Importance"] = permuted.ravel()
+            for col in ["Fold", featurecol]:
+                fold_df[col] = fold_df[col].astype(str).astype("category")
+            results["Fold Score Data"] = fold_df
         return results
@@ -14,6 +14,7 @@ from flim.gui.dialogs import BasicAnalysisConfigDlg
 import wx
 from importlib_resources import files
 import flim.resources
+from flim.core.aggregates import group_codes
 from flim.plugin import plugin
 
 
@@ -190,34 +191,47 @@ class RelativeChange(AbstractPlugin):
         method = self.params["method"]
         allcategories = list(data.select_dtypes(["category"]).columns.values)
         features = self.params["features"]
-        grouping = list(self.params["grouping"])
         refgroup = self.params["reference_group"]
         refvalue = self.params["reference_value"]
-        if refgroup not in grouping:
-            grouping.insert(0, refgroup)
-        cols = allcategories + features
-        data = data[cols]
-
+        # reference group is constant within the reference rows
+        grouping = [g for g in self.params["grouping"] if g != refgroup]
         nonrefcategories = [c for c in allcategories if c != refgroup]
 
-        refdf = data.loc[data[refgroup] == refvalue]
-        if method == "median":
-            transdf = refdf.groupby(grouping)[features].transform("median")
-        else:
-            transdf = refdf.groupby(grouping)[features].transform("mean")
-        data = data.set_index(allcategories)
-        transdf = pd.concat([refdf[nonrefcategories], transdf], axis=1)
-        transdf = transdf.drop_duplicates()
-        transdf = transdf.set_index(nonrefcategories)
-        transdef = transdf.reindex(data.index)
-        reldf = data[features].div(transdf).reset_index()
+        # small table of reference means/medians, one row per reference group
+        isref = (data[refgroup] == refvalue).to_numpy()
+        refdata = data.loc[isref]
+        refcodes, refkeys = group_codes(refdata, grouping)
+        refstats = np.full((len(refkeys) + 1, len(features)), np.nan)
+        if isref.any():
+            grouped = refdata[features].groupby(refcodes)
+            stats = grouped.median() if method == "median" else grouped.mean()
+            stats = stats.drop(index=-1, errors="ignore")
+            refstats[stats.index.to_numpy()] = stats.to_numpy(dtype=np.float64)
+
+        # gather reference values onto rows via the category cells they belong to;
+        # cells without reference rows and rows with missing categories map to NaN
+        cellcodes, cellkeys = group_codes(data, nonrefcategories)
+        cellref = np.full(len(cellkeys) + 1, -1, dtype=np.intp)
+        cellref[cellcodes[isref]] = refcodes
+        rowref = cellref[cellcodes]
+
+        # rows ordered by category cell, original order within each cell
+        cellorder = np.where(cellcodes < 0, len(cellkeys), cellcodes)
+        order = np.argsort(cellorder, kind="stable")
+        values = data[features].to_numpy(dtype=np.float64, na_value=np.nan)
+        relvalues = np.empty((len(data), len(features)), dtype=np.float64)
+        np.divide(values[order], refstats[rowref[order]], out=relvalues)
+
+        reldf = data[allcategories].iloc[order].reset_index(drop=True)
         for ckey in allcategories:
             reldf[ckey] = reldf[ckey].astype("category")
-        columnlabels = [
-            col if col in allcategories else f"rel {col}"
-            for col in reldf.columns.values
-        ]
-        reldf.columns = columnlabels
+        reldf = pd.concat(
+            [
+                reldf,
+                pd.DataFrame(relvalues, columns=[f"rel {f}" for f in features]),
+            ],
+            axis=1,
+        )
 
         title = f"Table: Relative Change"  # -{method}'
         return {title: reldf}
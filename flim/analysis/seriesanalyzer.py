@@ -8,6 +8,7 @@ Created on Wed Dec 16 14:18:30 2020
 
 import logging
 import itertools
+import warnings
 import pandas as pd
 import matplotlib.pyplot as plt
 import wx
@@ -19,6 +20,9 @@ import flim.resources
 from flim.plugin import AbstractPlugin, plugin
 from flim.gui.dialogs import BasicAnalysisConfigDlg
 
+# 'row': one series per row, 'mean'/'median': one aggregated series per group
+SERIES_MODES = ["row", "mean", "median"]
+
 
 class SeriesAnalyzerConfigDlg(BasicAnalysisConfigDlg):
     def __init__(
@@ -40,6 +44,7 @@ class SeriesAnalyzerConfigDlg(BasicAnalysisConfigDlg):
         deltacum=True,
         deltanorm=True,
         mergeinput=False,
+        seriesmode="row",
         autosave=True,
         working_dir="",
     ):
@@ -55,11 +60,11 @@ class SeriesAnalyzerConfigDlg(BasicAnalysisConfigDlg):
         self.deltacum = deltacum
         self.deltanorm = deltanorm
         self.mergeinput = mergeinput
+        self.seriesmode = seriesmode
         super().__init__(
             parent,
             title,
             input=input,
-            enablegrouping=False,
             selectedgrouping=selectedgrouping,
             selectedfeatures=selectedfeatures,
             optgridrows=1,
@@ -155,6 +160,28 @@ class SeriesAnalyzerConfigDlg(BasicAnalysisConfigDlg):
             self.mergeinput_cb, 0, wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL, 5
         )
 
+        self.seriesmode_combobox = wx.ComboBox(
+            self.panel,
+            wx.ID_ANY,
+            style=wx.CB_READONLY,
+            value=self.seriesmode,
+            choices=SERIES_MODES,
+        )
+        modesizer = wx.BoxSizer(wx.HORIZONTAL)
+        modesizer.Add(
+            wx.StaticText(self.panel, label="Series "),
+            0,
+            wx.ALL | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        modesizer.Add(
+            self.seriesmode_combobox,
+            0,
+            wx.ALL | wx.EXPAND | wx.ALIGN_CENTER_VERTICAL,
+            5,
+        )
+        sizer.Add(modesizer, 0, wx.ALL | wx.ALIGN_CENTER_VERTICAL, 5)
+
         selectsizer = wx.BoxSizer(wx.VERTICAL)
         self.selectAllButton = wx.Button(self.panel, label="Select All")
         self.selectAllButton.Bind(wx.EVT_BUTTON, self.OnOptSelectAll)
@@ -191,6 +218,7 @@ class SeriesAnalyzerConfigDlg(BasicAnalysisConfigDlg):
         params["delta_cum"] = self.deltacum_cb.GetValue()
         params["delta_norm"] = self.deltanorm_cb.GetValue()
         params["merge_input"] = self.mergeinput_cb.GetValue()
+        params["series_mode"] = self.seriesmode_combobox.GetValue()
         return params
 
 
@@ -225,6 +253,7 @@ class SeriesAnalyzer(AbstractPlugin):
                 "delta_cum": True,
                 "delta_norm": True,
                 "merge_input": False,
+                "series_mode": "row",  # 'mean', 'median'
             }
         )
         return params
@@ -247,6 +276,7 @@ class SeriesAnalyzer(AbstractPlugin):
         deltacum = self.params["delta_cum"]
         deltanorm = self.params["delta_norm"]
         mergeinput = self.params["merge_input"]
+        seriesmode = self.params["series_mode"]
         dlg = SeriesAnalyzerConfigDlg(
             parent,
             f"Configuration: {self.name}",
@@ -265,6 +295,7 @@ class SeriesAnalyzer(AbstractPlugin):
             deltacum=deltacum,
             deltanorm=deltanorm,
             mergeinput=mergeinput,
+            seriesmode=seriesmode,
             autosave=self.params["autosave"],
             working_dir=self.params["working_dir"],
         )
@@ -275,6 +306,92 @@ class SeriesAnalyzer(AbstractPlugin):
         else:
             return None
 
+    def _series_columns(self, label, uniquef):
+        """Returns the labels of the selected output columns in output order."""
+        nsteps = len(uniquef) - 1
+        steps = [f"{uniquef[i]}:{uniquef[i+1]}" for i in range(nsteps)]
+        columns = []
+        for key, name in [
+            ("series_min", "Series min"),
+            ("series_max", "Series max"),
+            ("series_range", "Series max-min"),
+            ("series_mean", "Series mean"),
+            ("series_median", "Series median"),
+        ]:
+            if self.params[key]:
+                columns.append(f"{label}\n{name}")
+        if self.params["delta"]:
+            columns.extend([f"{label}\ndelta {s}" for s in steps])
+        if self.params["delta_cum"]:
+            columns.extend(
+                [
+                    f"{label}\ncumulative delta {uniquef[0]}:{uniquef[i+1]}"
+                    for i in range(nsteps)
+                ]
+            )
+        if self.params["delta_norm"]:
+            columns.extend([f"{label}\nnormalized delta {s}" for s in steps])
+        for key, name in [
+            ("delta_min", "delta min"),
+            ("delta_max", "delta max"),
+            ("delta_sum", "delta sum"),
+        ]:
+            if self.params[key]:
+                columns.append(f"{label}\n{name}")
+        return columns
+
+    def _series_block(self, values, block):
+        """Fills the preallocated block with the selected series statistics.
+
+        Args:
+            values (numpy.ndarray): 2D float array, one series per row.
+            block (numpy.ndarray): 2D output array, columns in the order of
+                _series_columns.
+        """
+        col = 0
+
+        def put(result):
+            nonlocal col
+            result = result.reshape(len(block), -1)
+            block[:, col : col + result.shape[1]] = result
+            col += result.shape[1]
+
+        with warnings.catch_warnings():
+            # all-NaN rows yield NaN, as in pandas
+            warnings.simplefilter("ignore", category=RuntimeWarning)
+            if self.params["series_min"] or self.params["series_range"]:
+                smin = np.nanmin(values, axis=1)
+            if self.params["series_max"] or self.params["series_range"]:
+                smax = np.nanmax(values, axis=1)
+            if self.params["series_min"]:
+                put(smin)
+            if self.params["series_max"]:
+                put(smax)
+            if self.params["series_range"]:
+                put(smax - smin)
+            if self.params["series_mean"]:
+                put(np.nanmean(values, axis=1))
+            if self.params["series_median"]:
+                put(np.nanmedian(values, axis=1))
+            delta = np.diff(values, axis=1)
+            missing = np.isnan(delta)
+            if self.params["delta"]:
+                put(delta)
+            if self.params["delta_cum"] or self.params["delta_norm"]:
+                # missing steps are skipped but stay missing, as in pandas cumsum
+                cum = np.nancumsum(delta, axis=1)
+                cum[missing] = np.nan
+            if self.params["delta_cum"]:
+                put(cum)
+            if self.params["delta_norm"]:
+                put(delta / cum[:, -1:])
+            if self.params["delta_min"]:
+                put(np.nanmin(delta, axis=1))
+            if self.params["delta_max"]:
+                put(np.nanmax(delta, axis=1))
+            if self.params["delta_sum"]:
+                put(np.nansum(delta, axis=1))
+
     def execute(self):
         data = list(self.input.values())[0]
         logging.debug(
@@ -283,77 +400,49 @@ class SeriesAnalyzer(AbstractPlugin):
         )
         results = {}
         logging.debug(f"\tcreating series analysis for {self.params['features']}")
-        categories = data.select_dtypes("category").columns.values
+        categories = list(data.select_dtypes("category").columns.values)
         features = self.params["features"]
         sfeatures = [f.split("\n") for f in features]
         common_all = set(sfeatures[0]).intersection(*sfeatures[1:])
         logging.debug(f"sfeatures: {sfeatures}")
         logging.debug(f"common_all: {common_all}")
-        #ncommon_all = list(dict.fromkeys(sfeatures[0]).intersection(*sfeatures[1:]))
         common = [
             f for f in sfeatures[0] if f in common_all
         ]  # needed to ensure maintaining propper order
         uniquef = ["\n".join([f for f in s if f not in common]) for s in sfeatures]
-        #logging.debug(f"ncommon_all: {common_all}")
         logging.debug(f"common: {common}")
         logging.debug(f"uniquef: {uniquef}")
         label = "\n".join(common)
+
+        series_mode = self.params["series_mode"]
+        grouping = [g for g in self.params["grouping"] if g in categories]
+        if series_mode != "row":
+            # one series per group, aggregated across the rows of each group
+            if len(grouping) == 0:
+                series = data[features].agg(series_mode).to_frame().T
+            else:
+                series = (
+                    data.groupby(grouping, observed=True)[features]
+                    .agg(series_mode)
+                    .reset_index()
+                )
+            categories = grouping
+        else:
+            series = data
         if self.params["merge_input"]:
-            cols = list(categories)
-            cols.extend(features)
-            df = data[cols].copy()
+            df = series[categories + list(features)].copy()
         else:
-            df = data[categories].copy()
-        if self.params["series_min"]:
-            df[f"{label}\nSeries min"] = data[features].min(axis=1)
-        if self.params["series_max"]:
-            df[f"{label}\nSeries max"] = data[features].max(axis=1)
-        if self.params["series_range"]:
-            df[f"{label}\nSeries max-min"] = data[features].max(axis=1) - data[
-                features
-            ].min(axis=1)
-        if self.params["series_mean"]:
-            df[f"{label}\nSeries mean"] = data[features].mean(axis=1)
-        if self.params["series_median"]:
-            df[f"{label}\nSeries median"] = data[features].median(axis=1)
-        if (
-            self.params["delta"]
-            or self.params["delta_max"]
-            or self.params["delta_min"]
-            or self.params["delta_sum"]
-            or self.params["delta_cum"]
-            or self.params["delta_norm"]
-        ):
-            dfdelta = data[features].diff(axis=1)
-            dfcum = dfdelta.cumsum(axis=1)
-            dfnorm = dfdelta.divide(dfcum.iloc[:, -1], axis=0)
-            uniquef.insert(0, "None")
-            dcolheaders = [
-                f"{label}\ndelta {uniquef[i]}:{uniquef[i+1]}"
-                for i in range(len(uniquef) - 1)
-            ]
-            ccolheaders = [
-                f"{label}\ncumulative delta {uniquef[1]}:{uniquef[i+1]}"
-                for i in range(len(uniquef) - 1)
-            ]
-            ncolheaders = [
-                f"{label}\nnormalized delta {uniquef[i]}:{uniquef[i+1]}"
-                for i in range(len(uniquef) - 1)
-            ]
-            dfdelta.columns = dcolheaders
-            dfcum.columns = ccolheaders
-            dfnorm.columns = ncolheaders
-            if self.params["delta"]:
-                df = df.join(dfdelta.iloc[:, 1:])
-            if self.params["delta_cum"]:
-                df = df.join(dfcum.iloc[:, 1:])
-            if self.params["delta_norm"]:
-                df = df.join(dfnorm.iloc[:, 1:])
-            if self.params["delta_min"]:
-                df[f"{label}\ndelta min"] = dfdelta.iloc[:, 1:].min(axis=1)
-            if self.params["delta_max"]:
-                df[f"{label}\ndelta max"] = dfdelta.iloc[:, 1:].max(axis=1)
-            if self.params["delta_sum"]:
-                df[f"{label}\ndelta sum"] = dfdelta.iloc[:, 1:].sum(axis=1)
+            df = series[categories].copy()
+
+        # all statistics are computed from one contiguous float matrix
+        values = np.ascontiguousarray(
+            series[features].to_numpy(dtype=np.float64, na_value=np.nan)
+        )
+        columns = self._series_columns(label, uniquef)
+        block = np.empty((len(values), len(columns)), dtype=np.float64)
+        self._series_block(values, block)
+        df = pd.concat(
+            [df, pd.DataFrame(block, index=df.index, columns=columns)], axis=1
+        )
         results["Table: Series Analysis"] = df
         return results
@@ -6,26 +6,26 @@ Created on Thu Dec 17 09:50:44 2020
 @author: khs3z
 """
 
+import itertools
 import numpy as np
 import pandas as pd
 import wx
 from collections import OrderedDict
 from importlib_resources import files
 
+from flim.core.aggregates import (
+    percentile,
+    grouped_percentiles_by_codes,
+    iter_chunks,
+    GroupedMoments,
+    GroupedQuantileSketch,
+)
 from flim.plugin import plugin, ALL_FEATURES
 from flim.plugin import AbstractPlugin
 from flim.gui.dialogs import BasicAnalysisConfigDlg
 import flim.resources
 
 
-def percentile(n):
-    def percentile_(x):
-        return np.nanpercentile(x, n)
-
-    percentile_.__name__ = "%s percentile" % n
-    return percentile_
-
-
 class SummaryStatsConfigDlg(BasicAnalysisConfigDlg):
     def __init__(
         self,
@@ -160,6 +160,9 @@ class SummaryStats(AbstractPlugin):
                 "aggs": [n for n in self.agg_functions],
                 "singledf": True,
                 "flattenindex": True,
+                "mode": "exact",  # 'streaming'
+                "chunksize": 100000,
+                "relative_accuracy": 0.01,
             }
         )
         return params
@@ -211,52 +214,151 @@ class SummaryStats(AbstractPlugin):
             # combine all features results in single df
             return [self.params]
 
+    def _split_aggs(self, aggs):
+        """Returns agg labels and percentiles (label:percentile) for selected aggs.
+
+        The median is included in the percentiles if any percentile is requested so
+        that it is extracted from the same sort or sketch.
+        """
+        funcs = [self.agg_functions[agg] for agg in aggs]
+        labels = [f if isinstance(f, str) else f.__name__ for f in funcs]
+        percentiles = {
+            f.__name__: f.percentile for f in funcs if not isinstance(f, str)
+        }
+        if len(percentiles) > 0 and "median" in labels:
+            percentiles["median"] = 50
+        return labels, percentiles
+
+    def _aggregate(self, data, grouped, features, aggs):
+        """Computes all aggregations for all features of a grouped frame.
+
+        Native aggregations run as cythonized groupby reductions. Percentiles (and the
+        median, if requested alongside) are extracted from a single sort per feature.
+
+        Args:
+            data (pandas.DataFrame): the data.
+            grouped (pandas.core.groupby.DataFrameGroupBy): grouped feature columns.
+            features (list(str)): feature columns.
+            aggs (list(str)): keys of agg_functions.
+
+        Returns:
+            dict: aggregation labels mapped to DataFrames (groups x features).
+        """
+        labels, percentiles = self._split_aggs(aggs)
+        results = {}
+        for label in labels:
+            if label not in percentiles:
+                results[label] = getattr(grouped, label)()
+        if len(percentiles) > 0:
+            codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.intp)
+            table = grouped_percentiles_by_codes(
+                data, features, codes, grouped.size().index, list(percentiles.values())
+            )
+            for label, p in percentiles.items():
+                results[label] = table.xs(p, axis=1, level=1)
+        return {label: results[label] for label in labels}
+
+    def _aggregate_streaming(self, chunks, grouping, features, aggs):
+        """Computes all aggregations chunk by chunk with mergeable accumulators.
+
+        Count, sum, mean, std, sem, min and max are exact. The median and percentiles
+        are estimated from a quantile sketch with the configured relative accuracy.
+
+        Args:
+            chunks (iterable): DataFrame chunks.
+            grouping (list(str)): category columns to group by.
+            features (list(str)): feature columns.
+            aggs (list(str)): keys of agg_functions.
+
+        Returns:
+            dict: aggregation labels mapped to DataFrames (groups x features).
+        """
+        labels, percentiles = self._split_aggs(aggs)
+        if "median" in labels:
+            percentiles["median"] = 50
+        moments = GroupedMoments(features, grouping)
+        sketch = None
+        if len(percentiles) > 0:
+            sketch = GroupedQuantileSketch(
+                features, grouping, relative_accuracy=self.params["relative_accuracy"]
+            )
+        for chunk in chunks:
+            moments.update(chunk)
+            if sketch is not None:
+                sketch.update(chunk)
+        results = moments.result()
+        if len(results) == 0:
+            # no valid groups, same empty summary as the exact mode
+            if len(grouping) > 1:
+                index = pd.MultiIndex.from_arrays([[]] * len(grouping), names=grouping)
+            elif len(grouping) == 1:
+                index = pd.Index([], name=grouping[0])
+            else:
+                index = pd.Index([], dtype=bool)
+            empty = pd.DataFrame(index=index, columns=features, dtype=np.float64)
+            return {label: empty for label in labels}
+        index = results["count"].index
+        if sketch is not None:
+            table = sketch.quantiles(list(percentiles.values()))
+            for label, p in percentiles.items():
+                results[label] = (
+                    table.xs(p, axis=1, level=1)
+                    .reindex(index=index, columns=features)
+                )
+        order = index.argsort()
+        return {label: results[label].iloc[order] for label in labels}
+
     def execute(self):
         summaries = OrderedDict()
         data = list(self.input.values())[0]
-        sel_functions = [self.agg_functions[f] for f in self.params["aggs"]]
+        streaming = self.params["mode"] == "streaming"
+        if streaming:
+            # input may be a DataFrame or an iterable of DataFrame chunks
+            chunks = iter_chunks(data, self.params["chunksize"])
+            if not isinstance(data, pd.DataFrame):
+                data = next(chunks, None)
+                if data is None:
+                    return summaries
+                chunks = itertools.chain([data], chunks)
         features = self.params["features"]
         if features == ALL_FEATURES:
             features = list(data.select_dtypes(np.number).columns.values)
         if features is None or len(features) == 0:
             return summaries
-        for header in features:
-            # categories = [col for col in self.flimanalyzer.get_importer().get_parser().get_regexpatterns()]
-            allcats = [x for x in self.params["grouping"]]
-            allcats.append(header)
-            dftitle = self._create_df_title(header)
-            if self.params["grouping"] is None or len(self.params["grouping"]) == 0:
-                # create fake group by --> creates 'index' column that needs to removed from aggregate results
-                summary = (
-                    data[allcats]
-                    .groupby(lambda _: True, group_keys=False)
-                    .agg(sel_functions)
+        grouping = self.params["grouping"]
+        if grouping is None or len(grouping) == 0:
+            grouping = []
+        if streaming:
+            aggregated = self._aggregate_streaming(
+                chunks, grouping, features, self.params["aggs"]
+            )
+        else:
+            if len(grouping) == 0:
+                # create fake group key --> creates 'True' index that is kept in results
+                grouped = data[features].groupby(
+                    np.ones(len(data), dtype=bool), group_keys=False
                 )
             else:
-                # data = data.copy()
-                # data.reset_index(inplace=True)
-                grouped_data = data[allcats].groupby(
-                    self.params["grouping"], observed=True
-                )
-                summary = grouped_data.agg(sel_functions)
-                # summary = summary.dropna()
-                summary.reset_index(inplace=True)
+                grouped = data[grouping + features].groupby(grouping, observed=True)
+            # single pass over all features, shared group factorization
+            aggregated = self._aggregate(data, grouped, features, self.params["aggs"])
+        labels = list(aggregated.keys())
+        summary = pd.concat(aggregated, axis=1).swaplevel(axis=1)
+        summary = summary.reindex(
+            columns=pd.MultiIndex.from_product([features, labels])
+        )
+
+        if self.params["singledf"]:
+            summaries[self._create_df_title(None)] = summary
+        else:
+            for header in features:
+                summaries[self._create_df_title(header)] = summary.loc[:, [header]]
+        for dftitle, summary in summaries.items():
+            if len(grouping) > 0:
+                summary = summary.reset_index()
             if self.params["flattenindex"]:
                 summary.columns = [
                     "\n".join(col).strip() for col in summary.columns.values
                 ]
-            summaries[dftitle] = summary  # .reset_index()
-        if self.params["singledf"]:
-            if len(self.params["grouping"]) > 0:
-                concat_df = pd.concat(
-                    [
-                        summaries[key].set_index(self.params["grouping"])
-                        for key in summaries
-                    ],
-                    axis=1,
-                ).reset_index()
-            else:
-                concat_df = pd.concat([summaries[key] for key in summaries], axis=1)
-            return {self._create_df_title(None): concat_df}
-        else:
-            return summaries
+            summaries[dftitle] = summary
+        return summaries
@@ -0,0 +1,622 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 09:12:05 2026
+
+@author: khs3z
+"""
+
+import logging
+import numpy as np
+import pandas as pd
+import scipy.fft
+
+
+def percentile(n):
+    """Creates an aggregation function for the n-th percentile.
+
+    The returned function can be used like any other groupby aggregation function. It
+    also carries the requested percentile as attribute so that grouped aggregations can
+    route all percentiles through a single grouped_percentiles call instead.
+
+    Args:
+        n (float): percentile, 0 <= n <= 100.
+
+    Returns:
+        function: aggregation function.
+    """
+
+    def percentile_(x):
+        return np.nanpercentile(x, n)
+
+    percentile_.__name__ = "%s percentile" % n
+    percentile_.percentile = n
+    return percentile_
+
+
+def group_codes(data, grouping):
+    """Factorizes the grouping columns into integer group ids.
+
+    Args:
+        data (pandas.DataFrame): the data.
+        grouping (list(str)): category columns to group by. An empty list assigns all
+            rows to a single group with key True.
+
+    Returns:
+        tuple(numpy.ndarray, pandas.Index): group id per row (-1 for rows with missing
+            keys), group keys in group id order.
+    """
+    if grouping is None or len(grouping) == 0:
+        return np.zeros(len(data), dtype=np.intp), pd.Index([True])
+    grouped = data[grouping].groupby(grouping, observed=True)
+    codes = grouped.ngroup().fillna(-1).to_numpy(dtype=np.intp)
+    return codes, grouped.size().index
+
+
+def sort_groups(values, codes, ngroups, dropna=True):
+    """Sorts values within each group in a single pass.
+
+    Rows without group (code -1) are dropped. Missing values are dropped unless dropna
+    is False, in which case they are sorted to the end of each group.
+
+    Args:
+        values (numpy.ndarray): 1D array of values.
+        codes (numpy.ndarray): group id per value.
+        ngroups (int): number of groups.
+        dropna (bool): drop missing values.
+
+    Returns:
+        tuple(numpy.ndarray, numpy.ndarray): values sorted by group and value, offsets
+            of length ngroups+1 so that group i spans sorted[offsets[i]:offsets[i+1]].
+    """
+    values = np.asarray(values, dtype=np.float64)
+    valid = codes >= 0
+    if dropna:
+        valid &= ~np.isnan(values)
+    values = values[valid]
+    codes = codes[valid]
+    order = np.lexsort((values, codes))
+    counts = np.bincount(codes, minlength=ngroups)
+    offsets = np.zeros(ngroups + 1, dtype=np.intp)
+    np.cumsum(counts, out=offsets[1:])
+    return values[order], offsets
+
+
+def sorted_quantiles(sortedvalues, offsets, q):
+    """Extracts quantiles from values sorted by sort_groups.
+
+    Uses linear interpolation between closest ranks like numpy.nanpercentile.
+
+    Args:
+        sortedvalues (numpy.ndarray): values sorted within groups.
+        offsets (numpy.ndarray): group offsets into sortedvalues.
+        q (list(float)): quantiles, 0 <= q <= 1.
+
+    Returns:
+        numpy.ndarray: array of shape (ngroups, len(q)); NaN for empty groups.
+    """
+    q = np.asarray(q, dtype=np.float64)
+    counts = np.diff(offsets)
+    ngroups = len(counts)
+    result = np.full((ngroups, len(q)), np.nan)
+    if len(sortedvalues) == 0 or len(q) == 0:
+        return result
+    pos = (counts[:, None] - 1) * q[None, :]
+    lower = np.floor(pos)
+    t = pos - lower
+    start = offsets[:-1, None]
+    last = len(sortedvalues) - 1
+    lo = np.clip(start + lower.astype(np.intp), 0, last)
+    hi = np.clip(start + np.ceil(pos).astype(np.intp), 0, last)
+    a = sortedvalues[lo]
+    b = sortedvalues[hi]
+    # same lerp as numpy to keep results identical to nanpercentile
+    diff = b - a
+    interp = np.where(t >= 0.5, b - diff * (1 - t), a + diff * t)
+    nonempty = counts > 0
+    result[nonempty] = interp[nonempty]
+    return result
+
+
+def grouped_percentiles(data, features, grouping=[], percentiles=[25, 50, 75]):
+    """Calculates multiple percentiles for multiple features of grouped data.
+
+    Each feature is sorted once within all groups and all requested percentiles are
+    extracted from the same sort.
+
+    Args:
+        data (pandas.DataFrame): the data.
+        features (list(str)): numeric columns.
+        grouping (list(str)): category columns to group by.
+        percentiles (list(float)): percentiles, 0 <= p <= 100.
+
+    Returns:
+        pandas.DataFrame: group keys as index, (feature, percentile) MultiIndex columns.
+    """
+    codes, keys = group_codes(data, grouping)
+    return grouped_percentiles_by_codes(data, features, codes, keys, percentiles)
+
+
+def grouped_percentiles_by_codes(data, features, codes, keys, percentiles):
+    """Calculates percentiles for precomputed group ids, see grouped_percentiles."""
+    q = np.asarray(percentiles, dtype=np.float64) / 100
+    block = np.empty((len(keys), len(features) * len(q)))
+    for i, feature in enumerate(features):
+        sortedvalues, offsets = sort_groups(
+            data[feature].to_numpy(dtype=np.float64, na_value=np.nan), codes, len(keys)
+        )
+        block[:, i * len(q) : (i + 1) * len(q)] = sorted_quantiles(
+            sortedvalues, offsets, q
+        )
+    logging.debug(f"Calculated {len(q)} percentiles for {len(features)} features")
+    columns = pd.MultiIndex.from_product([features, list(percentiles)])
+    return pd.DataFrame(block, index=keys, columns=columns)
+
+
+def bin_indices(values, edges):
+    """Assigns values to uniform bins like numpy.histogram.
+
+    Bins are half-open except for the last bin, which includes the upper edge.
+
+    Args:
+        values (numpy.ndarray): 1D float array.
+        edges (numpy.ndarray): uniformly spaced bin edges.
+
+    Returns:
+        numpy.ndarray: bin index per value, -1 for missing values and values outside
+            the range of the edges.
+    """
+    nbins = len(edges) - 1
+    first, last = edges[0], edges[-1]
+    with np.errstate(invalid="ignore"):
+        keep = (values >= first) & (values <= last)
+        indices = np.full(len(values), -1, dtype=np.intp)
+        kept = values[keep]
+        idx = ((kept - first) / (last - first) * nbins).astype(np.intp)
+        idx[idx == nbins] -= 1
+        # correct floating point rounding at the bin edges
+        idx[kept < edges[idx]] -= 1
+        idx[(kept >= edges[idx + 1]) & (idx != nbins - 1)] += 1
+    indices[keep] = idx
+    return indices
+
+
+def grouped_histograms(
+    data,
+    features,
+    grouping=[],
+    bins=100,
+    ranges={},
+    normalize=None,
+    stacked=False,
+    cumulative=False,
+    density=False,
+):
+    """Calculates histograms for multiple features of grouped data.
+
+    Groups are factorized once; the histograms of all groups of a feature are counted
+    in a single bincount over shared bin edges. The results match matplotlib's
+    Axes.hist for the same options.
+
+    Args:
+        data (pandas.DataFrame): the data.
+        features (list(str)): numeric columns.
+        grouping (list(str)): category columns to group by.
+        bins (int or dict): number of bins, or number of bins per feature.
+        ranges (dict): (min, max) bin range per feature; defaults to the value range.
+        normalize (float): if set, counts are scaled to sum to normalize over the
+            non-missing values of each group, or of all groups if stacked.
+        stacked (bool): stack the histograms of the groups.
+        cumulative (bool): accumulate counts across bins.
+        density (bool): normalize to a probability density.
+
+    Returns:
+        tuple(dict, pandas.Index): (counts, bin edges) per feature, with counts of
+            shape (groups, bins); group keys.
+    """
+    codes, keys = group_codes(data, grouping)
+    ngroups = len(keys)
+    histograms = {}
+    for feature in features:
+        values = data[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+        nbins = bins[feature] if isinstance(bins, dict) else bins
+        vrange = ranges.get(feature, (np.nanmin(values), np.nanmax(values)))
+        edges = np.histogram_bin_edges(np.empty(0), bins=nbins, range=vrange)
+        indices = bin_indices(values, edges)
+        valid = (codes >= 0) & (indices >= 0)
+        counts = np.bincount(
+            codes[valid] * nbins + indices[valid], minlength=ngroups * nbins
+        ).reshape(ngroups, nbins)
+        counts = counts.astype(np.float64)
+        if normalize is not None:
+            notna = (codes >= 0) & ~np.isnan(values)
+            totals = np.bincount(codes[notna], minlength=ngroups).astype(np.float64)
+            if stacked:
+                totals[:] = totals.sum()
+            scale = np.divide(
+                normalize, totals, out=np.zeros(ngroups), where=totals > 0
+            )
+            counts *= scale[:, np.newaxis]
+        widths = np.diff(edges)
+        if density and not stacked:
+            sums = counts.sum(axis=1, keepdims=True)
+            counts = np.divide(
+                counts, sums * widths, out=np.zeros_like(counts), where=sums > 0
+            )
+        if stacked:
+            counts = counts.cumsum(axis=0)
+            if density:
+                counts = counts / widths / counts[-1].sum()
+        if cumulative:
+            if density:
+                counts = (counts * widths).cumsum(axis=1)
+            else:
+                counts = counts.cumsum(axis=1)
+        histograms[feature] = (counts, edges)
+    logging.debug(f"Calculated {ngroups} histograms for {len(features)} features")
+    return histograms, keys
+
+
+def grouped_kde(
+    data,
+    feature,
+    grouping=[],
+    gridsize=200,
+    cut=3,
+    clip=None,
+    bw_adjust=1,
+    nbins=2048,
+):
+    """Calculates Gaussian kernel density estimates for all groups of a feature.
+
+    The values of each group are linearly binned onto a fine grid that spans the
+    group's values plus cut bandwidths, and all groups are convolved with their
+    Gaussian kernels in a single batched FFT. Groups whose bandwidth is too small
+    for their grid, e.g. because of far outliers, are evaluated directly. Bandwidth
+    (Scott's rule), support and clipping follow seaborn's kdeplot defaults; each
+    group's density is interpolated onto its own support of gridsize points.
+
+    Args:
+        data (pandas.DataFrame): the data.
+        feature (str): numeric column.
+        grouping (list(str)): category columns to group by.
+        gridsize (int): number of support points per group.
+        cut (float): support extends cut bandwidths past the extreme values.
+        clip (tuple(float, float)): limits of the support.
+        bw_adjust (float): factor applied to the bandwidth.
+        nbins (int): number of points of each group's binning grid.
+
+    Returns:
+        dict: (support, density) per group key. Groups with fewer than two distinct
+            values are omitted.
+    """
+    codes, keys = group_codes(data, grouping)
+    values = data[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+    valid = (codes >= 0) & np.isfinite(values)
+    values = values[valid]
+    codes = codes[valid]
+    groupstats = (
+        pd.Series(values)
+        .groupby(codes)
+        .agg(["count", "std", "min", "max"])
+        .reindex(np.arange(len(keys)))
+    )
+    # Scott's rule
+    nvalues = groupstats["count"].to_numpy()
+    bw = groupstats["std"].to_numpy() * nvalues ** (-1 / 5) * bw_adjust
+    lows = groupstats["min"].to_numpy() - cut * bw
+    highs = groupstats["max"].to_numpy() + cut * bw
+    # clipping limits the support only, all values contribute to the density
+    supportlows, supporthighs = lows, highs
+    if clip is not None:
+        supportlows = np.maximum(lows, clip[0])
+        supporthighs = np.minimum(highs, clip[1])
+    supports = np.linspace(supportlows, supporthighs, gridsize, axis=1)
+    singular = ~(bw > 0)
+    kdes = {}
+    if singular.all():
+        return kdes
+    sigma = np.where(singular, 1.0, bw)
+    delta = np.where(singular, 1.0, (highs - lows) / (nbins - 1))
+    # linear binning is accurate for bins much narrower than the bandwidth
+    direct = ~singular & (delta > sigma / 16)
+    binned = np.flatnonzero(~singular & ~direct)
+    order = np.argsort(codes, kind="stable")
+    bounds = np.searchsorted(codes[order], np.arange(len(keys) + 1))
+    for i in np.flatnonzero(direct):
+        groupvalues = values[order[bounds[i] : bounds[i + 1]]]
+        density = np.zeros(gridsize)
+        for start in range(0, len(groupvalues), 10000):
+            chunk = groupvalues[start : start + 10000]
+            z = (supports[i][:, np.newaxis] - chunk) / sigma[i]
+            density += np.exp(-0.5 * z**2).sum(axis=1)
+        density /= nvalues[i] * sigma[i] * np.sqrt(2 * np.pi)
+        kdes[keys[i]] = (supports[i], density)
+
+    if len(binned) > 0:
+        # linear binning of each group onto its own grid
+        compact = np.full(len(keys), -1)
+        compact[binned] = np.arange(len(binned))
+        rows = compact[codes] >= 0
+        bcodes = codes[rows]
+        # the grids span all values, clipping only absorbs rounding at the edges
+        pos = np.clip((values[rows] - lows[bcodes]) / delta[bcodes], 0, nbins - 1)
+        left = np.minimum(pos.astype(np.intp), nbins - 2)
+        frac = pos - left
+        ngroups = len(binned)
+        flat = compact[bcodes] * nbins + left
+        counts = np.bincount(
+            flat, 1 - frac, minlength=ngroups * nbins
+        ) + np.bincount(flat + 1, frac, minlength=ngroups * nbins)
+        counts = counts.reshape(ngroups, nbins)
+
+        # sampled kernels wrapped around a buffer long enough for linear convolution
+        length = scipy.fft.next_fast_len(2 * nbins)
+        offsets = np.arange(nbins) * delta[binned][:, np.newaxis]
+        groupsigma = sigma[binned][:, np.newaxis]
+        kernels = np.zeros((ngroups, length))
+        kernels[:, :nbins] = np.exp(-0.5 * (offsets / groupsigma) ** 2) / (
+            groupsigma * np.sqrt(2 * np.pi)
+        )
+        kernels[:, length - nbins + 1 :] = kernels[:, nbins - 1 : 0 : -1]
+        densities = scipy.fft.irfft(
+            scipy.fft.rfft(counts, n=length, axis=1)
+            * scipy.fft.rfft(kernels, axis=1),
+            n=length,
+            axis=1,
+        )[:, :nbins]
+        densities /= nvalues[binned][:, np.newaxis]
+
+        for j, i in enumerate(binned):
+            grid = lows[i] + np.arange(nbins) * delta[i]
+            density = np.maximum(np.interp(supports[i], grid, densities[j]), 0)
+            kdes[keys[i]] = (supports[i], density)
+    kdes = {key: kdes[key] for key in keys if key in kdes}
+    logging.debug(f"Calculated {len(kdes)} density estimates for {feature}")
+    return kdes
+
+
+def iter_chunks(data, chunksize=100000):
+    """Yields consecutive row chunks of a DataFrame.
+
+    Args:
+        data (pandas.DataFrame or iterable): data to split. Any other iterable of
+            DataFrames is passed through unchanged.
+        chunksize (int): maximum number of rows per chunk.
+
+    Yields:
+        pandas.DataFrame: chunk of rows.
+    """
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, len(data), chunksize):
+            yield data.iloc[start : start + chunksize]
+    else:
+        yield from data
+
+
+def _keys_with_level(keys, positions, values, name):
+    """Returns MultiIndex of selected group keys with an additional trailing level."""
+    keys = keys[positions]
+    if isinstance(keys, pd.MultiIndex):
+        arrays = [keys.get_level_values(i) for i in range(keys.nlevels)]
+    else:
+        arrays = [keys]
+    return pd.MultiIndex.from_arrays(arrays + [values], names=list(keys.names) + [name])
+
+
+class GroupedMoments:
+    """Mergeable per-group count, sum, mean, variance, min and max.
+
+    Chunks are reduced to per-group moments and combined with the running state using
+    the pairwise (Chan et al.) form of Welford's update, so results do not depend on
+    how rows are split across chunks or workers.
+    """
+
+    stats = ["count", "sum", "mean", "m2", "min", "max"]
+
+    def __init__(self, features, grouping=[]):
+        self.features = list(features)
+        self.grouping = list(grouping) if grouping is not None else []
+        self.index = None
+        self.values = None
+
+    def update(self, data):
+        """Adds a chunk of rows to the accumulated moments."""
+        codes, keys = group_codes(data, self.grouping)
+        shape = (len(keys), len(self.features))
+        values = {stat: np.empty(shape) for stat in self.stats}
+        for i, feature in enumerate(self.features):
+            x = data[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+            valid = (codes >= 0) & ~np.isnan(x)
+            x = x[valid]
+            c = codes[valid]
+            count = np.bincount(c, minlength=len(keys)).astype(np.float64)
+            # bincount returns integers if there are no values
+            total = np.bincount(c, weights=x, minlength=len(keys)).astype(np.float64)
+            mean = np.divide(
+                total, count, out=np.zeros_like(total), where=count > 0
+            )
+            values["count"][:, i] = count
+            values["sum"][:, i] = total
+            values["mean"][:, i] = mean
+            values["m2"][:, i] = np.bincount(
+                c, weights=(x - mean[c]) ** 2, minlength=len(keys)
+            )
+            low = np.full(len(keys), np.inf)
+            high = np.full(len(keys), -np.inf)
+            np.minimum.at(low, c, x)
+            np.maximum.at(high, c, x)
+            values["min"][:, i] = low
+            values["max"][:, i] = high
+        self._combine(keys, values)
+        return self
+
+    def merge(self, other):
+        """Merges moments accumulated by another instance, e.g. on another worker."""
+        if other.index is not None:
+            self._combine(other.index, other.values)
+        return self
+
+    def _combine(self, index, values):
+        if self.index is None:
+            self.index = index
+            self.values = {stat: v.copy() for stat, v in values.items()}
+            return
+        union = self.index.union(index)
+        a = self._align(self.index, self.values, union)
+        b = self._align(index, values, union)
+        count = a["count"] + b["count"]
+        delta = b["mean"] - a["mean"]
+        nb = np.divide(b["count"], count, out=np.zeros_like(count), where=count > 0)
+        self.values = {
+            "count": count,
+            "sum": a["sum"] + b["sum"],
+            "mean": a["mean"] + delta * nb,
+            "m2": a["m2"] + b["m2"] + delta**2 * a["count"] * nb,
+            "min": np.minimum(a["min"], b["min"]),
+            "max": np.maximum(a["max"], b["max"]),
+        }
+        self.index = union
+
+    def _align(self, index, values, union):
+        positions = union.get_indexer(index)
+        fill = {"min": np.inf, "max": -np.inf}
+        aligned = {}
+        for stat, v in values.items():
+            a = np.full((len(union), v.shape[1]), fill.get(stat, 0.0))
+            a[positions] = v
+            aligned[stat] = a
+        return aligned
+
+    def result(self):
+        """Returns count, sum, mean, std, sem, min and max.
+
+        Returns:
+            dict: statistic names mapped to DataFrames (groups x features).
+        """
+        if self.index is None:
+            return {}
+        v = self.values
+        count = v["count"]
+        empty = count == 0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            std = np.sqrt(v["m2"] / (count - 1))
+            sem = std / np.sqrt(count)
+        mean = np.where(empty, np.nan, v["mean"])
+        low = np.where(empty, np.nan, v["min"])
+        high = np.where(empty, np.nan, v["max"])
+        results = {
+            "count": count.astype(np.int64),
+            "sum": v["sum"],
+            "mean": mean,
+            "std": np.where(count > 1, std, np.nan),
+            "sem": np.where(count > 1, sem, np.nan),
+            "min": low,
+            "max": high,
+        }
+        return {
+            stat: pd.DataFrame(r, index=self.index, columns=self.features)
+            for stat, r in results.items()
+        }
+
+
+class GroupedQuantileSketch:
+    """Mergeable per-group quantile sketch with bounded relative error.
+
+    Values are counted in logarithmically sized buckets (DDSketch) so that the estimate
+    x' of the value x at the requested rank satisfies |x' - x| <= relative_accuracy * |x|.
+    Values with an absolute value below min_value are counted as zero. Bucket counts of
+    different chunks or workers are merged by addition.
+    """
+
+    def __init__(self, features, grouping=[], relative_accuracy=0.01, min_value=1e-9):
+        self.features = list(features)
+        self.grouping = list(grouping) if grouping is not None else []
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.lngamma = np.log(self.gamma)
+        self.min_value = min_value
+        # shift bucket indices so that all nonzero values map to |bucket| >= 1
+        self.offset = int(np.ceil(-np.log(min_value) / self.lngamma)) + 1
+        self.counts = {feature: None for feature in self.features}
+
+    def _buckets(self, x):
+        absx = np.abs(x)
+        k = np.ceil(np.log(np.maximum(absx, self.min_value)) / self.lngamma)
+        buckets = np.sign(x).astype(np.int64) * (k.astype(np.int64) + self.offset)
+        buckets[absx < self.min_value] = 0
+        return buckets
+
+    def _bucket_values(self, buckets):
+        k = np.abs(buckets) - self.offset
+        values = np.sign(buckets) * 2 * self.gamma ** k.astype(np.float64)
+        return values / (self.gamma + 1)
+
+    def update(self, data):
+        """Adds a chunk of rows to the sketch."""
+        codes, keys = group_codes(data, self.grouping)
+        for feature in self.features:
+            x = data[feature].to_numpy(dtype=np.float64, na_value=np.nan)
+            valid = (codes >= 0) & ~np.isnan(x)
+            counts = (
+                pd.DataFrame({"group": codes[valid], "bucket": self._buckets(x[valid])})
+                .groupby(["group", "bucket"])
+                .size()
+            )
+            index = _keys_with_level(
+                keys,
+                counts.index.get_level_values(0).to_numpy(),
+                counts.index.get_level_values(1).to_numpy(),
+                "bucket",
+            )
+            self._add(feature, pd.Series(counts.to_numpy(), index=index))
+        return self
+
+    def merge(self, other):
+        """Merges bucket counts of another sketch with identical accuracy settings."""
+        if not np.isclose(self.gamma, other.gamma) or self.offset != other.offset:
+            raise ValueError("Cannot merge sketches with different accuracy settings.")
+        for feature, counts in other.counts.items():
+            if counts is not None:
+                self._add(feature, counts)
+        return self
+
+    def _add(self, feature, counts):
+        if self.counts.get(feature) is None:
+            self.counts[feature] = counts
+        else:
+            self.counts[feature] = self.counts[feature].add(counts, fill_value=0)
+
+    def quantiles(self, percentiles):
+        """Estimates percentiles for all groups and features.
+
+        Args:
+            percentiles (list(float)): percentiles, 0 <= p <= 100.
+
+        Returns:
+            pandas.DataFrame: group keys as index, (feature, percentile) MultiIndex
+                columns.
+        """
+        q = np.asarray(percentiles, dtype=np.float64) / 100
+        frames = {}
+        for feature in self.features:
+            counts = self.counts[feature]
+            if counts is None or len(counts) == 0:
+                continue
+            counts = counts.sort_index()
+            grouped = counts.groupby(level=list(range(counts.index.nlevels - 1)))
+            gcodes = grouped.ngroup().to_numpy()
+            keys = grouped.size().index
+            cnt = counts.to_numpy(dtype=np.float64)
+            cum = np.cumsum(cnt)
+            totals = np.bincount(gcodes, weights=cnt, minlength=len(keys))
+            starts = np.concatenate([[0.0], np.cumsum(totals)[:-1]])
+            targets = starts[:, None] + q[None, :] * (totals[:, None] - 1)
+            positions = np.searchsorted(cum, targets.ravel(), side="right")
+            positions = np.minimum(positions, len(cum) - 1)
+            buckets = counts.index.get_level_values(-1).to_numpy()[positions]
+            estimates = self._bucket_values(buckets).reshape(len(keys), len(q))
+            frames[feature] = pd.DataFrame(estimates, index=keys, columns=percentiles)
+        if len(frames) == 0:
+            columns = pd.MultiIndex.from_product([self.features, list(percentiles)])
+            return pd.DataFrame(columns=columns, dtype=np.float64)
+        return pd.concat(frames, axis=1)
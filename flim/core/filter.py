@@ -7,7 +7,14 @@ Created on Fri May 18 07:53:29 2018
 """
 
 import logging
+import weakref
 import numpy as np
+import pandas as pd
+
+# code lookup tables per categorical dtype, keyed by category order and kept values;
+# unordered dtypes with reordered categories compare equal, so the code order has to
+# be part of the key. Entries are dropped together with the dtype they belong to.
+_LOOKUP_CACHE = weakref.WeakKeyDictionary()
 
 
 class Filter:
@@ -177,3 +184,123 @@ class RangeFilter(Filter):
             )
         logging.debug(f"dropped rows: {droppedrows}")
         return droppedrows
+
+
+def category_codes(data, name):
+    """Returns integer codes and the matching category values for a column.
+
+    Categorical columns expose their codes directly; other columns are factorized.
+    Missing values are encoded as -1.
+
+    Args:
+        data (pandas.DataFrame): the data.
+        name (str): column name.
+
+    Returns:
+        tuple(numpy.ndarray, pandas.Index): codes per row, category values.
+    """
+    column = data[name]
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        return column.cat.codes.to_numpy(), column.cat.categories
+    codes, uniques = pd.factorize(column)
+    return codes, pd.Index(uniques)
+
+
+class CategoryFilter(Filter):
+    """Keeps rows whose category value is in a given set of values.
+
+    Rows are evaluated on the column's integer codes through a boolean lookup table
+    indexed by code. The table has one extra trailing slot so that code -1 (missing
+    value) resolves to whether NaN is among the kept values.
+    """
+
+    def __init__(self, name="", values=[], selected=True, cache=True, params=None):
+        if params:
+            self.set_params(params)
+        else:
+            self.name = name
+            self.values = list(values)
+            self.selected = selected
+            self.cache = cache
+        self.description = ""
+
+    def get_params(self):
+        return {
+            "name": self.name,
+            "values": self.values,
+            "selected": self.selected,
+            "cache": self.cache,
+        }
+
+    def set_params(self, params):
+        self.name = params.get("name", "")
+        self.values = list(params.get("values", []))
+        self.selected = params.get("selected", True)
+        self.cache = params.get("cache", True)
+
+    def _create_lookup(self, categories):
+        lookup = np.zeros(len(categories) + 1, dtype=bool)
+        lookup[:-1] = categories.isin(self.values)
+        lookup[-1] = any(v != v for v in self.values)
+        return lookup
+
+    def get_lookup(self, data):
+        """Returns the code lookup table for this filter's column.
+
+        For categorical columns the table is cached per category order and kept
+        values, and reused by all frames that share the column's categories.
+
+        Args:
+            data (pandas.DataFrame): the data.
+
+        Returns:
+            tuple(numpy.ndarray, numpy.ndarray): codes per row, boolean lookup table.
+        """
+        codes, categories = category_codes(data, self.name)
+        if not self.cache or not isinstance(data[self.name].dtype, pd.CategoricalDtype):
+            return codes, self._create_lookup(categories)
+        dtype = data[self.name].dtype
+        tables = _LOOKUP_CACHE.setdefault(dtype, {})
+        key = (tuple(categories), dtype.ordered, frozenset(self.values))
+        table = tables.get(key)
+        if table is None:
+            table = self._create_lookup(categories)
+            table.flags.writeable = False
+            tables[key] = table
+        return codes, table
+
+    def get_mask(self, data):
+        """Returns boolean array flagging rows that are kept by this filter."""
+        if self.name not in data.columns.values:
+            return np.ones(len(data), dtype=bool)
+        codes, lookup = self.get_lookup(data)
+        return lookup[codes]
+
+    def apply_filter(self, data, inplace=True):
+        droppedrows = data.index[self.get_dropped(data)]
+        filtereddata = data.drop(droppedrows, inplace=inplace)
+        return filtereddata
+
+    def get_dropped(self, data):
+        if self.name not in data.columns.values:
+            return []
+        droppedrows = np.flatnonzero(~self.get_mask(data))
+        logging.debug(f"{self.name}: dropped rows: {droppedrows}")
+        return droppedrows
+
+
+def category_mask(data, category_filters, cache=True):
+    """Combines category filters into a single mask of kept rows.
+
+    Args:
+        data (pandas.DataFrame): the data.
+        category_filters (dict): column names mapped to lists of values to keep.
+        cache (bool): cache code lookup tables per categorical dtype.
+
+    Returns:
+        numpy.ndarray: boolean array, True for rows passing all category filters.
+    """
+    mask = np.ones(len(data), dtype=bool)
+    for name, values in category_filters.items():
+        mask &= CategoryFilter(name, values, cache=cache).get_mask(data)
+    return mask
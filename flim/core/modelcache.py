@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 16:42:10 2026
+
+@author: khs3z
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from joblib import load
+
+
+class ModelCache:
+    """Process-wide LRU cache of loaded model pipelines.
+
+    Entries are keyed by absolute path and modification time, so a model file that is
+    overwritten (e.g. by continued training) is reloaded on its next use.
+
+    Args:
+        maxsize (int): maximum number of models kept in memory.
+    """
+
+    def __init__(self, maxsize=8):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _key(self, modelfile):
+        path = os.path.abspath(modelfile)
+        return path, os.stat(path).st_mtime_ns
+
+    def load(self, modelfile, loader=load):
+        """Returns the model stored in modelfile, loading it on a cache miss.
+
+        Args:
+            modelfile (str): path of a joblib dumped model pipeline.
+            loader (callable): function that loads modelfile, e.g. for exported
+                models.
+
+        Returns:
+            object: the loaded model. It is shared with other callers and must not be
+                modified.
+        """
+        key = self._key(modelfile)
+        with self._lock:
+            if key in self._models:
+                self.hits += 1
+                self._models.move_to_end(key)
+                return self._models[key]
+            self.misses += 1
+            # drop outdated versions of the same file
+            for stale in [k for k in self._models if k[0] == key[0]]:
+                del self._models[stale]
+            model = loader(key[0])
+            self._models[key] = model
+            while len(self._models) > max(self.maxsize, 0):
+                evicted, _ = self._models.popitem(last=False)
+                logging.debug(f"Evicted model {evicted[0]} from cache.")
+            return model
+
+    def preload(self, modelfiles):
+        """Loads models ahead of use, e.g. on Dask workers via Client.run.
+
+        Args:
+            modelfiles (str or list(str)): model file path(s).
+
+        Returns:
+            int: number of models currently held in the cache.
+        """
+        if isinstance(modelfiles, str):
+            modelfiles = [modelfiles]
+        for modelfile in modelfiles:
+            self.load(modelfile)
+        return len(self._models)
+
+    def resize(self, maxsize):
+        with self._lock:
+            self.maxsize = maxsize
+            while len(self._models) > max(self.maxsize, 0):
+                self._models.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "maxsize": self.maxsize,
+            "currsize": len(self._models),
+        }
+
+
+MODEL_CACHE = ModelCache()
+
+
+def load_model(modelfile):
+    """Loads a model pipeline through the process-wide cache."""
+    return MODEL_CACHE.load(modelfile)
+
+
+def preload_models(modelfiles):
+    """Keeps models resident in this process, e.g.
+    `client.run(preload_models, modelfiles)` on all Dask workers.
+    """
+    return MODEL_CACHE.preload(modelfiles)
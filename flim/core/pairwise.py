@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 19 14:03:27 2026
+
+@author: khs3z
+"""
+
+import logging
+import math
+import numpy as np
+import pandas as pd
+from itertools import combinations
+from joblib import Parallel, delayed
+from scipy import stats
+
+from flim.core.aggregates import group_codes, sort_groups
+
+try:
+    # exact KS distribution used by scipy's ks_2samp, available since scipy 1.5
+    from scipy.stats._stats_py import _attempt_exact_2kssamp
+except ImportError:
+    try:
+        from scipy.stats.stats import _attempt_exact_2kssamp
+    except ImportError:
+        _attempt_exact_2kssamp = None
+
+# largest sample size for which 'auto' uses the exact KS distribution, same as scipy
+KS_EXACT_MAX_N = 10000
+
+
+def sorted_cells(data, feature, groups=[], comparison="", dropna=True):
+    """Sorts the feature values of all groups x comparison cells in a single pass.
+
+    Args:
+        data (pandas.DataFrame): the data.
+        feature (str): numeric column.
+        groups (list(str)): category columns defining independent groups.
+        comparison (str): category column whose values are compared within each group.
+        dropna (bool): drop missing values.
+
+    Returns:
+        dict: group key tuples mapped to dicts of comparison value: sorted values.
+            Cells without values are omitted.
+    """
+    codes, keys = group_codes(data, list(groups) + [comparison])
+    return _split_cells(data[feature], codes, keys, dropna=dropna)
+
+
+def _split_cells(column, codes, keys, dropna=True):
+    """Sorts column values by precomputed cell codes, see sorted_cells."""
+    values = column.to_numpy(dtype=np.float64, na_value=np.nan)
+    sortedvalues, offsets = sort_groups(values, codes, len(keys), dropna=dropna)
+    cells = {}
+    for i, key in enumerate(keys):
+        if offsets[i + 1] == offsets[i]:
+            continue
+        key = key if isinstance(key, tuple) else (key,)
+        cell = sortedvalues[offsets[i] : offsets[i + 1]]
+        cells.setdefault(key[:-1], {})[key[-1]] = cell
+    logging.debug(f"Sorted {column.name} into {len(keys)} cells")
+    return cells
+
+
+def ks_statistic(x, y):
+    """Calculates the two-sample Kolmogorov-Smirnov statistic for sorted samples.
+
+    Both empirical CDFs are evaluated at all pooled values by merging the sorted arrays.
+
+    Args:
+        x (numpy.ndarray): sorted sample 1.
+        y (numpy.ndarray): sorted sample 2.
+
+    Returns:
+        float: maximum absolute difference between the two empirical CDFs.
+    """
+    pooled = np.concatenate([x, y])
+    cdf1 = np.searchsorted(x, pooled, side="right") / len(x)
+    cdf2 = np.searchsorted(y, pooled, side="right") / len(y)
+    return np.max(np.abs(cdf1 - cdf2))
+
+
+def ks_2samp_sorted(x, y, method="auto"):
+    """Two-sided two-sample Kolmogorov-Smirnov test for sorted samples.
+
+    Args:
+        x (numpy.ndarray): sorted sample 1.
+        y (numpy.ndarray): sorted sample 2.
+        method (str): 'auto' uses the exact distribution if both samples have up to
+            KS_EXACT_MAX_N values, 'exact' always, 'asymp' never.
+
+    Returns:
+        tuple(float, float): statistic, p-value.
+    """
+    n1 = len(x)
+    n2 = len(y)
+    if method == "exact" or (method == "auto" and max(n1, n2) <= KS_EXACT_MAX_N):
+        if _attempt_exact_2kssamp is None:
+            ks = stats.ks_2samp(x, y, "two-sided", "exact")
+            return ks.statistic, ks.pvalue
+        g = math.gcd(n1, n2)
+        # like scipy, fall back to the asymptotic distribution if the lcm is too large
+        # or the exact calculation fails
+        if n1 // g < np.iinfo(np.int32).max / (n2 // g):
+            success, d, prob = _attempt_exact_2kssamp(
+                n1, n2, g, ks_statistic(x, y), "two-sided"
+            )
+            if success:
+                return d, np.clip(prob, 0, 1)
+        logging.debug(f"Exact KS p-value not available for n={n1}, {n2}")
+    d = ks_statistic(x, y)
+    m, n = sorted([float(n1), float(n2)], reverse=True)
+    en = m * n / (m + n)
+    return d, stats.kstwo.sf(d, np.round(en))
+
+
+# upper limit for elements of a resample batch matrix (resamples x pooled values)
+MAX_BATCH_ELEMENTS = 2**22
+
+
+def _ks_from_counts(counts1, counts2, n1, n2, ends):
+    """Calculates KS statistics for batches of resampled counts over the pooled values.
+
+    Args:
+        counts1 (numpy.ndarray): resamples x pooled values, counts in sample 1.
+        counts2 (numpy.ndarray): resamples x pooled values, counts in sample 2.
+        n1 (int): size of sample 1.
+        n2 (int): size of sample 2.
+        ends (numpy.ndarray): positions of the last element of each run of tied values.
+
+    Returns:
+        numpy.ndarray: KS statistic for each resample.
+    """
+    cdf1 = np.cumsum(counts1, axis=1)[:, ends] / n1
+    cdf2 = np.cumsum(counts2, axis=1)[:, ends] / n2
+    return np.abs(cdf1 - cdf2).max(axis=1)
+
+
+def _resample_batch(pooled_n, n1, n2, size, mode, seedseq):
+    """Draws a batch of resamples as count matrices over the sorted pooled values."""
+    rng = np.random.default_rng(seedseq)
+    if mode == "permutation":
+        # first n1 positions of each random permutation form sample 1
+        order = np.argsort(rng.random((size, pooled_n)), axis=1)[:, :n1]
+        counts1 = np.zeros((size, pooled_n), dtype=np.int64)
+        np.put_along_axis(counts1, order, 1, axis=1)
+        counts2 = 1 - counts1
+    else:
+        # bootstrap: draw both samples with replacement from the pooled values
+        rows = np.arange(size)[:, None] * pooled_n
+        idx1 = (rng.integers(0, pooled_n, (size, n1)) + rows).ravel()
+        idx2 = (rng.integers(0, pooled_n, (size, n2)) + rows).ravel()
+        counts1 = np.bincount(idx1, minlength=size * pooled_n).reshape(size, pooled_n)
+        counts2 = np.bincount(idx2, minlength=size * pooled_n).reshape(size, pooled_n)
+    return counts1, counts2
+
+
+def resampled_ks(x, y, n_resamples=1000, mode="permutation", seed=0, n_jobs=1):
+    """Calculates KS statistics for resamples of the pooled samples.
+
+    Resamples are drawn under the null hypothesis of identical distributions, either by
+    permuting the sample labels or by bootstrapping both samples from the pooled values.
+    Resamples are generated and evaluated in vectorized batches; batches may run in
+    parallel threads. Results only depend on seed, not on n_jobs.
+
+    Args:
+        x (numpy.ndarray): sorted sample 1.
+        y (numpy.ndarray): sorted sample 2.
+        n_resamples (int): number of resamples.
+        mode (str): 'permutation' or 'bootstrap'.
+        seed (int or numpy.random.SeedSequence): random seed.
+        n_jobs (int): number of threads.
+
+    Returns:
+        numpy.ndarray: KS statistic for each resample.
+    """
+    n1 = len(x)
+    n2 = len(y)
+    pooled = np.sort(np.concatenate([x, y]))
+    ends = np.flatnonzero(np.append(pooled[1:] != pooled[:-1], True))
+    batchsize = int(max(1, min(n_resamples, MAX_BATCH_ELEMENTS // len(pooled))))
+    sizes = [batchsize] * (n_resamples // batchsize)
+    if n_resamples % batchsize > 0:
+        sizes.append(n_resamples % batchsize)
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+    seeds = seed.spawn(len(sizes))
+
+    def run_batch(size, seedseq):
+        counts1, counts2 = _resample_batch(len(pooled), n1, n2, size, mode, seedseq)
+        return _ks_from_counts(counts1, counts2, n1, n2, ends)
+
+    statistics = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(run_batch)(size, seedseq) for size, seedseq in zip(sizes, seeds)
+    )
+    return np.concatenate(statistics)
+
+
+def resampled_pvalue(statistic, resampled):
+    """Returns the resampling p-value (b + 1) / (m + 1) for observed statistic.
+
+    Args:
+        statistic (float): observed statistic.
+        resampled (numpy.ndarray): statistics of m resamples, b of which are at least
+            as large as the observed statistic.
+    """
+    # tolerance guards against rounding differences between identical statistics
+    exceeding = np.count_nonzero(resampled >= statistic - 1e-12)
+    return (exceeding + 1) / (len(resampled) + 1)
+
+
+def mannwhitney_sorted(x, y):
+    """Two-sided Mann-Whitney U test for sorted samples.
+
+    U is counted directly from the sorted samples. P-values use the normal
+    approximation with tie and continuity correction; small samples without ties use
+    scipy's exact distribution.
+
+    Args:
+        x (numpy.ndarray): sorted sample 1.
+        y (numpy.ndarray): sorted sample 2.
+
+    Returns:
+        tuple(float, float): U statistic of sample 1, p-value.
+    """
+    n1 = len(x)
+    n2 = len(y)
+    pooled = np.sort(np.concatenate([x, y]))
+    tiecounts = np.diff(
+        np.flatnonzero(np.concatenate([[True], pooled[1:] != pooled[:-1], [True]]))
+    )
+    if not (n1 > 8 and n2 > 8) and np.all(tiecounts == 1):
+        mwu = stats.mannwhitneyu(x, y, alternative="two-sided")
+        return mwu.statistic, mwu.pvalue
+    below = np.searchsorted(y, x, side="left")
+    tied = np.searchsorted(y, x, side="right") - below
+    u1 = np.sum(below) + 0.5 * np.sum(tied)
+    n = n1 + n2
+    tie_term = np.sum(tiecounts.astype(np.float64) ** 3 - tiecounts)
+    sigma = np.sqrt(n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1))))
+    if sigma == 0:
+        return u1, np.nan
+    u = max(u1, n1 * n2 - u1)
+    z = (u - n1 * n2 / 2 - 0.5) / sigma
+    return u1, min(1.0, 2 * stats.norm.sf(z))
+
+
+def ttest_sorted(x, y):
+    """Two-sided Welch's t-test, see scipy.stats.ttest_ind.
+
+    Returns:
+        tuple(float, float): t statistic, p-value.
+    """
+    ttest = stats.ttest_ind(x, y, equal_var=False)
+    return ttest.statistic, ttest.pvalue
+
+
+PAIRWISE_TESTS = {
+    "KS": ks_2samp_sorted,
+    "Mann-Whitney": mannwhitney_sorted,
+    "t-test": ttest_sorted,
+}
+
+P_ADJUSTMENTS = ["None", "fdr_bh", "bonferroni"]
+
+
+def adjust_pvalues(pvalues, method="fdr_bh"):
+    """Adjusts p-values for multiple testing.
+
+    Args:
+        pvalues (numpy.ndarray): p-values; NaN values are ignored.
+        method (str): 'fdr_bh' (Benjamini-Hochberg false discovery rate),
+            'bonferroni', or 'None'.
+
+    Returns:
+        numpy.ndarray: adjusted p-values.
+    """
+    pvalues = np.asarray(pvalues, dtype=np.float64)
+    adjusted = np.full_like(pvalues, np.nan)
+    valid = ~np.isnan(pvalues)
+    p = pvalues[valid]
+    m = len(p)
+    if method == "bonferroni":
+        adjusted[valid] = np.minimum(p * m, 1.0)
+    elif method == "fdr_bh":
+        order = np.argsort(p)
+        ranked = p[order] * m / np.arange(1, m + 1)
+        # enforce monotonicity from the largest p-value down
+        ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+        p_adj = np.empty(m)
+        p_adj[order] = np.minimum(ranked, 1.0)
+        adjusted[valid] = p_adj
+    else:
+        adjusted[valid] = p
+    return adjusted
+
+
+def _feature_tests(data, feature, codes, keys, tests, dropna, ks_method):
+    """Runs all tests for all groups and comparison pairs of a single feature."""
+    cells = _split_cells(data[feature], codes, keys, dropna=dropna)
+    rows = []
+    for groupval, compgroups in cells.items():
+        for pair in combinations(compgroups.keys(), 2):
+            x = compgroups[pair[0]]
+            y = compgroups[pair[1]]
+            row = list(groupval) + [feature, pair[0], pair[1], len(x), len(y)]
+            for test in tests:
+                if test == "KS":
+                    row.extend(ks_2samp_sorted(x, y, method=ks_method))
+                else:
+                    row.extend(PAIRWISE_TESTS[test](x, y))
+            rows.append(row)
+    return rows
+
+
+def pairwise_tests(
+    data,
+    features,
+    groups=[],
+    comparison="",
+    tests=["KS"],
+    correction="fdr_bh",
+    dropna=True,
+    ks_method="auto",
+    n_jobs=1,
+):
+    """Runs statistical tests for all features and all pairs of comparison values.
+
+    The cell factorization over groups + comparison is computed once and shared by all
+    features; each feature is sorted once per cell and the sorted arrays are shared by
+    all tests. Features are processed in parallel threads. P-values of each test are
+    adjusted for multiple testing across the complete result table.
+
+    Args:
+        data (pandas.DataFrame): the data.
+        features (list(str)): numeric columns.
+        groups (list(str)): category columns defining independent groups.
+        comparison (str): category column whose values are compared within each group.
+        tests (list(str)): keys of PAIRWISE_TESTS.
+        correction (str): one of P_ADJUSTMENTS.
+        dropna (bool): drop missing values.
+        ks_method (str): p-value method for KS test, see ks_2samp_sorted.
+        n_jobs (int): number of threads.
+
+    Returns:
+        pandas.DataFrame: one row per group, feature and comparison pair.
+    """
+    groups = [g for g in groups if g != comparison]
+    codes, keys = group_codes(data, groups + [comparison])
+    featurerows = Parallel(n_jobs=n_jobs, prefer="threads")(
+        delayed(_feature_tests)(data, f, codes, keys, tests, dropna, ks_method)
+        for f in features
+    )
+    cols = groups + [
+        "Feature",
+        f"{comparison} 1",
+        f"{comparison} 2",
+        f"n ({comparison} 1)",
+        f"n ({comparison} 2)",
+    ]
+    for test in tests:
+        cols.extend([f"{test} statistic", f"{test} p-value"])
+    result = pd.DataFrame([row for rows in featurerows for row in rows], columns=cols)
+    if correction != "None":
+        for test in tests:
+            result[f"{test} p-value ({correction})"] = adjust_pvalues(
+                result[f"{test} p-value"].to_numpy(), method=correction
+            )
+    for col in groups + ["Feature", f"{comparison} 1", f"{comparison} 2"]:
+        result[col] = result[col].astype("category")
+    return result
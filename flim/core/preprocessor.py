@@ -17,14 +17,6 @@ TRP_RZERO = 2.1
 ONE_SIXTH = 1.0 / 6
 
 
-def percentile(n):
-    def percentile_(x):
-        return np.nanpercentile(x, n)
-
-    percentile_.__name__ = "%s percentile" % n
-    return percentile_
-
-
 def nadph_perc(nadph_t2):
     return ((nadph_t2 - 1500) / (4400 - 1500)) * 100
 
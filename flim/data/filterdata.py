@@ -15,7 +15,7 @@ from importlib_resources import files
 from itertools import groupby
 import numpy as np
 
-from flim.core.filter import RangeFilter
+from flim.core.filter import RangeFilter, category_mask
 from flim.plugin import plugin
 from flim.plugin import AbstractPlugin
 from flim.gui.dicttablepanel import DictTable, ListTable
@@ -169,6 +169,7 @@ class Filter(AbstractPlugin):
                 "use": True,
                 "show_dropped": False,
                 "inplace": False,
+                "cache_categories": True,
             }
         )
         return params
@@ -199,14 +200,18 @@ class Filter(AbstractPlugin):
 
     def execute(self):
         data = list(self.input.values())[0]
+        droppedrows = {}
+        # category filters only read the codes, evaluate them before copying the input
+        if len(self.params["category_filters"]) > 0:
+            keep = category_mask(
+                data,
+                self.params["category_filters"],
+                cache=self.params["cache_categories"],
+            )
+            droppedrows["category_filters"] = np.flatnonzero(~keep)
         if not self.params["inplace"]:
             data = data.copy()
 
-        droppedrows = {}
-        for cat, values in self.params["category_filters"].items():
-            drop_values = [v for v in data[cat].unique() if v not in values]
-            droppedrows[cat] = np.flatnonzero(data[cat].isin(drop_values))
-
         filter_params = {
             f["name"]: f
             for f in self._update_filter_params(data, self.params["range_filters"])